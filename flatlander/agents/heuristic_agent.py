@@ -1,7 +1,7 @@
 from flatland.envs.rail_env import RailEnv, RailEnvActions
 
 from flatlander.agents.agent import Agent
-from flatlander.envs.utils.gym_env_wrappers import possible_actions_sorted_by_distance
+from flatlander.agents.shortest_path_agent import ShortestPathAgent
 
 
 class HeuristicPriorityAgent(Agent):
@@ -20,16 +20,16 @@ class HeuristicPriorityAgent(Agent):
         if obs is not None:
             if obs[0][6] == 1 and not obs[0][5] == 1:
                 action = 1
-                action = possible_actions_sorted_by_distance(env, handle)[action - 1][0]
+                action = ShortestPathAgent.possible_actions_sorted_by_distance(env, handle)[action - 1][0]
             elif obs[0][13] == 1 and not obs[0][12] == 1:
                 action = 2
-                action = possible_actions_sorted_by_distance(env, handle)[action - 1][0]
+                action = ShortestPathAgent.possible_actions_sorted_by_distance(env, handle)[action - 1][0]
             elif obs[0][6] == 1:
                 action = 1
-                action = possible_actions_sorted_by_distance(env, handle)[action - 1][0]
+                action = ShortestPathAgent.possible_actions_sorted_by_distance(env, handle)[action - 1][0]
             elif obs[0][13] == 1:
                 action = 2
-                action = possible_actions_sorted_by_distance(env, handle)[action - 1][0]
+                action = ShortestPathAgent.possible_actions_sorted_by_distance(env, handle)[action - 1][0]
         else:
             action = RailEnvActions.MOVE_FORWARD
 
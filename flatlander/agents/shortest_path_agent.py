@@ -11,8 +11,9 @@ class ShortestPathAgent(Agent):
 
         actions = {}
 
-        for handle, obs in observation_dict.items():
-            actions[handle] = self.compute_action(obs, env, handle)
+        # the shortest paths don't depend on the observations, iterating the handles keeps lazy observations unbuilt
+        for handle in observation_dict.keys():
+            actions[handle] = self.compute_action(None, env, handle)
 
         return actions
 
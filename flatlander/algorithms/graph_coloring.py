@@ -12,6 +12,8 @@ colors_of_states = {}"""
 import random
 from typing import Dict, Any, List
 
+import numpy as np
+
 
 class GreedyGraphColoring:
 
@@ -89,3 +91,74 @@ class ShufflingGraphColoring:
             node_colors[k] = color if color is not None else colors[0]
 
         return node_colors
+
+
+class IncrementalGraphColoring:
+    """
+    Greedy graph coloring which keeps the coloring of the previous call.
+
+    Gives the same colors as GreedyGraphColoring, but only the connected components containing a node whose
+    neighbors changed since the last call are colored again. The adjacency is stored as CSR arrays.
+    """
+
+    def __init__(self, colors: List[Any]):
+        self.colors = colors
+        self.reset()
+
+    def reset(self):
+        self._nodes = None
+        self._edges = np.empty(0, dtype=np.int64)
+        self._node_colors = np.empty(0, dtype=np.int64)
+        self.recolored = 0
+
+    def color(self, nodes, neighbors: Dict[Any, Any]) -> Dict[Any, Any]:
+        nodes = list(nodes)
+        n_nodes = len(nodes)
+        node_index = {node: i for i, node in enumerate(nodes)}
+
+        src, dst = [], []
+        for i, node in enumerate(nodes):
+            for neighbor in neighbors.get(node):
+                j = node_index.get(neighbor, None)
+                if j is not None:
+                    src.append(i)
+                    dst.append(j)
+        edges = np.unique(np.array(src, dtype=np.int64) * n_nodes + np.array(dst, dtype=np.int64))
+        src, dst = edges // max(n_nodes, 1), edges % max(n_nodes, 1)
+
+        if nodes != self._nodes:
+            node_colors = np.full(n_nodes, -1, dtype=np.int64)
+            dirty = np.ones(n_nodes, dtype=bool)
+        else:
+            node_colors = self._node_colors.copy()
+            changed = np.setxor1d(edges, self._edges, assume_unique=True) // max(n_nodes, 1)
+            labels = self._components(n_nodes, src, dst)
+            dirty = np.isin(labels, labels[changed])
+
+        dirty_nodes = np.flatnonzero(dirty)
+        if len(dirty_nodes) > 0:
+            node_colors[dirty_nodes] = -1
+            indptr = np.searchsorted(src, np.arange(n_nodes + 1))
+            for i in dirty_nodes:
+                neighbor_colors = node_colors[dst[indptr[i]:indptr[i + 1]]]
+                color = 0
+                while color < len(self.colors) and np.any(neighbor_colors == color):
+                    color += 1
+                node_colors[i] = color if color < len(self.colors) else 0
+        self.recolored += len(dirty_nodes)
+
+        self._nodes = nodes
+        self._edges = edges
+        self._node_colors = node_colors
+        return {node: self.colors[c] for node, c in zip(nodes, node_colors)}
+
+    @staticmethod
+    def _components(n_nodes, src, dst) -> np.ndarray:
+        labels = np.arange(n_nodes)
+        while True:
+            prev_labels = labels.copy()
+            np.minimum.at(labels, src, labels[dst])
+            np.minimum.at(labels, dst, labels[src])
+            labels = labels[labels]
+            if np.array_equal(labels, prev_labels):
+                return labels
@@ -0,0 +1,40 @@
+#!/usr/bin/envs python
+
+import argparse
+import os
+
+from flatlander.envs import get_generator_config
+from flatlander.envs.utils.rail_bank import generate_rail_bank
+
+EXAMPLE_USAGE = """
+Example Usage:
+    python generate_rail_bank.py --generator-configs small_v0 medium_v0 --episodes 1000 --workers 8 --out ./rail_bank
+
+Train with the bank by adding `rail_bank: ./rail_bank` to the env_config.
+"""
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Pregenerates the rails, schedules and distance maps of generator configs.",
+        epilog=EXAMPLE_USAGE)
+    parser.add_argument("--generator-configs", type=str, nargs="+", required=True,
+                        help="names of the generator configs")
+    parser.add_argument("--episodes", type=int, default=1000, help="number of episodes per config")
+    parser.add_argument("--start-seed", type=int, default=1, help="reset seed of the first episode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of generating processes")
+    parser.add_argument("--out", type=str, required=True, help="root directory of the bank")
+    return parser
+
+
+def run(args):
+    for config_name in args.generator_configs:
+        path = os.path.join(args.out, config_name)
+        seeds = range(args.start_seed, args.start_seed + args.episodes)
+        bank = generate_rail_bank(get_generator_config(config_name), path, seeds, n_workers=args.workers)
+        print("Generated", len(bank), "of", args.episodes, "episodes for", config_name, "in", path)
+
+
+if __name__ == "__main__":
+    run(create_parser().parse_args())
@@ -9,8 +9,6 @@ from collections import deque
 
 import numpy as np
 import pandas as pd
-from ray.rllib.evaluation.sample_batch_builder import SampleBatchBuilder
-from ray.rllib.offline.json_writer import JsonWriter
 from utils.observation_utils import normalize_observation  # noqa
 
 from flatland.envs.agent_utils import RailAgentStatus
@@ -22,6 +20,8 @@ from flatland.envs.rail_generators import rail_from_file
 from flatland.envs.schedule_generators import schedule_from_file
 from flatland.utils.misc import str2bool
 
+from flatlander.utils.demonstrations import DemonstrationWriter, build_index
+
 imitate = True
 
 
@@ -43,8 +43,8 @@ def main(args):
         else:
             assert False, "unhandled option"
 
-    batch_builder = SampleBatchBuilder()  # or MultiAgentSampleBatchBuilder
-    writer = JsonWriter("./out/")
+    out_dir = "./out/"
+    os.makedirs(out_dir, exist_ok=True)
 
     #  Setting these 2 parameters to True can slow down training
     visuals = False
@@ -139,6 +139,8 @@ def main(args):
                     obs[a], tree_depth, observation_radius=10)
                 agent_obs_buffer[a] = agent_obs[a].copy()
 
+        writer = DemonstrationWriter(out_dir, f"Level_{trials}", obs_shape=np.shape(agent_obs_buffer[0]))
+
         # Reset score and done
         score = 0
         agent_action_buffer = np.zeros(n_agents)
@@ -177,18 +179,15 @@ def main(args):
                 if update_values[a] or done[a]:
                     start += 1
 
-                    batch_builder.add_values(
+                    writer.add(
                         t=step,
                         eps_id=trials,
-                        agent_index=0,
+                        agent_index=a,
                         obs=agent_obs_buffer[a],
                         actions=action_dict[a],
                         action_prob=1.0,  # put the true action probability
                         rewards=all_rewards[a],
-                        prev_actions=agent_action_buffer[a],
-                        prev_rewards=prev_reward[a],
                         dones=done[a],
-                        infos=info['action_required'][a],
                         new_obs=agent_obs[a])
 
                 agent_obs_buffer[a] = agent_obs[a].copy()
@@ -204,7 +203,6 @@ def main(args):
                     time.sleep(0.5)
 
             if done["__all__"] or step > max_steps:
-                writer.write(batch_builder.build_and_reset())
                 break
 
             # Collection information about training
@@ -222,6 +220,8 @@ def main(args):
                         100 * np.mean(tasks_finished / max(
                             1, env.get_num_agents()))), end=" ")
 
+        writer.close()
+
         tasks_finished = 0
         for current_agent in env.agents:
             if current_agent.status == RailAgentStatus.DONE_REMOVED:
@@ -257,6 +257,8 @@ def main(args):
 
         gc.collect()
 
+    build_index(out_dir)
+
 
 if __name__ == '__main__':
     if 'argv' in globals():
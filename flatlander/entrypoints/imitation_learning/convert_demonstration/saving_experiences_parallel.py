@@ -2,34 +2,40 @@ import argparse
 import copy
 # from gen_envs import *
 import json
+import multiprocessing
 import os
 import tarfile
+import time
 from collections import deque
 from functools import partial
 
 import numpy as np
 import pandas as pd
-import tensorflow as tf
-from ray.rllib.evaluation.sample_batch_builder import SampleBatchBuilder
-from ray.rllib.offline.json_writer import JsonWriter
-from tensorflow.python.framework.ops import enable_eager_execution
 from utils.observation_utils import normalize_observation  # noqa
 
 from flatland.core.grid import grid4
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.envs.malfunction_generators import malfunction_from_file
-from flatland.envs.observations import TreeObsForRailEnv, GlobalObsForRailEnv
+from flatland.envs.observations import TreeObsForRailEnv
 from flatland.envs.predictions import ShortestPathPredictorForRailEnv
 from flatland.envs.rail_env import RailEnv
 from flatland.envs.rail_generators import rail_from_file
 from flatland.envs.schedule_generators import schedule_from_file
 
-enable_eager_execution()
+from flatlander.envs.observations.builders.cached_global_obs import CachedGlobalObsForRailEnv
+from flatlander.envs.observations.common.transition_cache import get_padded_transition_tensor
+from flatlander.utils.demonstrations import DemonstrationWriter, build_index, load_manifest, save_manifest, \
+    is_shard_complete
 
 parser = argparse.ArgumentParser(description="Flatland Saving Experiences Parallel.")
 parser.add_argument("--single", default=False, action="store_true")
 parser.add_argument("--visual", default=False, action="store_true")
 parser.add_argument("--globalobs", default=False, action="store_true")
+parser.add_argument("--envs", default="envs-100-999/envs", help="folder of the Level_{n}.pkl files")
+parser.add_argument("--actions", default="envs-100-999/actions/envs", help="folder of the Level_{n}.json actions")
+parser.add_argument("--out", default="./out", help="dataset folder, levels already in it are skipped")
+parser.add_argument("--levels", default=[100, 999], nargs=2, type=int, metavar=("FIRST", "LAST"))
+parser.add_argument("--workers", default=None, type=int, help="worker processes, defaults to the number of cpus")
 
 ## Legacy Code for the correct expert actions
 
@@ -81,10 +87,6 @@ columns = ['Agents', 'X_DIM', 'Y_DIM', 'TRIAL_NO',
 # To disable parallel for debug purposes etc.
 parallel = True
 
-if parallel:
-    batch_builder = SampleBatchBuilder()  # or MultiAgentSampleBatchBuilder
-    writer = JsonWriter(path="./out", max_file_size=1024 * 1024 * 1024)
-
 '''
 A 2-d array matrix on-hot encoded similar to tf.one_hot function
 https://stackoverflow.com/questions/36960320/convert-a-2d-matrix-to-a-3d-one-hot-matrix-numpy/36960495
@@ -92,10 +94,10 @@ https://stackoverflow.com/questions/36960320/convert-a-2d-matrix-to-a-3d-one-hot
 
 
 def one_hot2d(arr, depth):
-    return (np.arange(depth) == arr[..., None]).astype(int)
+    return (np.arange(depth) == arr[..., None]).astype(np.float32)
 
 
-def create_global_observation(agent_obs):
+def create_global_observation(agent_obs, rail):
     # Taken from the file global_obs_model - Intended to be used with Impala/CNN Architectures
     global_obs = list(agent_obs)
     height, width = global_obs[0].shape[:2]
@@ -103,9 +105,10 @@ def create_global_observation(agent_obs):
     global_obs[1] = global_obs[1] + 1  # get rid of -1
     assert pad_height >= 0 and pad_width >= 0
 
-    final_obs = tuple([
-        np.pad(o, ((0, pad_height), (0, pad_height), (0, 0)), constant_values=0)
-        for o in global_obs
+    # the static transition map is padded once per rail
+    final_obs = tuple([get_padded_transition_tensor(rail, _max_height, _max_width)] + [
+        np.pad(o, ((0, pad_height), (0, pad_width), (0, 0)), constant_values=0)
+        for o in global_obs[1:]
     ])
 
     # observations = [tf.keras.layers.Input(shape=o.shape) for o in final_obs]
@@ -121,10 +124,7 @@ def preprocess_obs(obs):
     processed_agents_state_layers = []
     for i, feature_layer in enumerate(states):
         if i in {0, 1}:  # agent direction (categorical)
-            feature_layer = tf.one_hot(tf.cast(feature_layer, tf.int32), depth=len(grid4.Grid4TransitionsEnum) + 1,
-                                       dtype=tf.float32).numpy()
-            # Numpy Version
-            # feature_layer = one_hot2d(feature_layer, depth=len(grid4.Grid4TransitionsEnum) + 1)
+            feature_layer = one_hot2d(feature_layer.astype(np.int32), depth=len(grid4.Grid4TransitionsEnum) + 1)
         elif i in {2, 4}:  # counts
             feature_layer = np.expand_dims(np.log(feature_layer + 1), axis=-1)
         else:  # well behaved scalars
@@ -134,8 +134,13 @@ def preprocess_obs(obs):
     return np.concatenate([transition_map, targets] + processed_agents_state_layers, axis=-1)
 
 
-def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="tree", batch_builder=None, writer=None):
-    env_file = f"envs-100-999/envs/Level_{trials}.pkl"
+def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="tree", env_dir="envs-100-999/envs",
+                         actions_dir="envs-100-999/actions/envs", out_dir="./out"):
+    """
+    Replays the expert actions of a level and writes its transitions as a dataset shard. Runs in the pool workers,
+    returns the stats of the level (or None if its files are missing).
+    """
+    env_file = os.path.join(env_dir, f"Level_{trials}.pkl")
 
     # env_file = f"../env_configs/round_1-small/Test_0/Level_{trials}.mpk"
     pad_name = False
@@ -148,7 +153,7 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
     # env_file = f"./{env_names}/envs/Level_{trials}.pkl"
 
     # file = f"../env_configs/actions-small/Test_0/Level_{trials}.mpk"
-    file = f"envs-100-999/actions/envs/Level_{trials}.json"
+    file = os.path.join(actions_dir, f"Level_{trials}.json")
     # file = f"./{env_names}/actions/envs/Level_{trials}.json"
 
     if not os.path.isfile(env_file) or not os.path.isfile(file):
@@ -164,7 +169,7 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
                                                    max_depth))
 
     elif obs_type == "global":
-        obs_builder_object = GlobalObsForRailEnv()
+        obs_builder_object = CachedGlobalObsForRailEnv()
 
     env = RailEnv(width=1, height=1,
                   rail_generator=rail_from_file(env_file),
@@ -221,12 +226,15 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
     for a in range(n_agents):
         if obs[a]:
             if obs_type == "global":
-                agent_obs[a] = create_global_observation(obs[a])
+                agent_obs[a] = create_global_observation(obs[a], env.rail)
             elif obs_type == "tree":
                 agent_obs[a] = normalize_observation(
                     obs[a], tree_depth, observation_radius=10)
             agent_obs_buffer[a] = copy.copy(agent_obs[a])  # agent_obs[a].copy()
 
+    # one shard per level, it only shows up in the dataset once the level is complete
+    writer = DemonstrationWriter(out_dir, f"Level_{trials}", obs_shape=np.shape(agent_obs_buffer[0]))
+
     # Reset score and done
     score = 0
     agent_action_buffer = np.zeros(n_agents)
@@ -258,7 +266,7 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
 
             if next_obs[a] is not None:
                 if obs_type == "global":
-                    agent_obs[a] = create_global_observation(next_obs[a])
+                    agent_obs[a] = create_global_observation(next_obs[a], env.rail)
                 elif obs_type == "tree":
                     agent_obs[a] = normalize_observation(
                         next_obs[a], tree_depth, observation_radius=10)
@@ -268,18 +276,15 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
             if update_values[a] or done[a]:
                 start += 1
 
-                batch_builder.add_values(
+                writer.add(
                     t=step,
                     eps_id=trials,
-                    agent_index=0,
+                    agent_index=a,
                     obs=agent_obs_buffer[a],
                     actions=action_dict[a],
                     action_prob=1.0,  # put the true action probability
                     rewards=all_rewards[a],
-                    prev_actions=agent_action_buffer[a],
-                    prev_rewards=prev_reward[a],
                     dones=done[a],
-                    infos=info['action_required'][a],
                     new_obs=agent_obs[a])
 
             agent_obs_buffer[a] = copy.copy(agent_obs[a])  # agent_obs[a].copy()
@@ -293,23 +298,9 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
                 show=True, frames=True, show_observations=True)
 
         if done["__all__"] or step > max_steps:
-            writer.write(batch_builder.build_and_reset())
             break
 
-        # Collection information about training
-        if step % 100 == 0:
-            tasks_finished = 0
-            for current_agent in env.agents:
-                if current_agent.status == RailAgentStatus.DONE_REMOVED:
-                    tasks_finished += 1
-            print(
-                '\rTrial No {} Training {} Agents on ({},{}).\t Steps {}\t Reward: {:.3f}\t Normalized Reward: {:.3f}\tDones: {:.2f}%\t'.format(
-                    trials, env.get_num_agents(), x_dim, y_dim,
-                    step,
-                    score,
-                    score / (max_steps + n_agents),
-                    100 * np.mean(tasks_finished / max(
-                        1, env.get_num_agents()))), end=" ")
+    writer.close()
 
     tasks_finished = 0
     for current_agent in env.agents:
@@ -319,27 +310,17 @@ def generate_experiences(trials, start=0, tree_depth=2, max_depth=30, obs_type="
     reward_window.append(score)
     scores_window.append(score / (max_steps + n_agents))
 
-    data = [[n_agents, x_dim, y_dim,
-             trials,
-             np.mean(reward_window),
-             np.mean(scores_window),
-             100 * np.mean(done_window),
-             step, action_prob / np.sum(action_prob)]]
-
-    df_cur = pd.DataFrame(data, columns=columns)
-
-    print(
-        '\rTrial No {} Training {} Agents on ({},{}).\t Total Steps {}\t Reward: {:.3f}\t Normalized Reward: {:.3f}\tDones: {:.2f}%\t'.format(
-            trials, env.get_num_agents(), x_dim, y_dim,
-            step,
+    data = [n_agents, x_dim, y_dim,
+            trials,
             np.mean(reward_window),
             np.mean(scores_window),
-            100 * np.mean(done_window)))
+            100 * np.mean(done_window),
+            step, (np.array(action_prob) / np.sum(action_prob)).tolist()]
 
     if visuals:
         env_renderer.close_window()
 
-    return df_cur
+    return dict(zip(columns, data), ROWS=writer.rows)
 
 
 def main():
@@ -357,52 +338,47 @@ def main():
         global obs_type
         obs_type = "global"
 
-    if visuals:
-        from flatland.utils.rendertools import RenderTool
-
     max_depth = 30
     tree_depth = 2
-    trial_start = 100
-    n_trials = 999
     start = 0
 
-    df_all_results = pd.DataFrame(columns=columns)
-
-    all_trials = range(trial_start, n_trials + 1)
-
-    if parallel:
-        from ray.util.multiprocessing import Pool
-        print(tf.executing_eagerly(), tf.__version__)
-        pool = Pool(processes=None)
-
-        # By default, Ray uses this to determine the number of CPUs
-        # TODO: Check if splitting based on cores yields better performance
-        # Especially for cases where there are too many trials and far less cpu cores
-
-        # import psutil
-        # n_cores = psutil.cpu_count()
-        # parallel_splits = np.array_split(np.array(all_trials),n_cores)
-
-        generate_experiences_trial = partial(generate_experiences, start=start, tree_depth=tree_depth,
-                                             max_depth=max_depth, obs_type=obs_type, batch_builder=batch_builder,
-                                             writer=writer)
-
-        for df_cur in pool.map(generate_experiences_trial, all_trials):
-            if df_cur is not None:
-                df_all_results = pd.concat([df_all_results, df_cur])
-
-    else:
-
-        generate_experiences_trial = partial(generate_experiences, start=start, tree_depth=tree_depth,
-                                             max_depth=max_depth, obs_type=obs_type, batch_builder=SampleBatchBuilder(),
-                                             writer=JsonWriter(path="/", max_file_size=1024 * 1024 * 1024))
-
-        for trial in all_trials:
-            df_cur = generate_experiences_trial(trial)
-            if df_cur is not None:
-                df_all_results = pd.concat([df_all_results, df_cur])
+    # levels of earlier runs are skipped, their shards were only renamed into the dataset once complete
+    os.makedirs(args.out, exist_ok=True)
+    manifest = load_manifest(args.out)
+    all_trials = range(args.levels[0], args.levels[1] + 1)
+    trials = [trial for trial in all_trials if not is_shard_complete(args.out, f"Level_{trial}", manifest)]
+    print(f"Converting {len(trials)} levels, {len(all_trials) - len(trials)} already converted")
+
+    generate_experiences_trial = partial(generate_experiences, start=start, tree_depth=tree_depth,
+                                         max_depth=max_depth, obs_type=obs_type, env_dir=args.envs,
+                                         actions_dir=args.actions, out_dir=args.out)
+
+    # observations are computed and normalized in the workers, only the level stats come back
+    pool = multiprocessing.Pool(processes=args.workers) if parallel else None
+    results = pool.imap_unordered(generate_experiences_trial, trials) if parallel \
+        else map(generate_experiences_trial, trials)
+
+    start_time = time.time()
+    steps, converted = 0, 0
+    for i, level_stats in enumerate(results):
+        if level_stats is not None:
+            manifest[f"Level_{level_stats['TRIAL_NO']}"] = level_stats
+            save_manifest(args.out, manifest)
+            steps += level_stats['STEPS']
+            converted += 1
+        elapsed = time.time() - start_time
+        print('\rLevels {}/{} ({} converted)\t{:.0f} steps/s\t{:.1f} levels/min'.format(
+            i + 1, len(trials), converted, steps / elapsed, 60 * converted / elapsed), end=" ")
+    print()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    build_index(args.out)
 
     if imitate:
+        df_all_results = pd.DataFrame([[stats[c] for c in columns] for stats in manifest.values()], columns=columns)
         df_all_results.to_csv(
             f'TreeImitationLearning_DQN_TrainingResults.csv', index=False)
 
@@ -1,19 +1,27 @@
 import argparse as ap
+import hashlib
 import json
+import multiprocessing
 import os
 import random
 import sys
+import time
+from functools import partial
 
 import msgpack
+import numpy as np
 from PIL import Image
 
 from flatland.envs.malfunction_generators import malfunction_from_params, MalfunctionParameters
 from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.persistence import RailEnvPersister
 from flatland.envs.rail_env import RailEnv
-from flatland.envs.rail_generators import sparse_rail_generator
-from flatland.envs.schedule_generators import sparse_schedule_generator
+from flatland.envs.rail_generators import sparse_rail_generator, rail_from_file
+from flatland.envs.schedule_generators import sparse_schedule_generator, schedule_from_file
 from flatland.utils.rendertools import RenderTool
 
+HASH_INDEX_FILE = "hashes.json"
+
 
 def RandomTestParams(tid):
     seed = tid * 19997 + 997
@@ -64,7 +72,7 @@ def ShouldRunTest(tid):
     return True
 
 
-def create_test_env(fnParams, nTest, sDir):
+def generate_test_env(fnParams, nTest):
     (seed, width, height,
      nr_trains, nr_cities,
      max_rails_between_cities, max_rails_in_cities,
@@ -120,13 +128,18 @@ def create_test_env(fnParams, nTest, sDir):
             height += 5
             print("Try again with larger envs: (w,h):", width, height)
 
+    return env
+
+
+def create_test_env(fnParams, nTest, sDir):
+    env = generate_test_env(fnParams, nTest)
+
     if not os.path.exists(sDir):
         os.makedirs(sDir)
 
     sfName = "{}/Level_{}.mpk".format(sDir, nTest)
-    if os.path.exists(sfName):
-        os.remove(sfName)
-    env.save(sfName)
+    with open(sfName, "wb") as fEnv:
+        fEnv.write(envToMsgpack(env))
 
     sys.stdout.write("")
     sys.stdout.flush()
@@ -136,27 +149,95 @@ def create_test_env(fnParams, nTest, sDir):
 
 # envs = create_test_env(RandomTestParams_small, 0, "train-envs-small/Test_0")
 
-def createEnvSet(nStart, nEnd, sDir, bSmall=True):
-    # print("Generate small envs in train-envs-small:")
-    print(f"Generate envs (small={bSmall}) in dir {sDir}:")
+def envToMsgpack(env):
+    """
+    The env as saved by RailEnvPersister to a .mpk file, with the numpy scalars of the agents converted.
+    """
+    return msgpack.packb(RailEnvPersister.get_full_state(env),
+                         default=lambda o: o.item() if isinstance(o, np.generic) else o)
+
+
+def generateLevel(nTest, fnParams):
+    """
+    Generates a level in a worker, returns its msgpack file content (as saved by RailEnvPersister) and its hash.
+    All randomness of a level comes from its test id, so the partitioning over the workers does not matter.
+    """
+    env = generate_test_env(fnParams, nTest)
+    data = envToMsgpack(env)
+    return nTest, hashlib.sha1(data).hexdigest(), data
+
 
-    sDirImages = "train-envs-small/images/"
-    if not os.path.exists(sDirImages):
-        os.makedirs(sDirImages)
+def renderLevel(sfEnv, sDirImages):
+    env = RailEnv(width=1, height=1, rail_generator=rail_from_file(sfEnv),
+                  schedule_generator=schedule_from_file(sfEnv))
+    env.reset()
 
-    for test_id in range(nStart, nEnd, 1):
-        env = create_test_env(RandomTestParams_small, test_id, sDir)
+    oRender = RenderTool(env, gl="PILSVG")
+    oRender.render_env()
+    imgPIL = Image.fromarray(oRender.get_image())
+    imgPIL.save(os.path.join(sDirImages, os.path.basename(sfEnv).replace(".mpk", ".png")))
 
-        oRender = RenderTool(env, gl="PILSVG")
 
-        # oRender.envs = envs
-        # oRender.set_new_rail()
-        oRender.render_env()
-        g2img = oRender.get_image()
-        imgPIL = Image.fromarray(g2img)
-        # imgPIL.show()
+def loadHashIndex(sDir):
+    sfIndex = os.path.join(sDir, HASH_INDEX_FILE)
+    if not os.path.exists(sfIndex):
+        return {}
+    with open(sfIndex) as fIndex:
+        return json.load(fIndex)
 
-        imgPIL.save(sDirImages + "Level_{}.png".format(test_id))
+
+def saveHashIndex(sDir, dHashes):
+    sfIndex = os.path.join(sDir, HASH_INDEX_FILE)
+    with open(sfIndex + ".tmp", "w") as fIndex:
+        json.dump(dHashes, fIndex)
+    os.replace(sfIndex + ".tmp", sfIndex)
+
+
+def createEnvSet(nStart, nEnd, sDir, bSmall=True, nWorkers=None, bRender=True):
+    """
+    Generates the levels nStart..nEnd-1 over a process pool, then renders them in a second stage. Levels are
+    written as Level_{n}.mpk, levels with the same content as an existing level are skipped (hashes.json keeps the
+    content hash of every level), as are levels of an earlier run.
+    """
+    print(f"Generate envs (small={bSmall}) in dir {sDir}:")
+    if not os.path.exists(sDir):
+        os.makedirs(sDir)
+
+    dHashes = loadHashIndex(sDir)
+    setDone = set(dHashes.values())
+    lTests = [test_id for test_id in range(nStart, nEnd, 1) if "Level_{}.mpk".format(test_id) not in setDone]
+    print(f"Generating {len(lTests)} levels, {nEnd - nStart - len(lTests)} already generated")
+
+    fnParams = RandomTestParams_small if bSmall else RandomTestParams
+    nDuplicates = 0
+    t0 = time.time()
+    with multiprocessing.Pool(processes=nWorkers) as pool:
+        for i, (test_id, sHash, data) in enumerate(pool.imap_unordered(partial(generateLevel, fnParams=fnParams),
+                                                                        lTests)):
+            if sHash in dHashes:
+                nDuplicates += 1
+                print(f"\nLevel {test_id} is a duplicate of {dHashes[sHash]}, skipped")
+            else:
+                sfName = "Level_{}.mpk".format(test_id)
+                with open(os.path.join(sDir, sfName + ".tmp"), "wb") as fEnv:
+                    fEnv.write(data)
+                os.replace(os.path.join(sDir, sfName + ".tmp"), os.path.join(sDir, sfName))
+                dHashes[sHash] = sfName
+                saveHashIndex(sDir, dHashes)
+            sys.stdout.write("\rGenerated {}/{} levels\t{:.1f} levels/min".format(
+                i + 1, len(lTests), 60 * (i + 1) / (time.time() - t0)))
+            sys.stdout.flush()
+    print(f"\n{nDuplicates} duplicates")
+
+    if bRender:
+        sDirImages = os.path.join(sDir, "images")
+        if not os.path.exists(sDirImages):
+            os.makedirs(sDirImages)
+        lEnvs = [os.path.join(sDir, sfName) for sfName in sorted(dHashes.values())
+                 if not os.path.exists(os.path.join(sDirImages, sfName.replace(".mpk", ".png")))]
+        print(f"Rendering {len(lEnvs)} levels to {sDirImages}")
+        with multiprocessing.Pool(processes=nWorkers) as pool:
+            pool.map(partial(renderLevel, sDirImages=sDirImages), lEnvs)
 
     # print("Generate large envs in train-envs-1000:")
 
@@ -213,7 +294,14 @@ def main2():
                         metavar=("nStart", "nEnd"),
                         help='merge episode into envs')
 
-    parser.add_argument("-d", "--outDir", type=str, nargs=1, default="./round_1-tmp")
+    parser.add_argument("-d", "--outDir", type=str, default="./round_1-tmp")
+
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help='worker processes for generating and rendering, defaults to the number of cpus')
+
+    parser.add_argument("-l", "--large", action="store_true", help='generate with RandomTestParams')
+
+    parser.add_argument("--noRender", action="store_true", help='only generate the envs')
 
     parser.add_argument("-m", '--merge', type=str, nargs=3, action="append",
                         metavar=("episode", "envs", "output_env"),
@@ -246,7 +334,8 @@ def main2():
 
     if args.createEnvs:
         print("create Envs - ", *args.createEnvs[0])
-        createEnvSet(*args.createEnvs[0], sDir=args.outDir)
+        createEnvSet(*args.createEnvs[0], sDir=args.outDir, bSmall=not args.large, nWorkers=args.workers,
+                     bRender=not args.noRender)
 
 
 if __name__ == "__main__":
@@ -16,11 +16,14 @@ import yaml
 from ray.rllib.agents.registry import get_agent_class
 from ray.rllib.env import MultiAgentEnv
 from ray.rllib.env.base_env import _DUMMY_AGENT_ID
+from ray.rllib.env.env_context import EnvContext
 from ray.rllib.policy.sample_batch import DEFAULT_POLICY_ID
-from ray.rllib.utils.space_utils import flatten_to_single_ndarray
+from ray.rllib.utils.space_utils import flatten_to_single_ndarray, clip_action
+from ray.tune.registry import _global_registry, ENV_CREATOR
 from ray.tune.utils import merge_dicts
 
-from flatlander.utils.loader import load_envs, load_models
+from flatlander.utils.loader import load_envs, load_models, custom_model_names
+from flatlander.utils.rollout_stream import RolloutStreamWriter
 
 logger = logging.getLogger(__name__)
 
@@ -37,19 +40,22 @@ python rollout.py /Users/flaurent/Sites/flatland/flatland-checkpoints/checkpoint
 python rollout.py /Users/flaurent/Sites/flatland/flatland-checkpoints/checkpoint_940/checkpoint-940 --run APEX --no-render --episodes 1000 --envs 'flatland_sparse' --config '{"env_config": {"test": "true", "generator": "sparse_rail_generator", "generator_config": "small_v0", "observation": "tree", "observation_config": {"max_depth": 2, "shortest_path_max_depth": 30}}, "model": {"fcnet_activation": "relu", "fcnet_hiddens": [256, 256], "vf_share_layers": "True"}}' 
 """
 
-# Register all necessary assets in tune registries
+# Register all necessary assets in tune registries, the models are loaded once the config is known
 load_envs(os.path.dirname(__file__))  # Load envs
-load_envs(os.path.dirname(__file__))  # Load models
 
 
 class RolloutSaver:
     """Utility class for storing rollouts.
 
-    Currently supports two behaviours: the original, which
+    Currently supports three behaviours: the original, which
     simply dumps everything to a pickle file once complete,
-    and a mode which stores each rollout as an entry in a Python
-    shelf db file. The latter mode is more robust to memory problems
-    or crashes part-way through the rollout generation. Each rollout
+    a mode which stores each rollout as an entry in a Python
+    shelf db file, and a mode which streams the steps as they come
+    to compressed segment files in the outfile folder (see
+    flatlander.utils.rollout_stream, read them with
+    iter_rollout_stream). The latter modes are more robust to memory
+    problems or crashes part-way through the rollout generation,
+    streaming only keeps one chunk of steps in memory. Each rollout
     is stored with a key based on the episode number (0-indexed),
     and the number of episodes is stored with the key "num_episodes",
     so to load the shelf file, use something like:
@@ -67,10 +73,13 @@ class RolloutSaver:
                  write_update_file=False,
                  target_steps=None,
                  target_episodes=None,
-                 save_info=False):
+                 save_info=False,
+                 use_stream=False):
         self._outfile = outfile
         self._update_file = None
         self._use_shelve = use_shelve
+        self._use_stream = use_stream
+        self._stream = None
         self._write_update_file = write_update_file
         self._shelf = None
         self._num_episodes = 0
@@ -91,7 +100,10 @@ class RolloutSaver:
 
     def __enter__(self):
         if self._outfile:
-            if self._use_shelve:
+            if self._use_stream:
+                # Stream the steps to segment files in the outfile folder
+                self._stream = RolloutStreamWriter(self._outfile, save_info=self._save_info)
+            elif self._use_shelve:
                 # Open a shelf file to store each rollout as they come in
                 self._shelf = shelve.open(self._outfile)
             else:
@@ -113,11 +125,13 @@ class RolloutSaver:
         return self
 
     def __exit__(self, type, value, traceback):
-        if self._shelf:
+        if self._stream:
+            self._stream.close()
+        elif self._shelf:
             # Close the shelf file, and store the number of episodes for ease
             self._shelf["num_episodes"] = self._num_episodes
             self._shelf.close()
-        elif self._outfile and not self._use_shelve:
+        elif self._outfile and not self._use_shelve and not self._use_stream:
             # Dump everything as one big pickle:
             pickle.dump(self._rollouts, open(self._outfile, "wb"))
         if self._update_file:
@@ -137,10 +151,14 @@ class RolloutSaver:
 
     def begin_rollout(self):
         self._current_rollout = []
+        if self._stream:
+            self._stream.begin_episode(self._num_episodes)
 
     def end_rollout(self):
         if self._outfile:
-            if self._use_shelve:
+            if self._stream:
+                self._stream.end_episode()
+            elif self._use_shelve:
                 # Save this episode as a new entry in the shelf database,
                 # using the episode number as the key.
                 self._shelf[str(self._num_episodes)] = self._current_rollout
@@ -155,7 +173,9 @@ class RolloutSaver:
 
     def append_step(self, obs, action, next_obs, reward, done, info):
         """Add a step to the current rollout, if we are saving them"""
-        if self._outfile:
+        if self._stream:
+            self._stream.append(obs, action, next_obs, reward, done, info)
+        elif self._outfile:
             if self._save_info:
                 self._current_rollout.append(
                     [obs, action, next_obs, reward, done, info])
@@ -223,6 +243,12 @@ def create_parser(parser_creator=None):
         action="store_true",
         help="Save rollouts into a python shelf file (will save each episode "
              "as it is generated). An output filename must be set using --out.")
+    parser.add_argument(
+        "--use-stream",
+        default=False,
+        action="store_true",
+        help="Stream the steps into compressed segment files while rolling out "
+             "(the --out folder), only keeps one chunk of steps in memory.")
     parser.add_argument(
         "--track-progress",
         default=False,
@@ -230,6 +256,19 @@ def create_parser(parser_creator=None):
         help="Write progress to a temporary file (updated "
              "after each episode). An output filename must be set using --out; "
              "the progress file will live in the same folder.")
+    parser.add_argument(
+        "--workers",
+        default=0,
+        type=int,
+        help="Evaluate the --episodes in parallel on this many worker processes, "
+             "each episode with its own env seed (starting at --seed). "
+             "Rollouts are not saved in this mode.")
+    parser.add_argument(
+        "--seed",
+        default=None,
+        type=int,
+        help="Env seed of the first episode of a parallel evaluation, defaults "
+             "to the seed (or min_test_seed) of the env config, or 1.")
     return parser
 
 
@@ -255,19 +294,31 @@ def run(args, parser):
         args.env = config.get("envs")
 
     ray.init()
+    load_models(os.path.dirname(__file__), names=custom_model_names(config))
+
+    num_steps = int(args.steps)
+    num_episodes = int(args.episodes)
+    if args.workers > 0:
+        if not num_episodes:
+            parser.error("parallel evaluation (--workers) requires --episodes")
+        outcome = parallel_rollout(args.run, args.env, config, args.checkpoint, num_episodes, args.workers,
+                                   args.seed)
+        outcome_file = os.path.join(os.path.dirname(config_path), 'test_outcome.json')
+        with open(outcome_file, 'w') as f:
+            json.dump(outcome, f, indent=4)
+        return
 
     cls = get_agent_class(args.run)
     agent = cls(env=args.env, config=config)
     agent.restore(args.checkpoint)
-    num_steps = int(args.steps)
-    num_episodes = int(args.episodes)
     with RolloutSaver(
             args.out,
             args.use_shelve,
             write_update_file=args.track_progress,
             target_steps=num_steps,
             target_episodes=num_episodes,
-            save_info=args.save_info) as saver:
+            save_info=args.save_info,
+            use_stream=args.use_stream) as saver:
         outcome = rollout(agent, args.env, num_steps, num_episodes, saver,
                           args.no_render, args.monitor)
         outcome_file = os.path.join(os.path.dirname(config_path), 'test_outcome.json')
@@ -299,13 +350,65 @@ def keep_going(steps, num_steps, episodes, num_episodes):
     return True
 
 
+def seeded_env_config(env_config: dict, seed: int) -> dict:
+    """Env config of an env whose first episode is generated from the given seed."""
+    env_config = dict(env_config, seed=seed)
+    if "min_test_seed" in env_config:
+        env_config["min_test_seed"] = seed
+        env_config["max_test_seed"] = max(seed, env_config.get("max_test_seed", seed))
+    return env_config
+
+
+def compute_actions(agent, multi_obs, policy_agent_mapping, mapping_cache, use_lstm, agent_states, prev_actions,
+                    prev_rewards):
+    """
+    Computes the actions of all agents with one compute_actions call per policy, preprocessing and filtering the
+    observations and clipping the actions like agent.compute_action.
+    """
+    local_worker = agent.workers.local_worker()
+    agent_ids_by_policy = collections.defaultdict(list)
+    for agent_id, a_obs in multi_obs.items():
+        if a_obs is not None:
+            policy_id = mapping_cache.setdefault(agent_id, policy_agent_mapping(agent_id))
+            agent_ids_by_policy[policy_id].append(agent_id)
+
+    action_dict = {}
+    for policy_id, agent_ids in agent_ids_by_policy.items():
+        obs_batch = np.stack([local_worker.filters[policy_id](
+            local_worker.preprocessors[policy_id].transform(multi_obs[agent_id]), update=False)
+            for agent_id in agent_ids])
+        state_batches = [np.stack(s) for s in zip(*[agent_states[agent_id] for agent_id in agent_ids])] \
+            if use_lstm[policy_id] else []
+        policy = agent.get_policy(policy_id)
+        actions, state_outs, _ = policy.compute_actions(
+            obs_batch,
+            state_batches,
+            prev_action_batch=np.stack([prev_actions[agent_id] for agent_id in agent_ids]),
+            prev_reward_batch=np.array([prev_rewards[agent_id] for agent_id in agent_ids]))
+        for i, agent_id in enumerate(agent_ids):
+            if use_lstm[policy_id]:
+                agent_states[agent_id] = [s[i] for s in state_outs]
+            a_action = actions[i]
+            if agent.config["clip_actions"]:
+                # like compute_single_action, e.g. the Box(0, 1) priorities of the priorization wrappers
+                a_action = clip_action(a_action, policy.action_space_struct)
+            a_action = flatten_to_single_ndarray(a_action)  # ray 0.8.5
+            action_dict[agent_id] = a_action
+            prev_actions[agent_id] = a_action
+    return action_dict
+
+
 def rollout(agent,
             env_name,
             num_steps,
             num_episodes=0,
             saver=None,
             no_render=True,
-            monitor=False):
+            monitor=False,
+            episode_seeds=None):
+    """
+    Rolls out the agent. With episode_seeds, every episode runs on a new env generated from its seed.
+    """
     policy_agent_mapping = default_policy_agent_mapping
 
     if saver is None:
@@ -330,6 +433,10 @@ def rollout(agent,
         multiagent = False
         use_lstm = {DEFAULT_POLICY_ID: False}
 
+    if episode_seeds is not None:
+        num_episodes = len(episode_seeds)
+        env_creator = _global_registry.get(ENV_CREATOR, env_name)
+
     if monitor and not no_render and saver and saver.outfile is not None:
         # If monitoring has been requested,
         # manually wrap our environment with a gym monitor
@@ -348,6 +455,9 @@ def rollout(agent,
     while keep_going(steps, num_steps, episodes, num_episodes):
         mapping_cache = {}  # in case policy_agent_mapping is stochastic
         saver.begin_rollout()
+        if episode_seeds is not None:
+            env = env_creator(EnvContext(seeded_env_config(agent.config["env_config"], episode_seeds[episodes]),
+                                         worker_index=0))
         obs = env.reset()
         agent_states = DefaultMapping(
             lambda agent_id: state_init[mapping_cache[agent_id]])
@@ -366,30 +476,8 @@ def rollout(agent,
         while not done and keep_going(steps, num_steps, episodes,
                                       num_episodes):
             multi_obs = obs if multiagent else {_DUMMY_AGENT_ID: obs}
-            action_dict = {}
-            for agent_id, a_obs in multi_obs.items():
-                if a_obs is not None:
-                    policy_id = mapping_cache.setdefault(
-                        agent_id, policy_agent_mapping(agent_id))
-                    p_use_lstm = use_lstm[policy_id]
-                    if p_use_lstm:
-                        a_action, p_state, _ = agent.compute_action(
-                            a_obs,
-                            state=agent_states[agent_id],
-                            prev_action=prev_actions[agent_id],
-                            prev_reward=prev_rewards[agent_id],
-                            policy_id=policy_id)
-                        agent_states[agent_id] = p_state
-                    else:
-                        a_action = agent.compute_action(
-                            a_obs,
-                            prev_action=prev_actions[agent_id],
-                            prev_reward=prev_rewards[agent_id],
-                            policy_id=policy_id)
-                    a_action = flatten_to_single_ndarray(a_action)  # ray 0.8.5
-                    action_dict[agent_id] = a_action
-                    prev_actions[agent_id] = a_action
-            action = action_dict
+            action = compute_actions(agent, multi_obs, policy_agent_mapping, mapping_cache, use_lstm,
+                                     agent_states, prev_actions, prev_rewards)
 
             action = action if multiagent else action[_DUMMY_AGENT_ID]
             next_obs, reward, done, info = env.step(action)
@@ -436,29 +524,89 @@ def rollout(agent,
         if done:
             episodes += 1
 
-    print("Evaluation completed:\n"
-          f"Episodes: {episodes}\n"
-          f"Mean Reward: {np.round(np.mean(simulation_rewards))}\n"
-          f"Mean Normalized Reward: {np.round(np.mean(simulation_rewards_normalized))}\n"
-          f"Mean Percentage Complete: {np.round(np.mean(simulation_percentage_complete), 3)}\n"
-          f"Mean Steps: {np.round(np.mean(simulation_steps), 2)}")
+    outcome = evaluation_outcome(simulation_rewards, simulation_rewards_normalized, simulation_percentage_complete,
+                                 simulation_steps)
+    print_outcome(outcome)
+    return outcome
+
 
+def evaluation_outcome(rewards, normalized_rewards, percentage_complete, steps):
     return {
-        'reward': [float(r) for r in simulation_rewards],
-        'reward_mean': np.mean(simulation_rewards),
-        'reward_std': np.std(simulation_rewards),
-        'normalized_reward': [float(r) for r in simulation_rewards_normalized],
-        'normalized_reward_mean': np.mean(simulation_rewards_normalized),
-        'normalized_reward_std': np.std(simulation_rewards_normalized),
-        'percentage_complete': [float(c) for c in simulation_percentage_complete],
-        'percentage_complete_mean': np.mean(simulation_percentage_complete),
-        'percentage_complete_std': np.std(simulation_percentage_complete),
-        'steps': [float(c) for c in simulation_steps],
-        'steps_mean': np.mean(simulation_steps),
-        'steps_std': np.std(simulation_steps),
+        'reward': [float(r) for r in rewards],
+        'reward_mean': np.mean(rewards),
+        'reward_std': np.std(rewards),
+        'normalized_reward': [float(r) for r in normalized_rewards],
+        'normalized_reward_mean': np.mean(normalized_rewards),
+        'normalized_reward_std': np.std(normalized_rewards),
+        'percentage_complete': [float(c) for c in percentage_complete],
+        'percentage_complete_mean': np.mean(percentage_complete),
+        'percentage_complete_std': np.std(percentage_complete),
+        'steps': [float(c) for c in steps],
+        'steps_mean': np.mean(steps),
+        'steps_std': np.std(steps),
     }
 
 
+def merge_outcomes(outcomes, shard_seeds=None):
+    """
+    Outcome of all episodes of the given evaluation outcomes, means and stds are computed over all of them. With
+    the episode seeds of every outcome, the episodes are sorted by seed.
+    """
+    episodes = [list(zip(*[outcome[key] for key in ['reward', 'normalized_reward', 'percentage_complete', 'steps']]))
+                for outcome in outcomes]
+    if shard_seeds is not None:
+        episodes = [[episode for _, episode in sorted(zip([s for seeds in shard_seeds for s in seeds],
+                                                          [e for shard in episodes for e in shard]))]]
+    return evaluation_outcome(*[list(values) for values in zip(*[e for shard in episodes for e in shard])])
+
+
+def print_outcome(outcome):
+    print("Evaluation completed:\n"
+          f"Episodes: {len(outcome['reward'])}\n"
+          f"Mean Reward: {np.round(outcome['reward_mean'])}\n"
+          f"Mean Normalized Reward: {np.round(outcome['normalized_reward_mean'])}\n"
+          f"Mean Percentage Complete: {np.round(outcome['percentage_complete_mean'], 3)}\n"
+          f"Mean Steps: {np.round(outcome['steps_mean'], 2)}")
+
+
+class EvaluationWorker:
+    """Restores the checkpoint in its own process and rolls out the episodes of the seeds it is given."""
+
+    def __init__(self, run, env_name, config, checkpoint):
+        load_envs(os.path.dirname(__file__))
+        load_models(os.path.dirname(__file__), names=custom_model_names(config))
+        self._env_name = env_name
+        self._agent = get_agent_class(run)(env=env_name, config=config)
+        self._agent.restore(checkpoint)
+
+    def rollout(self, episode_seeds):
+        return rollout(self._agent, self._env_name, 0, episode_seeds=episode_seeds)
+
+
+def parallel_rollout(run, env_name, config, checkpoint, num_episodes, num_workers, seed=None):
+    """
+    Evaluates the checkpoint on num_episodes episodes, generated from consecutive env seeds, which are sharded
+    over num_workers worker processes. Returns the merged outcome.
+    """
+    env_config = config.get("env_config", {})
+    if seed is None:
+        # flatland_sparse ignores a seed of 0
+        seed = env_config.get("seed", env_config.get("min_test_seed", 1)) or 1
+    seeds = list(range(seed, seed + num_episodes))
+    num_workers = min(num_workers, num_episodes)
+
+    # the workers roll out on their local worker only
+    config = dict(config, num_workers=0)
+    remote_worker_cls = ray.remote(num_cpus=1)(EvaluationWorker)
+    workers = [remote_worker_cls.remote(run, env_name, config, checkpoint) for _ in range(num_workers)]
+    shard_seeds = [seeds[i::num_workers] for i in range(num_workers)]
+    outcomes = ray.get([worker.rollout.remote(shard) for worker, shard in zip(workers, shard_seeds)])
+
+    outcome = merge_outcomes(outcomes, shard_seeds)
+    print_outcome(outcome)
+    return outcome
+
+
 if __name__ == "__main__":
     parser = create_parser()
     args = parser.parse_args()
@@ -1,47 +1,54 @@
 import os
+from collections.abc import Mapping
 
 import yaml
 import inspect
 src_file_path = inspect.getfile(lambda: None)
 
-GENERATOR_CONFIG_REGISTRY = {}
-EVAL_CONFIG_REGISTRY = {}
 
+class ConfigRegistry(Mapping):
+    """
+    Configs of the yaml files in a folder by file name. The folder is only listed and a file only parsed on the
+    first lookup.
+    """
 
-def get_eval_config(name: str = None):
-    return EVAL_CONFIG_REGISTRY[name]
-
-
-def get_generator_config(name: str):
-    return GENERATOR_CONFIG_REGISTRY[name]
+    def __init__(self, folder: str):
+        self._folder = folder
+        self._files = None
+        self._configs = {}
 
+    def _index(self):
+        if self._files is None:
+            self._files = {file.replace(".yaml", ""): os.path.join(self._folder, file)
+                           for file in sorted(os.listdir(self._folder))
+                           if file.endswith('.yaml') and not file.startswith('_')}
+        return self._files
 
-config_folder = os.path.join(os.path.dirname(src_file_path), "..", "resources", "generator_configs")
-load_count = 0
-for file in os.listdir(config_folder):
-    if file.endswith('.yaml') and not file.startswith('_'):
-        basename = os.path.basename(file)
-        filename = basename.replace(".yaml", "")
+    def __getitem__(self, name):
+        if name not in self._configs:
+            with open(self._index()[name]) as f:
+                self._configs[name] = yaml.safe_load(f)
+        return self._configs[name]
 
-        with open(os.path.join(config_folder, file)) as f:
-            GENERATOR_CONFIG_REGISTRY[filename] = yaml.safe_load(f)
+    def __contains__(self, name):
+        return name in self._index()
 
-        load_count += 1
+    def __iter__(self):
+        return iter(self._index())
 
-print("- Successfully loaded", load_count, "generator configs")
+    def __len__(self):
+        return len(self._index())
 
 
-load_count = 0
-eval_config_folder = os.path.join(os.path.dirname(src_file_path), "..", "resources", "eval_configs")
-for file in os.listdir(eval_config_folder):
-    if file.endswith('.yaml') and not file.startswith('_'):
-        basename = os.path.basename(file)
-        filename = basename.replace(".yaml", "")
+GENERATOR_CONFIG_REGISTRY = ConfigRegistry(
+    os.path.join(os.path.dirname(src_file_path), "..", "resources", "generator_configs"))
+EVAL_CONFIG_REGISTRY = ConfigRegistry(
+    os.path.join(os.path.dirname(src_file_path), "..", "resources", "eval_configs"))
 
-        with open(os.path.join(eval_config_folder, file)) as f:
-            EVAL_CONFIG_REGISTRY[filename] = yaml.safe_load(f)
 
-        load_count += 1
+def get_eval_config(name: str = None):
+    return EVAL_CONFIG_REGISTRY[name]
 
-print("- Successfully loaded", load_count, "evaluation configs")
 
+def get_generator_config(name: str):
+    return GENERATOR_CONFIG_REGISTRY[name]
@@ -25,7 +25,8 @@ class FlatlandBase(MultiAgentEnv):
 
         obs, all_rewards, done, info = self._env.step(action_dict)
         if done['__all__']:
-            self.close()
+            # only ends the episode, close() also releases the resources of the env
+            self._env.close()
         return obs, all_rewards, done, info
 
     def reset(self, *args, **kwargs):
@@ -7,7 +7,8 @@ from flatlander.agents.shortest_path_agent import ShortestPathAgent
 from flatlander.envs import get_generator_config
 from flatlander.envs.flatland_sparse import FlatlandSparse
 from flatlander.envs.observations import make_obs
-from flatlander.envs.utils.gym_env import StepOutput
+from flatlander.envs.utils.gym_env import StepOutput, suppressed_observations
+from flatlander.envs.utils.priorization.priorizer import priority_order
 from flatlander.envs.utils.robust_gym_env import RobustFlatlandGymEnv
 import numpy as np
 
@@ -44,7 +45,8 @@ class FlatlandMeta(FlatlandSparse):
             regenerate_rail_on_reset=self._config['regenerate_rail_on_reset'],
             regenerate_schedule_on_reset=self._config['regenerate_schedule_on_reset'],
             config=env_config,
-            allow_noop=True
+            allow_noop=True,
+            dynamic_priorities=env_config.get('dynamic_priorities', False)
         )
         self.last_obs = None
 
@@ -61,13 +63,14 @@ class FlatlandMeta(FlatlandSparse):
 
     def _scheduling_step(self, action):
         norm_factor = self._env.rail_env._max_episode_steps * self._env.rail_env.get_num_agents()
-        sorted_actions = {k: v for k, v in sorted(action.items(), key=lambda item: item[1], reverse=True)}
-        self._env.sorted_handles = list(sorted_actions.keys())
+        self._env.sorted_handles = priority_order(action)
 
         done = defaultdict(lambda: False)
-        while not done['__all__']:
-            actions = ShortestPathAgent().compute_actions(self.last_obs, self._env.rail_env)
-            _, _, done, _ = self._env.step(actions)
+        # the observations of the episode are never read
+        with suppressed_observations(self._env.rail_env, lazy=True):
+            while not done['__all__']:
+                actions = ShortestPathAgent().compute_actions(self.last_obs, self._env.rail_env)
+                _, _, done, _ = self._env.step(actions)
 
         pc = np.sum(
             np.array([1 for a in self._env.rail_env.agents if is_done(a)])) / self._env.rail_env.get_num_agents()
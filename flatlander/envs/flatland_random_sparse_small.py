@@ -43,7 +43,8 @@ class FlatlandRandomSparseSmall(FlatlandBase):
             deadlock_reward = env_config.get('deadlock_reward', 0)
             self._env = DeadlockResolutionWrapper(self._env, deadlock_reward)
         if env_config.get('skip_no_choice_cells', False):
-            self._env = SkipNoChoiceCellsWrapper(self._env, env_config.get('accumulate_skipped_rewards', False))
+            self._env = SkipNoChoiceCellsWrapper(self._env, env_config.get('accumulate_skipped_rewards', False),
+                                                 fast_forward=env_config.get('fast_forward', False))
         if env_config.get('available_actions_obs', False):
             self._env = AvailableActionsWrapper(self._env)
 
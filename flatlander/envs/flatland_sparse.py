@@ -1,4 +1,5 @@
 import logging
+import os
 from pprint import pprint
 
 import gym
@@ -19,6 +20,7 @@ from flatlander.envs.utils.gym_env_wrappers import AvailableActionsWrapper, Skip
     DeadlockWrapper, ShortestPathActionWrapper, DeadlockResolutionWrapper, GlobalRewardWrapper, \
     NoStopShortestPathActionWrapper, PriorizationWrapper, SparsePriorizationWrapper
 from flatlander.envs.utils.gym_env_wrappers import FlatlandRenderWrapper as RailEnv
+from flatlander.envs.utils.rail_bank import RailBank, EpisodePrefetcher
 from flatlander.envs.utils.robust_gym_env import RobustFlatlandGymEnv
 from flatlander.envs.utils.seq_schedule_generator import SequentialSparseSchedGen
 from flatlander.envs.utils.sequential_gym_env import SequentialFlatlandGymEnv
@@ -55,6 +57,16 @@ class FlatlandSparse(FlatlandBase):
             pprint(self._config)
             print("=" * 50)
 
+        # precomputed rails and schedules, from disk or generated in the background
+        self._episode_source = None
+        if env_config.get('rail_bank', None) is not None:
+            self._episode_source = self._open_rail_bank(env_config)
+        elif env_config.get('prefetch_episodes', False):
+            assert self._config['regenerate_rail_on_reset'] and self._config['regenerate_schedule_on_reset']
+            sub_env = (getattr(env_config, 'worker_index', 0), getattr(env_config, 'vector_index', 0))
+            self._episode_source = EpisodePrefetcher(self._config, seed=hash((self._config['seed'], *sub_env))
+                                                                         % (2 ** 31 - 1) + 1)
+
         self._gym_env_class = self._gym_envs[env_config.get("gym_env", "default")]
 
         self._env = self._gym_env_class(
@@ -64,7 +76,8 @@ class FlatlandSparse(FlatlandBase):
             regenerate_rail_on_reset=self._config['regenerate_rail_on_reset'],
             regenerate_schedule_on_reset=self._config['regenerate_schedule_on_reset'],
             config=env_config,
-            allow_noop=env_config.get('allow_noop', True)
+            allow_noop=env_config.get('allow_noop', True),
+            dynamic_priorities=env_config.get('dynamic_priorities', False)
         )
 
         if env_config['observation'] in self._sp_action_needed:
@@ -87,7 +100,8 @@ class FlatlandSparse(FlatlandBase):
             self._env = DeadlockResolutionWrapper(self._env, deadlock_reward)
         if env_config.get('skip_no_choice_cells', False):
             self._env = SkipNoChoiceCellsWrapper(self._env, env_config.get('accumulate_skipped_rewards', False),
-                                                 discounting=env_config.get('discounting', 1.))
+                                                 discounting=env_config.get('discounting', 1.),
+                                                 fast_forward=env_config.get('fast_forward', False))
         if env_config.get('available_actions_obs', False):
             self._env = AvailableActionsWrapper(self._env, env_config.get('allow_noop', True))
         if env_config.get('fill_unavailable_actions', False):
@@ -101,6 +115,27 @@ class FlatlandSparse(FlatlandBase):
     def action_space(self) -> gym.spaces.Space:
         return self._env.action_space
 
+    def reset(self, *args, **kwargs):
+        if self._episode_source is not None:
+            self._episode_source.select(kwargs.get('random_seed', args[0] if len(args) > 0 else None))
+        return super().reset(*args, **kwargs)
+
+    def close(self):
+        super().close()
+        if isinstance(self._episode_source, EpisodePrefetcher):
+            self._episode_source.close()
+
+    def _open_rail_bank(self, env_config) -> RailBank:
+        """
+        Opens the pregenerated episodes of the generator config, the sub envs of the workers start at different
+        episodes.
+        """
+        assert self._config['regenerate_rail_on_reset'] and self._config['regenerate_schedule_on_reset']
+        offset = hash((getattr(env_config, 'worker_index', 0), getattr(env_config, 'vector_index', 0)))
+        rail_bank = RailBank(os.path.join(env_config['rail_bank'], env_config['generator_config']), offset=offset)
+        assert rail_bank.number_of_agents == self._config['number_of_agents']
+        return rail_bank
+
     def get_rail_generator(self):
         rail_generator = sparse_rail_generator(
             seed=self._config['seed'],
@@ -133,6 +168,10 @@ class FlatlandSparse(FlatlandBase):
         else:
             schedule_generator = sparse_schedule_generator(speed_ratio_map)
 
+        if self._episode_source is not None:
+            rail_generator = self._episode_source.rail_generator()
+            schedule_generator = self._episode_source.schedule_generator()
+
         env = None
         try:
             if self._fine_tune_env_path is None:
@@ -148,6 +187,8 @@ class FlatlandSparse(FlatlandBase):
                     random_seed=self._config['seed'],
                     use_renderer=self._env_config.get('render')
                 )
+                if self._episode_source is not None:
+                    self._episode_source.attach(env)
                 env.reset()
             else:
                 env, _ = RailEnvPersister.load_new(self._fine_tune_env_path)
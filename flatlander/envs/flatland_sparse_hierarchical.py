@@ -4,6 +4,7 @@ from flatlander.envs.flatland_sparse import FlatlandSparse
 import numpy as np
 
 from flatlander.envs.utils.gym_env import StepOutput
+from flatlander.envs.utils.priorization.priorizer import priority_order
 from flatlander.envs.utils.robust_gym_env import RobustFlatlandGymEnv
 
 
@@ -51,9 +52,7 @@ class FlatlandSparseHierarchical(FlatlandSparse):
             return StepOutput(obs=obs, reward=rew, done=dones, info=info)
 
     def _scheduling_step(self, action):
-        sorted_actions = {int(k.replace('meta_', '')): v
-                          for k, v in sorted(action.items(), key=lambda item: item[1], reverse=True)}
-        self._env.sorted_handles = list(sorted_actions.keys())
+        self._env.sorted_handles = [int(k.replace('meta_', '')) for k in priority_order(action)]
 
         d = {h: False for h in self._low_level_reset_obs.keys()}
         d['__all__'] = False
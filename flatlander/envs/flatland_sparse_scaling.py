@@ -7,18 +7,27 @@ from flatland.envs.malfunction_generators import ParamMalfunctionGen, \
     NoMalfunctionGen
 from flatland.envs.schedule_generators import sparse_schedule_generator
 from flatlander.envs.flatland_sparse import FlatlandSparse
-from flatlander.envs.utils.gym_env import FlatlandGymEnv
 from flatlander.envs.utils.gym_env_wrappers import FlatlandRenderWrapper as RailEnv
+from flatlander.envs.utils.step_counter import SharedStepCounter
 
 
 class FlatlandSparseScaling(FlatlandSparse, ABC):
+    """
+    Curriculum which adds agents to the env over the course of the training. The steps are counted per env, or
+    over all sub envs sharing the step counter (the envs of a worker with the same step_counter_key, all workers
+    with the step_counter file), so they scale in sync.
+
+    The env is created once, more agents only regenerate the schedule, on the current rail if the rail is kept.
+    """
 
     def __init__(self, env_config) -> None:
         self._add_agent_interval = env_config.get("add_agent_interval", 10000)
         self._interval_growth_rate = env_config.get("interval_growth_rate", 1.1)
         self._max_agents = env_config.get("max_agents", 10)
-        self._cumulative_steps = 0
+        self._step_counter = SharedStepCounter(env_config.get("step_counter", None),
+                                               key=env_config.get("step_counter_key", None))
         self._prev_num_agents = 1
+        self._agents_hints = None
         self._agent_intervals = np.zeros(self._max_agents)
         self._agent_intervals[0] = self._add_agent_interval
         for i in range(1, self._max_agents):
@@ -32,7 +41,7 @@ class FlatlandSparseScaling(FlatlandSparse, ABC):
         super(FlatlandSparseScaling, self).__init__(env_config)
 
     def step(self, action_dict):
-        self._cumulative_steps += 1
+        self._step_counter.add(1)
         return super(FlatlandSparseScaling, self).step(action_dict)
 
     def get_num_agents(self, steps):
@@ -44,6 +53,28 @@ class FlatlandSparseScaling(FlatlandSparse, ABC):
                 num_agents += 1
         return self._max_agents
 
+    def get_rail_generator(self):
+        rail_generator = super().get_rail_generator()
+
+        def generator(width, height, num_agents, num_resets=0, np_random=None):
+            rail, optionals = rail_generator(width, height, num_agents, num_resets, np_random)
+            self._agents_hints = optionals.get('agents_hints', None)
+            return rail, optionals
+
+        return generator
+
+    def get_schedule_generator(self, speed_ratio_map):
+        schedule_generator = sparse_schedule_generator(speed_ratio_map)
+
+        def generator(rail, num_agents, hints=None, num_resets=0, np_random=None):
+            # a schedule regenerated on the current rail gets no hints from the env, reuse the ones of the rail.
+            # the sparse rail generator only limits the number of agents through its hints.
+            if hints is None and self._agents_hints is not None:
+                hints = dict(self._agents_hints, num_agents=num_agents)
+            return schedule_generator(rail, num_agents, hints, num_resets, np_random)
+
+        return generator
+
     def _launch(self):
         rail_generator = self.get_rail_generator()
 
@@ -61,11 +92,10 @@ class FlatlandSparseScaling(FlatlandSparse, ABC):
             speed_ratio_map = {
                 float(k): float(v) for k, v in self._config['speed_ratio_map'].items()
             }
-        schedule_generator = sparse_schedule_generator(speed_ratio_map)
+        schedule_generator = self.get_schedule_generator(speed_ratio_map)
 
         env = None
         try:
-            print("GENERATE NEW ENV WITH", self._prev_num_agents, "AGENTS")
             env = RailEnv(
                 width=self._config['width'],
                 height=self._config['height'],
@@ -87,19 +117,12 @@ class FlatlandSparseScaling(FlatlandSparse, ABC):
 
         return env
 
-    def get_env(self):
-        return FlatlandGymEnv(
-            rail_env=self._launch(),
-            observation_space=self._observation.observation_space(),
-            render=self._env_config.get('render'),
-            regenerate_rail_on_reset=self._config['regenerate_rail_on_reset'],
-            regenerate_schedule_on_reset=self._config['regenerate_schedule_on_reset']
-        )
-
     def reset(self, *args, **kwargs):
-        cur_num_agents = self.get_num_agents(self._cumulative_steps)
+        cur_num_agents = self.get_num_agents(self._step_counter.sync())
         if cur_num_agents > self._prev_num_agents:
             self._prev_num_agents = cur_num_agents
-            self._env = self.get_env()
-        self._env.reset(*args, **kwargs)
-        return self._env.reset(*args, **kwargs)
+            rail_env = self._env.rail_env
+            rail_env.number_of_agents = cur_num_agents
+            # without agents the rail env generates a new schedule also if the gym env keeps it
+            rail_env.agents = []
+        return super(FlatlandSparseScaling, self).reset(*args, **kwargs)
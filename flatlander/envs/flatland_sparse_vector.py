@@ -0,0 +1,49 @@
+from ray.rllib.env.base_env import _MultiAgentEnvToBaseEnv
+
+from flatlander.envs.flatland_sparse import FlatlandSparse
+from flatlander.envs.utils.gym_env import suppressed_observations, build_observations
+from flatlander.envs.utils.shared_episodes import SharedEpisodeCache
+
+
+class FlatlandSparseVector(_MultiAgentEnvToBaseEnv):
+    """
+    Runs num_sub_envs flatland_sparse envs of a rollout worker as one vector env (use with num_envs_per_worker: 1).
+
+    Sub envs with the same generator state share their rails, schedules and distance maps. The sub envs step with
+    lazy observations, which are built for all sub envs together after the step, in one call for observation
+    builders with get_many_batch.
+    """
+
+    def __init__(self, env_config) -> None:
+        num_envs = env_config.get('num_sub_envs', 1)
+        self._episode_cache = SharedEpisodeCache(max_entries=2 * num_envs)
+        super().__init__(make_env=lambda i: self._make_sub_env(env_config, i), existing_envs=[], num_envs=num_envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+    def _make_sub_env(self, env_config, index: int) -> FlatlandSparse:
+        if hasattr(env_config, 'copy_with_overrides'):
+            env_config = env_config.copy_with_overrides(vector_index=index)
+        env = FlatlandSparse(env_config)
+        if env._episode_source is None:
+            self._episode_cache.attach(env._env.rail_env)
+        return env
+
+    def send_actions(self, action_dict):
+        steps = {}
+        for env_id, agent_dict in action_dict.items():
+            if env_id in self.dones:
+                raise ValueError("Env {} is already done".format(env_id))
+            env = self.envs[env_id]
+            with suppressed_observations(env._env.rail_env, lazy=True):
+                steps[env_id] = env.step(agent_dict)
+
+        build_observations([obs for obs, _, _, _ in steps.values()])
+        for env_id, (obs, rewards, dones, infos) in steps.items():
+            obs = {handle: obs[handle] for handle in obs}
+            if set(obs.keys()) != set(rewards.keys()):
+                raise ValueError("Key set for obs and rewards must be the same: {} vs {}".format(obs.keys(),
+                                                                                                rewards.keys()))
+            if dones["__all__"]:
+                self.dones.add(env_id)
+            self.env_states[env_id].observe(obs, rewards, dones, infos)
@@ -1,9 +1,9 @@
 import importlib
 import os
+import re
 from abc import ABC, abstractmethod
 
 import gym
-import humps
 
 from flatland.core.env_observation_builder import ObservationBuilder
 
@@ -37,19 +37,34 @@ def register_obs(name: str):
     return register_observation_cls
 
 
-def make_obs(name: str, config, *args, **kwargs) -> Observation:
-    return OBS_REGISTRY[name](config, *args, **kwargs)
+_REGISTER_PATTERN = re.compile(r'@register_obs\(\s*["\']([^"\']+)["\']\s*\)')
+_obs_modules = None
+
 
+def _obs_module_index():
+    """
+    Maps the observation names to the modules registering them, found in the sources of the obs/ directory
+    without importing them.
+    """
+    global _obs_modules
+    if _obs_modules is None:
+        _obs_modules = {}
+        for file in sorted(os.listdir(os.path.dirname(__file__))):
+            if file.endswith('.py') and not file.startswith('_'):
+                with open(os.path.join(os.path.dirname(__file__), file)) as f:
+                    for name in _REGISTER_PATTERN.findall(f.read()):
+                        _obs_modules[name] = file[:-3]
+    return _obs_modules
 
-# automatically import any Python files in the obs/ directory
-load_count = 0
-for file in os.listdir(os.path.dirname(__file__)):
-    if file.endswith('.py') and not file.startswith('_'):
-        basename = os.path.basename(file)
-        filename = basename.replace(".py", "")
-        class_name = humps.pascalize(filename)
 
-        module = importlib.import_module(f'.{file[:-3]}', package=__name__)
-        load_count += 1
+def get_obs_cls(name: str):
+    """
+    Returns the observation class registered under the name, its module is imported on the first lookup.
+    """
+    if name not in OBS_REGISTRY and name in _obs_module_index():
+        importlib.import_module(f'.{_obs_module_index()[name]}', package=__name__)
+    return OBS_REGISTRY[name]
 
-print("- Successfully loaded", load_count, "observation classes")
+
+def make_obs(name: str, config, *args, **kwargs) -> Observation:
+    return get_obs_cls(name)(config, *args, **kwargs)
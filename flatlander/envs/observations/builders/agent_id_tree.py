@@ -11,6 +11,7 @@ from flatland.core.grid.grid_utils import coordinate_to_position
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.utils.ordered_set import OrderedSet
 
+from flatlander.envs.observations.common.prediction_cache import PredictionCache
 from flatlander.envs.observations.common.utils import one_hot
 
 AgentIdNode = collections.namedtuple('AgentIdNode', 'dist_own_target_encountered '
@@ -65,22 +66,10 @@ class AgentIdTreeObservationBuilder(ObservationBuilder):
         if handles is None:
             handles = []
         if self.predictor:
-            self.max_prediction_depth = 0
-            self.predicted_pos = {}
-            self.predicted_dir = {}
-            self.predictions = self.predictor.get()
-            if self.predictions:
-                for t in range(self.predictor.max_depth + 1):
-                    pos_list = []
-                    dir_list = []
-                    for a in handles:
-                        if self.predictions[a] is None:
-                            continue
-                        pos_list.append(self.predictions[a][t][1:3])
-                        dir_list.append(self.predictions[a][t][3])
-                    self.predicted_pos.update({t: coordinate_to_position(self.env.width, pos_list)})
-                    self.predicted_dir.update({t: dir_list})
-                self.max_prediction_depth = len(self.predicted_pos)
+            step_predictions = PredictionCache.for_env(self.env).get(self.predictor)
+            self.predictions = step_predictions.predictions
+            self.predicted_pos, self.predicted_dir = step_predictions.positions(handles)
+            self.max_prediction_depth = len(self.predicted_pos)
         # Update local lookup table for all agents' positions
         # ignore other agents not in the grid (only status active and done)
         # self.location_has_agent = {tuple(agent.position): 1 for agent in self.env.agents if
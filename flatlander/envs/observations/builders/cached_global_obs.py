@@ -0,0 +1,12 @@
+from flatland.envs.observations import GlobalObsForRailEnv
+
+from flatlander.envs.observations.common.transition_cache import get_transition_tensor
+
+
+class CachedGlobalObsForRailEnv(GlobalObsForRailEnv):
+    """
+    GlobalObsForRailEnv reusing the transition tensor decoded once per rail instead of parsing every cell on reset.
+    """
+
+    def reset(self):
+        self.rail_obs = get_transition_tensor(self.env.rail)
@@ -6,6 +6,9 @@ from flatland.core.env import Environment
 from flatland.core.env_observation_builder import ObservationBuilder
 from flatland.envs.agent_utils import RailAgentStatus
 
+from flatlander.envs.observations.common.transition_cache import get_transition_tensor, \
+    get_padded_transition_tensor
+
 
 class PerfectInformationGlobalObs(ObservationBuilder):
     """
@@ -26,21 +29,21 @@ class PerfectInformationGlobalObs(ObservationBuilder):
          target and the positions of the other agents targets (flag only, no counter!).
     """
 
-    def __init__(self, max_n_agents: int = 5):
+    def __init__(self, max_n_agents: int = 5, max_height: int = None, max_width: int = None):
         super(PerfectInformationGlobalObs, self).__init__()
         self.max_n_agents = max_n_agents
+        self.max_height = max_height
+        self.max_width = max_width
         self.rail_obs = None
 
     def set_env(self, env: Environment):
         super().set_env(env)
 
     def reset(self):
-        self.rail_obs = np.zeros((self.env.height, self.env.width, 16))
-        for i in range(self.rail_obs.shape[0]):
-            for j in range(self.rail_obs.shape[1]):
-                bit_list = [int(digit) for digit in bin(self.env.rail.get_full_transitions(i, j))[2:]]
-                bit_list = [0] * (16 - len(bit_list)) + bit_list
-                self.rail_obs[i, j] = np.array(bit_list)
+        if self.max_height is None or self.max_width is None:
+            self.rail_obs = get_transition_tensor(self.env.rail)
+        else:
+            self.rail_obs = get_padded_transition_tensor(self.env.rail, self.max_height, self.max_width)
 
     def _one_hot_agent(self, handle, old: np.ndarray = None):
         if old is not None:
@@ -59,11 +62,12 @@ class PerfectInformationGlobalObs(ObservationBuilder):
         return None
 
     def get_many(self, handles: Optional[List[int]] = None) -> np.ndarray:
-        obs_agent_ids = np.zeros((self.env.height, self.env.width, self.max_n_agents))
-        obs_agent_directions = np.zeros((self.env.height, self.env.width, 4))
-        obs_agent_malfunctions = np.zeros((self.env.height, self.env.width, 1))
-        obs_agent_initials = np.zeros((self.env.height, self.env.width, self.max_n_agents))
-        obs_agent_targets = np.zeros((self.env.height, self.env.width, self.max_n_agents))
+        height, width = self.rail_obs.shape[:2]
+        obs_agent_ids = np.zeros((height, width, self.max_n_agents))
+        obs_agent_directions = np.zeros((height, width, 4))
+        obs_agent_malfunctions = np.zeros((height, width, 1))
+        obs_agent_initials = np.zeros((height, width, self.max_n_agents))
+        obs_agent_targets = np.zeros((height, width, self.max_n_agents))
 
         for agent in self.env.agents:
 
@@ -10,7 +10,8 @@ from flatland.core.grid.grid_utils import coordinate_to_position
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.utils.ordered_set import OrderedSet
 
-from flatlander.algorithms.graph_coloring import GreedyGraphColoring
+from flatlander.algorithms.graph_coloring import IncrementalGraphColoring
+from flatlander.envs.observations.common.prediction_cache import PredictionCache
 from flatlander.envs.observations.common.utils import one_hot
 
 Node = collections.namedtuple('Node', 'dist_own_target_encountered '
@@ -59,9 +60,12 @@ class PriorityTreeObs(ObservationBuilder):
         self.location_has_agent_malfunction = {}
         self.location_has_agent_ready_to_depart = {}
         self._conflict_map = {}
+        # the order of the colors matters
+        self._coloring = IncrementalGraphColoring(colors=[1, 0])
 
     def reset(self):
         self.location_has_target = {tuple(agent.target): 1 for agent in self.env.agents}
+        self._coloring.reset()
 
     def get_many(self, handles: Optional[List[int]] = None):
         """
@@ -75,22 +79,10 @@ class PriorityTreeObs(ObservationBuilder):
         self._conflict_map = {handle: [] for handle in handles}
 
         if self.predictor:
-            self.max_prediction_depth = 0
-            self.predicted_pos = {}
-            self.predicted_dir = {}
-            self.predictions = self.predictor.get()
-            if self.predictions:
-                for t in range(self.predictor.max_depth + 1):
-                    pos_list = []
-                    dir_list = []
-                    for a in handles:
-                        if self.predictions[a] is None:
-                            continue
-                        pos_list.append(self.predictions[a][t][1:3])
-                        dir_list.append(self.predictions[a][t][3])
-                    self.predicted_pos.update({t: coordinate_to_position(self.env.width, pos_list)})
-                    self.predicted_dir.update({t: dir_list})
-                self.max_prediction_depth = len(self.predicted_pos)
+            step_predictions = PredictionCache.for_env(self.env).get(self.predictor)
+            self.predictions = step_predictions.predictions
+            self.predicted_pos, self.predicted_dir = step_predictions.positions(handles)
+            self.max_prediction_depth = len(self.predicted_pos)
         # Update local lookup table for all agents' positions
         # ignore other agents not in the grid (only status active and done)
         # self.location_has_agent = {tuple(agent.position): 1 for agent in self.env.agents if
@@ -119,9 +111,8 @@ class PriorityTreeObs(ObservationBuilder):
         obs_dict: Dict = super().get_many(handles)
 
         if self.use_priority:
-            priorities = GreedyGraphColoring.color(colors=[1, 0],
-                                                   nodes=obs_dict.keys(),
-                                                   neighbors=self._conflict_map)
+            priorities = self._coloring.color(nodes=obs_dict.keys(),
+                                              neighbors=self._conflict_map)
 
             for handle, obs in obs_dict.items():
                 if obs is not None:
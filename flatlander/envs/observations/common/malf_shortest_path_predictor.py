@@ -16,7 +16,9 @@ class MalfShortestPathPredictorForRailEnv(PredictionBuilder):
 
     This object returns shortest-path predictions for agents in the RailEnv environment.
     The prediction acts as if no other agent is in the environment and always takes the forward action.
+    The predictions of a lower max_depth are the first steps of the deeper ones.
     """
+    truncatable = True
 
     def __init__(self, max_depth: int = 20, branch_only=False):
         super().__init__(max_depth)
@@ -55,7 +57,8 @@ class MalfShortestPathPredictorForRailEnv(PredictionBuilder):
 
         distance_map: DistanceMap = self.env.distance_map
 
-        shortest_paths = get_shortest_paths(distance_map, handles=handles, max_depth=self.max_depth,
+        # the path includes the current position, max_depth moves need one more waypoint
+        shortest_paths = get_shortest_paths(distance_map, handles=handles, max_depth=self.max_depth + 1,
                                             branch_only=self.branch_only)
 
         prediction_dict = {}
@@ -65,7 +68,7 @@ class MalfShortestPathPredictorForRailEnv(PredictionBuilder):
 
             if not agent.status == RailAgentStatus.ACTIVE and not agent.status == RailAgentStatus.READY_TO_DEPART:
                 prediction = np.zeros(shape=(self.max_depth + 1, 5))
-                for i in range(self.max_depth):
+                for i in range(self.max_depth + 1):
                     prediction[i] = [i, None, None, None, None]
                 prediction_dict[agent.handle] = prediction
                 continue
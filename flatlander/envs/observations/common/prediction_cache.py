@@ -0,0 +1,159 @@
+import copy
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from flatland.core.env_prediction_builder import PredictionBuilder
+from flatland.core.grid.grid_utils import coordinate_to_position
+from flatland.envs.rail_env import RailEnv
+
+
+class StepPredictions:
+    """
+    Predictions of one predictor for one step of the environment.
+
+    The raw prediction dict is shared by all consumers, the mapped positions/directions and the
+    (t, cell) -> handles index are computed lazily once per list of handles.
+    """
+
+    def __init__(self, width: int, max_depth: int, predictions: Dict[int, np.ndarray]):
+        self.width = width
+        self.max_depth = max_depth
+        self.predictions = predictions
+        self.dev_pred_dict = {}
+        self._mapped = {}
+        self._cell_handles = {}
+        self._truncated = {}
+
+    def truncated(self, max_depth: int) -> 'StepPredictions':
+        """
+        Returns the predictions up to max_depth, the shortest path predictions of a lower max_depth are the first
+        steps of the deeper ones.
+        """
+        if max_depth >= self.max_depth:
+            return self
+        if max_depth not in self._truncated:
+            self._truncated[max_depth] = StepPredictions(
+                self.width, max_depth, {h: None if p is None else p[:max_depth + 1]
+                                        for h, p in self.predictions.items()})
+        return self._truncated[max_depth]
+
+    def positions(self, handles) -> Tuple[Dict[int, np.ndarray], Dict[int, np.ndarray]]:
+        """
+        Returns the predicted positions (as int cell positions, -1 = off grid) and directions per time step,
+        indexed in the order of `handles`. Agents without prediction are off grid.
+        """
+        key = tuple(handles)
+        if key not in self._mapped:
+            predicted_pos = {}
+            predicted_dir = {}
+            if self.predictions:
+                predictions = [self.predictions.get(h, None) for h in key]
+                for t in range(self.max_depth + 1):
+                    pos_list = [(np.nan, np.nan) if p is None else p[t][1:3] for p in predictions]
+                    predicted_pos[t] = coordinate_to_position(self.width, pos_list)
+                    predicted_dir[t] = np.array([np.nan if p is None else p[t][3] for p in predictions],
+                                                dtype=float)
+            self._mapped[key] = predicted_pos, predicted_dir
+        return self._mapped[key]
+
+    def cell_handles(self, handles) -> Dict[Tuple[int, int], List[int]]:
+        """
+        Returns a mapping (t, cell) -> handles predicted to occupy the cell at time t. Off grid cells are not indexed.
+        """
+        key = tuple(handles)
+        if key not in self._cell_handles:
+            predicted_pos, _ = self.positions(key)
+            index = defaultdict(list)
+            for t, cells in predicted_pos.items():
+                for i in np.flatnonzero(cells >= 0):
+                    index[(t, int(cells[i]))].append(key[i])
+            self._cell_handles[key] = dict(index)
+        return self._cell_handles[key]
+
+
+class PredictionCache:
+    """
+    Per step cache of predictor outputs, shared by the observation builders and conflict detectors of a rail env.
+
+    Entries are keyed by the predictor config and the optional position/direction overrides and are predicted for
+    all agents. Predictors which are `truncatable` are predicted at the deepest max_depth requested so far (in
+    this or the previous step), shallower lookups get the first steps of the deeper predictions. A hit sets the
+    env.dev_pred_dict of the prediction (used by the renderer) like the predictor would. The whole cache is dropped
+    as soon as the elapsed steps or the agent states of the env change. Overridden positions without a direction
+    keep the agent's current direction.
+    """
+
+    def __init__(self, env: RailEnv):
+        self.env = env
+        self._step_key = None
+        self._entries: Dict[tuple, StepPredictions] = {}
+        self._requested_depths: Dict[tuple, int] = {}
+        self._depth_hints: Dict[tuple, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def for_env(env: RailEnv) -> 'PredictionCache':
+        cache = getattr(env, 'prediction_cache', None)
+        if cache is None or cache.env is not env:
+            cache = PredictionCache(env)
+            env.prediction_cache = cache
+        return cache
+
+    def invalidate(self):
+        self._step_key = None
+        self._entries = {}
+        self._depth_hints = self._requested_depths
+        self._requested_depths = {}
+
+    def get(self, predictor: PredictionBuilder,
+            positions: Optional[dict] = None, directions: Optional[dict] = None) -> StepPredictions:
+        env = self.env
+        step_key = (env._elapsed_steps, id(env.rail), self._agents_key(env))
+        if step_key != self._step_key:
+            self.invalidate()
+            self._step_key = step_key
+
+        # the predictor only uses the directions of the overridden positions, agents without an overridden
+        # direction keep their current one
+        positions = {int(h): tuple(p) for h, p in (positions or {}).items() if p is not None}
+        directions = directions or {}
+        directions = {h: int(directions[h] if directions.get(h, None) is not None else env.agents[h].direction)
+                      for h in positions}
+        key = (self._predictor_key(predictor), tuple(sorted(positions.items())), tuple(sorted(directions.items())))
+        max_depth = predictor.max_depth
+        self._requested_depths[key] = max(max_depth, self._requested_depths.get(key, 0))
+
+        entry = self._entries.get(key, None)
+        if entry is None or entry.max_depth < max_depth:
+            self.misses += 1
+            entry = self._predict(predictor, max(max_depth, self._depth_hints.get(key, 0)), positions, directions)
+            self._entries[key] = entry
+        else:
+            self.hits += 1
+            env.dev_pred_dict.update(entry.dev_pred_dict)
+        return entry.truncated(max_depth)
+
+    def _predict(self, predictor: PredictionBuilder, max_depth: int, positions: dict,
+                 directions: dict) -> StepPredictions:
+        if max_depth != predictor.max_depth:
+            predictor = copy.copy(predictor)
+            predictor.max_depth = max_depth
+        if positions:
+            predictions = predictor.get(positions=positions, directions=directions)
+        else:
+            predictions = predictor.get()
+        entry = StepPredictions(self.env.width, max_depth, predictions)
+        entry.dev_pred_dict = {h: self.env.dev_pred_dict[h] for h in predictions if h in self.env.dev_pred_dict}
+        return entry
+
+    @staticmethod
+    def _predictor_key(predictor: PredictionBuilder):
+        max_depth = None if getattr(predictor, 'truncatable', False) else predictor.max_depth
+        return type(predictor), max_depth, getattr(predictor, 'branch_only', False)
+
+    @staticmethod
+    def _agents_key(env: RailEnv):
+        return tuple((a.status, a.position, a.direction, a.target, a.malfunction_data['malfunction'],
+                      a.speed_data['position_fraction']) for a in env.agents)
@@ -1,12 +1,13 @@
 from collections import defaultdict
 
 import numpy as np
-from flatland.core.grid.grid_utils import coordinate_to_position, position_to_coordinate
+from flatland.core.grid.grid_utils import coordinate_to_position
 from flatland.envs.rail_env import RailEnv
 from flatland.envs.rail_env_shortest_paths import get_valid_move_actions_
 
 from flatlander.envs.observations.common.conflict_detector import ConflictDetector
 from flatlander.envs.observations.common.malf_shortest_path_predictor import MalfShortestPathPredictorForRailEnv
+from flatlander.envs.observations.common.prediction_cache import PredictionCache
 from flatlander.envs.observations.common.utils import reverse_dir
 from flatlander.utils.helper import get_save_agent_pos
 
@@ -27,7 +28,7 @@ class ShortestPathConflictDetector(ConflictDetector):
     def set_env(self, rail_env: RailEnv):
         self.rail_env = rail_env
         self.distance_map = self.rail_env.distance_map.get()
-        self.nan_inf_mask = ((self.distance_map != np.inf) * (np.abs(np.isnan(self.distance_map) - 1))).astype(np.bool)
+        self.nan_inf_mask = ((self.distance_map != np.inf) * (np.abs(np.isnan(self.distance_map) - 1))).astype(bool)
         self.max_distance = np.max(self.distance_map[self.nan_inf_mask])
         max_agent_dist = np.max([self.distance_map[a.handle][a.initial_position + (a.initial_direction,)]
                                  for a in self.rail_env.agents])
@@ -49,22 +50,10 @@ class ShortestPathConflictDetector(ConflictDetector):
         if handles is None:
             handles = [a.handle for a in self.rail_env.agents]
         if self._predictor:
-            self.max_prediction_depth = 0
-            self.predicted_pos = {}
-            self.predicted_dir = {}
-            predictions = self._predictor.get(handles=handles, positions=positions, directions=directions)
-            if predictions:
-                for t in range(self._predictor.max_depth + 1):
-                    pos_list = []
-                    dir_list = []
-                    for a in handles:
-                        if predictions[a] is None:
-                            continue
-                        pos_list.append(predictions[a][t][1:3])
-                        dir_list.append(predictions[a][t][3])
-                    self.predicted_pos.update({t: coordinate_to_position(self.rail_env.width, pos_list)})
-                    self.predicted_dir.update({t: dir_list})
-                self.max_prediction_depth = len(self.predicted_pos)
+            step_predictions = PredictionCache.for_env(self.rail_env).get(self._predictor, positions=positions,
+                                                                          directions=directions)
+            self.predicted_pos, self.predicted_dir = step_predictions.positions(handles)
+            self.max_prediction_depth = len(self.predicted_pos)
 
     def detect_conflicts(self, handles=None, positions=None, directions=None):
         if self.multi_shortest_path:
@@ -88,35 +77,31 @@ class ShortestPathConflictDetector(ConflictDetector):
         if handles is None:
             handles = [a.handle for a in self.rail_env.agents]
 
-        handles = np.array(handles)
-        predictions = self._predictor.get(handles=handles, positions=positions,
-                                          directions=directions)
-        self.predicted_pos = {}
-        self.predicted_dir = {}
+        handles = [int(h) for h in handles]
+        step_predictions = PredictionCache.for_env(self.rail_env).get(self._predictor, positions=positions,
+                                                                      directions=directions)
+        self.predicted_pos, self.predicted_dir = step_predictions.positions(handles)
+        cell_handles = step_predictions.cell_handles(handles)
+        handle_idx = {h: i for i, h in enumerate(handles)}
+
         agent_conflict_handles = defaultdict(lambda: [])
         agent_malfunctions = defaultdict(lambda: [])
         for t in range(self._predictor.max_depth + 1):
             pred_times = [max(0, t - 1), t]
 
-            for i in range(len(handles)):
+            for i, h in enumerate(handles):
                 for pt in pred_times:
-                    self.accumulate_predictions(t, pt, handles, predictions)
-                    handle_mask = np.zeros(len(handles))
-                    handle_mask[i] = np.inf
-                    masked_preds = self.predicted_pos[pt] + handle_mask
-                    conf_handles = np.where(self.predicted_pos[t][i] == masked_preds)
-                    conf_dirs = np.where(self.predicted_dir[t][i] != self.predicted_dir[pt][conf_handles])
-                    conf_idx = conf_handles[0][conf_dirs]
-                    conf_handles = handles[conf_idx]
-
-                    for ci in conf_idx:
-                        malf_dir = np.isnan(self.predicted_dir[pt][ci])
-                        agent_conflict_handles[handles[i]].append(handles[ci])
+                    conf_handles = [ch for ch in cell_handles.get((pt, self.predicted_pos[t][i]), [])
+                                    if ch != h and self.predicted_dir[t][i] != self.predicted_dir[pt][handle_idx[ch]]]
+
+                    for ch in conf_handles:
+                        malf_dir = np.isnan(self.predicted_dir[pt][handle_idx[ch]])
+                        agent_conflict_handles[h].append(ch)
                         if malf_dir:
-                            malf_current = self.rail_env.agents[handles[ci]].malfunction_data['malfunction']
+                            malf_current = self.rail_env.agents[ch].malfunction_data['malfunction']
                             malf_remaining = max(malf_current - pt, 0)
-                            agent_conflict_handles[handles[i]].extend(list(conf_handles))
-                            agent_malfunctions[handles[ci]].append(min(malf_remaining, 0))
+                            agent_conflict_handles[h].extend(conf_handles)
+                            agent_malfunctions[ch].append(min(malf_remaining, 0))
 
         return agent_conflict_handles, agent_malfunctions
 
@@ -196,19 +181,3 @@ class ShortestPathConflictDetector(ConflictDetector):
         if best_next_action is None:
             return [position], [direction]
         return [best_next_action.next_position], [best_next_action.next_direction]
-
-    def accumulate_predictions(self, t, pt, handles, predictions):
-        if self.predicted_pos.get(t, None) is None:
-            self.predicted_pos[t], self.predicted_dir[t] = self._get_predictions(t, handles,
-                                                                                 predictions)
-        if self.predicted_pos.get(pt, None) is None:
-            self.predicted_pos[pt], self.predicted_dir[pt] = self._get_predictions(pt, handles,
-                                                                                   predictions)
-
-    def _get_predictions(self, timestep: int, handles: list, predictions):
-        positions = np.zeros(len(handles))
-        directions = np.zeros(len(handles))
-        for i, h in enumerate(handles):
-            positions[i] = coordinate_to_position(self.rail_env.width, [predictions[h][timestep][1:3]])[0]
-            directions[i] = (predictions[h][timestep][3])
-        return positions, directions
@@ -0,0 +1,47 @@
+import weakref
+
+import numpy as np
+from flatland.core.transition_map import GridTransitionMap
+
+_TRANSITION_BITS = np.arange(15, -1, -1, dtype=np.uint16)
+
+_transition_cache = weakref.WeakKeyDictionary()
+
+
+def get_transition_tensor(rail: GridTransitionMap) -> np.ndarray:
+    """
+    Returns the (height, width, 16) transition bits of the rail, most significant bit first (same layout as
+    flatland's GlobalObsForRailEnv). Decoded once per rail and shared by all observation builders.
+    """
+    return _get_cached(rail, None, lambda: _decode_transitions(rail.grid))
+
+
+def get_padded_transition_tensor(rail: GridTransitionMap, max_height: int, max_width: int) -> np.ndarray:
+    """
+    Returns the transition tensor of the rail zero padded to (max_height, max_width, 16).
+    """
+    def pad():
+        transitions = get_transition_tensor(rail)
+        pad_height, pad_width = max_height - rail.height, max_width - rail.width
+        assert pad_height >= 0 and pad_width >= 0
+        return np.pad(transitions, ((0, pad_height), (0, pad_width), (0, 0)), constant_values=0)
+
+    return _get_cached(rail, (max_height, max_width), pad)
+
+
+def _decode_transitions(grid: np.ndarray) -> np.ndarray:
+    bits = (grid.astype(np.uint16)[..., np.newaxis] >> _TRANSITION_BITS) & 1
+    return bits.astype(np.float64)
+
+
+def _get_cached(rail: GridTransitionMap, key, compute):
+    grid, entries = _transition_cache.get(rail, (None, None))
+    # a new grid on the same rail object means the rail was regenerated
+    if grid is not rail.grid:
+        entries = {}
+        _transition_cache[rail] = (rail.grid, entries)
+    if key not in entries:
+        tensor = compute()
+        tensor.flags.writeable = False
+        entries[key] = tensor
+    return entries[key]
@@ -1,16 +1,20 @@
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 import gym
 import numpy as np
 from flatland.core.env_observation_builder import ObservationBuilder
 from flatland.core.grid.grid4_utils import get_new_position
-from flatland.core.grid.grid_utils import coordinate_to_position
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.envs.rail_env import RailEnv
 
-from flatlander.algorithms.graph_coloring import GreedyGraphColoring, ShufflingGraphColoring
+from flatlander.algorithms.graph_coloring import IncrementalGraphColoring
 from flatlander.envs.observations import register_obs, Observation
+from flatlander.envs.observations.common.prediction_cache import PredictionCache
 from flatlander.envs.observations.common.predictors import get_predictor
+from flatlander.envs.observations.common.transition_cache import get_transition_tensor
+
+# row/column offsets of the movements N, E, S, W
+_MOVEMENT_OFFSETS = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]])
 
 
 @register_obs("shortest_path_priority_conflict")
@@ -40,6 +44,8 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
         self._prev_other_path_conflict_map = {}
         self._prev_sp_prios = {}
         self._prev_other_prios = {}
+        self._sp_coloring.reset()
+        self._other_coloring.reset()
 
     def set_env(self, env):
         self.predictor.set_env(env)
@@ -53,11 +59,16 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
         self._prev_other_path_conflict_map = {}
         self._prev_sp_prios = {}
         self._prev_other_prios = {}
+        # the order of the colors matters, the previous colorings are kept to only recolor changed conflicts
+        self._sp_coloring = IncrementalGraphColoring(colors=[1, 0])
+        self._other_coloring = IncrementalGraphColoring(colors=[1, 0])
         self.predictor = predictor
         self._directions = list(range(4))
         self._path_size = len(self._directions) + 3
         self._encode_one_hot = encode_one_hot
         self._asserts = asserts
+        self._path_conflicts = {}
+        self._max_distance = None
 
     def get_many(self, handles: Optional[List[int]] = None):
 
@@ -65,22 +76,10 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
         self._other_path_conflict_map = {handle: [] for handle in handles}
 
         if self.predictor:
-            self.max_prediction_depth = 0
-            self.predicted_pos = {}
-            self.predicted_dir = {}
-            self.predictions = self.predictor.get()
-            if self.predictions:
-                for t in range(self.predictor.max_depth + 1):
-                    pos_list = []
-                    dir_list = []
-                    for a in handles:
-                        if self.predictions[a] is None:
-                            continue
-                        pos_list.append(self.predictions[a][t][1:3])
-                        dir_list.append(self.predictions[a][t][3])
-                    self.predicted_pos.update({t: coordinate_to_position(self.env.width, pos_list)})
-                    self.predicted_dir.update({t: dir_list})
-                self.max_prediction_depth = len(self.predicted_pos)
+            step_predictions = PredictionCache.for_env(self.env).get(self.predictor)
+            self.predictions = step_predictions.predictions
+            self.predicted_pos, self.predicted_dir = step_predictions.positions(handles)
+            self.max_prediction_depth = len(self.predicted_pos)
         # Update local lookup table for all agents' positions
         # ignore other agents not in the grid (only status active and done)
         # self.location_has_agent = {tuple(agent.position): 1 for agent in self.env.agents if
@@ -106,17 +105,22 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
                 self.location_has_agent_ready_to_depart[tuple(_agent.initial_position)] = \
                     self.location_has_agent_ready_to_depart.get(tuple(_agent.initial_position), 0) + 1
 
-        self._conflict_map = {handle: [] for handle in handles}
-        obs_dict = {handle: self.get(handle) for handle in handles}
+        distance_map = self.env.distance_map.get()
+        self._max_distance = np.max(distance_map[np.isfinite(distance_map)])
+        self._path_conflicts = self._detect_path_conflicts(handles)
+        for handle, conflicts in self._path_conflicts.items():
+            for i, ch in enumerate(conflicts):
+                if ch is not None and i == 0:
+                    self._shortest_path_conflict_map[handle].append(ch)
+                elif ch is not None:
+                    self._other_path_conflict_map[handle].append(ch)
 
-        # the order of the colors matters
-        sp_priorities = GreedyGraphColoring.color(colors=[1, 0],
-                                                  nodes=obs_dict.keys(),
-                                                  neighbors=self._shortest_path_conflict_map)
+        obs_dict = {handle: self.get(handle) for handle in handles}
 
-        op_priorities = GreedyGraphColoring.color(colors=[1, 0],
-                                                  nodes=obs_dict.keys(),
-                                                  neighbors=self._other_path_conflict_map)
+        sp_priorities = self._sp_coloring.color(nodes=obs_dict.keys(),
+                                                neighbors=self._shortest_path_conflict_map)
+        op_priorities = self._other_coloring.color(nodes=obs_dict.keys(),
+                                                   neighbors=self._other_path_conflict_map)
         for handle, obs in obs_dict.items():
             if obs is not None:
                 obs[0][6] = sp_priorities[handle]
@@ -149,10 +153,10 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
 
         possible_transitions = self.env.rail.get_transitions(*agent_virtual_position, agent.direction)
         distance_map = self.env.distance_map.get()
-        nan_inf_mask = ((distance_map != np.inf) * (np.abs(np.isnan(distance_map) - 1))).astype(np.bool)
-        max_distance = np.max(distance_map[nan_inf_mask])
+        max_distance = self._max_distance
         assert not np.isnan(max_distance)
         assert max_distance != np.inf
+        conflicts = self._path_conflicts.get(handle, [])
         possible_steps = []
 
         # look in all directions for possible moves
@@ -164,20 +168,7 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
                 distance = max_distance if (
                         distance == np.inf or np.isnan(distance)) else distance
 
-                cell_transitions = self.env.rail.get_transitions(*pos, movement)
-                _, ch = self.detect_conflicts(1,
-                                              np.reciprocal(agent.speed_data["speed"]),
-                                              pos,
-                                              cell_transitions,
-                                              handle,
-                                              movement)
-
-                conflict = ch is not None
-
-                if conflict and len(possible_steps) == 0:
-                    self._shortest_path_conflict_map[handle].append(ch)
-                elif conflict:
-                    self._other_path_conflict_map[handle].append(ch)
+                conflict = conflicts[len(possible_steps)] is not None
 
                 if self._encode_one_hot:
                     next_move_one_hot = np.zeros(len(self._directions))
@@ -195,88 +186,130 @@ class ConflictPriorityShortestPathObservationBuilder(ObservationBuilder):
 
         return obs, int(agent.status.value != RailAgentStatus.READY_TO_DEPART)
 
-    def _reverse_dir(self, direction):
-        return int((direction + 2) % 4)
-
-    def detect_conflicts(self, tot_dist,
-                         time_per_cell,
-                         position,
-                         cell_transitions,
-                         handle,
-                         direction):
-
-        potential_conflict = np.inf
-        conflict_handle = None
-        predicted_time = int(tot_dist * time_per_cell)
-        while self.predictor and predicted_time < self.max_prediction_depth:
-            predicted_time = int(tot_dist * time_per_cell)
-            int_position = coordinate_to_position(self.env.width, [position])
-            if tot_dist < self.max_prediction_depth:
-
-                pre_step = max(0, predicted_time - 1)
-                post_step = min(self.max_prediction_depth - 1, predicted_time + 1)
-
-                # Look for conflicting paths at distance tot_dist
-                if int_position in np.delete(self.predicted_pos[predicted_time], handle, 0):
-                    conflicting_agent = np.where(self.predicted_pos[predicted_time] == int_position)
-                    for ca in conflicting_agent[0]:
-                        if direction != self.predicted_dir[predicted_time][ca] and cell_transitions[
-                            self._reverse_dir(
-                                self.predicted_dir[predicted_time][ca])] == 1 and tot_dist < potential_conflict:
-                            potential_conflict = tot_dist
-                            conflict_handle = ca
-                        if self.env.agents[ca].status == RailAgentStatus.DONE and tot_dist < potential_conflict:
-                            potential_conflict = tot_dist
-                            conflict_handle = ca
-
-                # Look for conflicting paths at distance num_step-1
-                elif int_position in np.delete(self.predicted_pos[pre_step], handle, 0):
-                    conflicting_agent = np.where(self.predicted_pos[pre_step] == int_position)
-                    for ca in conflicting_agent[0]:
-                        if direction != self.predicted_dir[pre_step][ca] \
-                                and cell_transitions[self._reverse_dir(self.predicted_dir[pre_step][ca])] == 1 \
-                                and tot_dist < potential_conflict:  # noqa: E125
-                            potential_conflict = tot_dist
-                            conflict_handle = ca
-                        if self.env.agents[ca].status == RailAgentStatus.DONE and tot_dist < potential_conflict:
-                            potential_conflict = tot_dist
-                            conflict_handle = ca
-
-                # Look for conflicting paths at distance num_step+1
-                elif int_position in np.delete(self.predicted_pos[post_step], handle, 0):
-                    conflicting_agent = np.where(self.predicted_pos[post_step] == int_position)
-                    for ca in conflicting_agent[0]:
-                        if direction != self.predicted_dir[post_step][ca] and cell_transitions[self._reverse_dir(
-                                self.predicted_dir[post_step][ca])] == 1 \
-                                and tot_dist < potential_conflict:  # noqa: E125
-                            potential_conflict = tot_dist
-                            conflict_handle = ca
-                        if self.env.agents[ca].status == RailAgentStatus.DONE and tot_dist < potential_conflict:
-                            potential_conflict = tot_dist
-                            conflict_handle = ca
-            tot_dist += 1
-            position, direction = self.get_shortest_path_position(position=position, direction=direction, handle=handle)
-
-        return potential_conflict, conflict_handle
-
-    def get_shortest_path_position(self, position, direction, handle):
-        distance_map = self.env.distance_map.get()
-        nan_inf_mask = ((distance_map != np.inf) * (np.abs(np.isnan(distance_map) - 1))).astype(np.bool)
-        max_dist = np.max(self.env.distance_map.get()[nan_inf_mask])
-
-        possible_transitions = self.env.rail.get_transitions(*position, direction)
-        min_dist = np.inf
-        sp_move = None
-        sp_pos = None
-
-        for movement in self._directions:
-            if possible_transitions[movement]:
-                pos = get_new_position(position, movement)
-                distance = self.env.distance_map.get()[handle][pos + (movement,)]
-                distance = max_dist if (distance == np.inf or np.isnan(distance)) else distance
-                if distance <= min_dist:
-                    min_dist = distance
-                    sp_move = movement
-                    sp_pos = pos
-
-        return sp_pos, sp_move
+    @staticmethod
+    def _virtual_position(agent):
+        if agent.status == RailAgentStatus.READY_TO_DEPART:
+            return agent.initial_position
+        elif agent.status == RailAgentStatus.ACTIVE:
+            return agent.position
+        elif agent.status == RailAgentStatus.DONE:
+            return agent.target
+        return None
+
+    def _detect_path_conflicts(self, handles) -> Dict[int, List[Optional[int]]]:
+        """
+        Rolls out the possible paths of all agents (one per possible first move, following the shortest path
+        afterwards) as arrays and finds the first conflicting agent on every path with one (t, cell) join
+        against the predicted positions of all agents.
+
+        An agent conflicts with a path cell if it is predicted on the cell at the predicted time (or one step
+        before/after if there is none at the predicted time) and is heading the opposite direction or is done.
+        """
+        env = self.env
+        walkers = []
+        for handle in handles:
+            agent = env.agents[handle]
+            position = self._virtual_position(agent)
+            if position is None:
+                continue
+            possible_transitions = env.rail.get_transitions(*position, agent.direction)
+            for movement in self._directions:
+                if possible_transitions[movement]:
+                    pos = get_new_position(position, movement)
+                    walkers.append((handle, pos[0], pos[1], movement, np.reciprocal(agent.speed_data["speed"])))
+
+        path_conflicts = {handle: [None] * sum(1 for w in walkers if w[0] == handle) for handle in handles}
+        if not self.predictor or len(walkers) == 0:
+            return path_conflicts
+
+        walker_handles = np.array([w[0] for w in walkers])
+        rows = np.array([w[1] for w in walkers])
+        cols = np.array([w[2] for w in walkers])
+        directions = np.array([w[3] for w in walkers])
+        time_per_cell = np.array([w[4] for w in walkers], dtype=float)
+        n_walkers = len(walkers)
+        max_depth = self.max_prediction_depth
+
+        transitions = get_transition_tensor(env.rail).reshape(env.height, env.width, 4, 4).astype(bool)
+        distance_map = env.distance_map.get()
+        first_cell_transitions = transitions[rows, cols, directions]
+
+        # shortest path roll out, the walk follows the last movement with the minimal distance
+        n_steps = max(max_depth - 1, 0)
+        path_cells = np.zeros((n_walkers, n_steps), dtype=int)
+        path_dirs = np.zeros((n_walkers, n_steps), dtype=int)
+        reached = np.ones((n_walkers, n_steps), dtype=bool)
+        for k in range(n_steps):
+            path_cells[:, k] = cols * env.width + rows
+            path_dirs[:, k] = directions
+            if k == n_steps - 1:
+                break
+            possible = transitions[rows, cols, directions]
+            next_rows = np.clip(rows[:, np.newaxis] + _MOVEMENT_OFFSETS[:, 0], 0, env.height - 1)
+            next_cols = np.clip(cols[:, np.newaxis] + _MOVEMENT_OFFSETS[:, 1], 0, env.width - 1)
+            distances = distance_map[walker_handles[:, np.newaxis], next_rows, next_cols, np.arange(4)]
+            distances = np.where(np.isfinite(distances), distances, self._max_distance)
+            distances = np.where(possible, distances, np.inf)
+            moves = 3 - np.argmin(distances[:, ::-1], axis=1)
+            reached[:, k + 1] = reached[:, k] & np.any(possible, axis=1)
+            steps = np.arange(n_walkers)
+            rows, cols, directions = next_rows[steps, moves], next_cols[steps, moves], moves
+
+        # path step k is at distance k + 1, it is checked as long as the predicted time of the previous
+        # distance lies within the prediction
+        dists = np.arange(1, n_steps + 1)
+        times = np.floor(dists[np.newaxis, :] * time_per_cell[:, np.newaxis]).astype(int)
+        prev_times = np.floor(np.maximum(dists - 1, 1)[np.newaxis, :] * time_per_cell[:, np.newaxis]).astype(int)
+        active = np.cumprod((prev_times < max_depth) & (times < max_depth) & reached, axis=1).astype(bool)
+
+        predicted_pos = np.array([self.predicted_pos[t] for t in range(max_depth)])
+        predicted_dir = np.array([self.predicted_dir[t] for t in range(max_depth)])
+        done = np.array([agent.status == RailAgentStatus.DONE for agent in env.agents])
+
+        # (t, cell) index of the predicted positions, agents ascending per key
+        n_cells = max(np.max(predicted_pos), np.max(path_cells, initial=0)) + 1
+        pred_t, pred_agents = np.nonzero(predicted_pos >= 0)
+        pred_keys = pred_t * n_cells + predicted_pos[pred_t, pred_agents]
+        order = np.lexsort((pred_agents, pred_keys))
+        pred_keys, pred_agents = pred_keys[order], pred_agents[order]
+
+        q_walkers, q_steps = np.nonzero(active)
+        q_cells = path_cells[q_walkers, q_steps]
+        q_handles = walker_handles[q_walkers]
+        q_times = times[q_walkers, q_steps]
+        candidate_times = [q_times, np.maximum(q_times - 1, 0), np.minimum(q_times + 1, max_depth - 1)]
+
+        # predicted time first, one step before/after only if no other agent is on the cell at that time
+        chosen_times = np.full(len(q_walkers), -1)
+        for t in candidate_times:
+            keys = t * n_cells + q_cells
+            n_matches = np.searchsorted(pred_keys, keys, side='right') - np.searchsorted(pred_keys, keys)
+            n_other = n_matches - (predicted_pos[t, q_handles] == q_cells)
+            chosen_times = np.where((chosen_times < 0) & (n_other > 0), t, chosen_times)
+
+        matched = np.flatnonzero(chosen_times >= 0)
+        keys = chosen_times[matched] * n_cells + q_cells[matched]
+        lo = np.searchsorted(pred_keys, keys)
+        sizes = np.searchsorted(pred_keys, keys, side='right') - lo
+        query = np.repeat(matched, sizes)
+        agents = pred_agents[np.repeat(lo, sizes) + np.arange(np.sum(sizes)) - np.repeat(np.cumsum(sizes) - sizes,
+                                                                                        sizes)]
+        agent_dirs = predicted_dir[chosen_times[query], agents]
+        reverse_dirs = (agent_dirs.astype(int) + 2) % 4
+        opposite = (path_dirs[q_walkers[query], q_steps[query]] != agent_dirs) & \
+                   first_cell_transitions[q_walkers[query], reverse_dirs]
+        conflicting = opposite | done[agents]
+
+        # first conflicting agent of the first conflicting step of every walker
+        query, agents = query[conflicting], agents[conflicting]
+        walkers_hit, first = np.unique(q_walkers[query], return_index=True)
+        conflict_handles = agents[first]
+
+        path_of_walker = np.zeros(n_walkers, dtype=int)
+        for w in range(1, n_walkers):
+            if walker_handles[w] == walker_handles[w - 1]:
+                path_of_walker[w] = path_of_walker[w - 1] + 1
+        for w, ch in zip(walkers_hit, conflict_handles):
+            path_conflicts[walker_handles[w]][path_of_walker[w]] = int(ch)
+
+        return path_conflicts
@@ -16,7 +16,7 @@ class ProjectedDensityObservation(Observation):
     def __init__(self, config) -> None:
         super().__init__(config)
         self._builder = ProjectedDensityForRailEnv(config['height'], config['width'], config['encoding'],
-                                                   config['max_t'])
+                                                   config['max_t'], config.get('sparse', False))
 
     def builder(self) -> ObservationBuilder:
         return self._builder
@@ -31,10 +31,11 @@ class ProjectedDensityObservation(Observation):
 
 class ProjectedDensityForRailEnv(ObservationBuilder):
 
-    def __init__(self, height, width, encoding='exp_decay', max_t=10):
+    def __init__(self, height, width, encoding='exp_decay', max_t=10, sparse=False):
         super().__init__()
         self._height = height
         self._width = width
+        self._sparse = sparse
         self._depth = max_t + 1 if encoding == 'series' else 1
         if encoding == 'exp_decay':
             self._encode = lambda t: np.exp(-t / np.sqrt(max_t))
@@ -53,6 +54,8 @@ class ProjectedDensityForRailEnv(ObservationBuilder):
         get density maps for agents and compose the observation with agent's and other's density maps
         """
         self._predictions = self._predictor.get()
+        if self._sparse:
+            return self._get_many_sparse(handles)
         density_maps = dict()
         for handle in handles:
             density_maps[handle] = self.get(handle)
@@ -63,6 +66,43 @@ class ProjectedDensityForRailEnv(ObservationBuilder):
             obs[handle] = [density_maps[handle], others_density]
         return obs
 
+    def _get_many_sparse(self, handles: List[int]) -> Dict[int, np.ndarray]:
+        """
+        same observation as get_many, but the agents' density maps are kept as (cell, value) pairs and the
+        others density is derived from the sum over all agents, dense maps are only built for the output
+        """
+        sparse_maps = {handle: self._get_sparse(handle) for handle in handles}
+        density_sum = np.zeros(self._height * self._width * self._depth)
+        for cells, values in sparse_maps.values():
+            density_sum[cells] += values
+        nr_others = max(len(handles) - 1, 1)
+
+        obs = dict()
+        for handle, (cells, values) in sparse_maps.items():
+            density_map = np.zeros(density_sum.shape, dtype=np.float32)
+            density_map[cells] = values
+            others_density = density_sum.copy()
+            others_density[cells] -= values
+            others_density /= nr_others
+            obs[handle] = [density_map.reshape(self.observation_shape),
+                           others_density.astype(np.float32).reshape(self.observation_shape)]
+        return obs
+
+    def _get_sparse(self, handle: int) -> (np.ndarray, np.ndarray):
+        """
+        flat (cell, depth) indices and values of the agent's density map, for cells visited several times
+        the last prediction is kept as in get()
+        """
+        if self._predictions[handle] is None:
+            return np.empty(0, dtype=int), np.empty(0)
+        prediction = np.asarray(self._predictions[handle])
+        t = np.flatnonzero(~np.isnan(prediction[:, 1]))
+        d = t if self._depth > 1 else 0
+        cells = (prediction[t, 1].astype(int) * self._width + prediction[t, 2].astype(int)) * self._depth + d
+        cells, last = np.unique(cells[::-1], return_index=True)
+        values = np.broadcast_to(self._encode(t), t.shape)[::-1][last]
+        return cells, values
+
     def get(self, handle: int = 0):
         """
         compute density map for agent: a value is asigned to every cell along the shortest path between
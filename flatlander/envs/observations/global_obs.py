@@ -1,11 +1,16 @@
+from typing import Optional, List
+
 import gym
 import numpy as np
 
 from flatland.core.env import Environment
 from flatland.core.env_observation_builder import ObservationBuilder
 from flatland.core.grid import grid4
-from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.agent_utils import RailAgentStatus
 from flatlander.envs.observations import Observation, register_obs
+from flatlander.envs.observations.builders.cached_global_obs import CachedGlobalObsForRailEnv
+from flatlander.envs.observations.common.transition_cache import get_padded_transition_tensor
+from flatlander.utils.helper import get_agent_pos
 
 '''
 A 2-d array matrix on-hot encoded similar to tf.one_hot function
@@ -19,7 +24,7 @@ def one_hot2d(arr, depth):
 
 def preprocess_obs(obs):
     transition_map, agents_state, targets = obs
-    new_agents_state = agents_state.transpose([2, 0, 1])
+    new_agents_state = np.moveaxis(agents_state, -1, 0)
     *states, = new_agents_state
     processed_agents_state_layers = []
     for i, feature_layer in enumerate(states):
@@ -37,43 +42,142 @@ def preprocess_obs(obs):
     return np.concatenate([transition_map, targets] + processed_agents_state_layers, axis=-1)
 
 
+def expand_ego_channels(shared_obs, ego):
+    """
+    rebuild the per agent observation from the shared observation and the agent's ego vector
+    [target row, target col, position row, position col, direction, on grid], see GlobalObsModel for the
+    tensorflow version
+    """
+    height, width = shared_obs.shape[:2]
+    ego = ego.astype(int)
+    no_agent = one_hot2d(np.zeros((height, width), dtype=int), depth=len(grid4.Grid4TransitionsEnum) + 1)
+    own_target = np.zeros((height, width, 1))
+    own_target[ego[0], ego[1]] = 1
+    own_direction = no_agent.copy()
+    others_direction = shared_obs[..., 23:28].copy()
+    if ego[2] >= 0:
+        own_direction[ego[2], ego[3]] = one_hot2d(ego[4] + 1, depth=len(grid4.Grid4TransitionsEnum) + 1)
+        if ego[5]:
+            others_direction[ego[2], ego[3]] = no_agent[ego[2], ego[3]]
+    return np.concatenate([shared_obs[..., :16], own_target, shared_obs[..., 17:18], own_direction,
+                           others_direction, shared_obs[..., 28:]], axis=-1)
+
+
 @register_obs("global")
 class GlobalObservation(Observation):
 
     def __init__(self, config) -> None:
         super().__init__(config)
         self._config = config
-        self._builder = PaddedGlobalObsForRailEnv(max_width=config['max_width'], max_height=config['max_height'])
+        self._builder = PaddedGlobalObsForRailEnv(max_width=config['max_width'], max_height=config['max_height'],
+                                                  shared=config.get('shared', False))
 
     def builder(self) -> ObservationBuilder:
         return self._builder
 
     def observation_space(self) -> gym.Space:
         grid_shape = (self._config['max_width'], self._config['max_height'])
+        if self._config.get('shared', False):
+            return gym.spaces.Tuple([
+                gym.spaces.Box(low=0, high=np.inf, shape=grid_shape + (31,), dtype=np.float32),  # shared
+                gym.spaces.Box(low=-1, high=max(grid_shape), shape=(6,), dtype=np.float32),  # ego
+            ])
         return gym.spaces.Box(low=0, high=np.inf, shape=grid_shape + (31,), dtype=np.float32)
 
 
 class PaddedGlobalObsForRailEnv(ObservationBuilder):
+    """
+    With shared=True the observation of an agent is a tuple of the global observation, which is computed once per
+    step and shared by all agents (own target/direction channels empty, other agents channel containing all agents),
+    and a compact ego vector from which the model rebuilds the agent's own channels (see expand_ego_channels).
+    """
 
-    def __init__(self, max_width, max_height):
+    def __init__(self, max_width, max_height, shared=False):
         super().__init__()
         self._max_width = max_width
         self._max_height = max_height
-        self._builder = GlobalObsForRailEnv()
+        self._shared = shared
+        self._builder = CachedGlobalObsForRailEnv()
+        self._padded_rail_obs = None
 
     def set_env(self, env: Environment):
+        super().set_env(env)
         self._builder.set_env(env)
 
     def reset(self):
+        # the static transition map is decoded and padded once per rail, only the agent channels change per step
         self._builder.reset()
+        self._padded_rail_obs = get_padded_transition_tensor(self.env.rail, self._max_height, self._max_width)
 
     def get(self, handle: int = 0):
-        obs = list(self._builder.get(handle))
-        height, width = obs[0].shape[:2]
+        _, agents_state, targets = self._builder.get(handle)
+        height, width = agents_state.shape[:2]
         pad_height, pad_width = self._max_height - height, self._max_width - width
-        obs[1] = obs[1] + 1  # get rid of -1
+        agents_state = agents_state + 1  # get rid of -1
         assert pad_height >= 0 and pad_width >= 0
-        return preprocess_obs(tuple([
-            np.pad(o, ((0, pad_height), (0, pad_height), (0, 0)), constant_values=0)
-            for o in obs
+        return preprocess_obs(tuple([self._padded_rail_obs] + [
+            np.pad(o, ((0, pad_height), (0, pad_width), (0, 0)), constant_values=0)
+            for o in (agents_state, targets)
         ]))
+
+    def get_many(self, handles: Optional[List[int]] = None):
+        if not self._shared:
+            return super().get_many(handles)
+        if handles is None:
+            handles = []
+        shared_obs = self._get_shared()
+        return {h: (shared_obs, self._get_ego(h)) for h in handles}
+
+    def _get_shared(self):
+        return self._get_shared_batch([self])[0]
+
+    @staticmethod
+    def get_many_batch(builders: List['PaddedGlobalObsForRailEnv'], handles: List[List[int]]) -> List[dict]:
+        """
+        Builds the observations of several envs, the shared observations of all envs as one tensor.
+        """
+        if not all(b._shared for b in builders) \
+                or len({(b._max_height, b._max_width) for b in builders}) > 1:
+            return [b.get_many(h) for b, h in zip(builders, handles)]
+        shared_obs = PaddedGlobalObsForRailEnv._get_shared_batch(builders)
+        return [{h: (shared_obs[i], b._get_ego(h)) for h in hs} for i, (b, hs) in enumerate(zip(builders, handles))]
+
+    @staticmethod
+    def _get_shared_batch(builders: List['PaddedGlobalObsForRailEnv']) -> np.ndarray:
+        max_height, max_width = builders[0]._max_height, builders[0]._max_width
+        # agent channels are -1 on the grid (0 for the departure counts) before getting rid of -1, 0 in the padding
+        agents_state = np.zeros((len(builders), max_height, max_width, 5))
+        targets = np.zeros((len(builders), max_height, max_width, 2))
+        target_cells, position_cells, position_values, ready_cells = [], [], [], []
+        for i, builder in enumerate(builders):
+            env = builder.env
+            agents_state[i, :env.height, :env.width, 4] = 1
+            for agent in env.agents:
+                if agent.status == RailAgentStatus.DONE_REMOVED:
+                    continue
+                target_cells.append((i, *agent.target))
+                if agent.position is not None:
+                    position_cells.append((i, *agent.position))
+                    position_values.append((agent.direction, agent.malfunction_data['malfunction'],
+                                            agent.speed_data['speed']))
+                if agent.status == RailAgentStatus.READY_TO_DEPART:
+                    ready_cells.append((i, *agent.initial_position))
+
+        if target_cells:
+            cells = tuple(np.array(target_cells).T)
+            targets[cells + (1,)] = 1
+        if position_cells:
+            cells = tuple(np.array(position_cells).T)
+            agents_state[cells + (slice(1, 4),)] = np.array(position_values) + 1
+        if ready_cells:
+            cells = tuple(np.array(ready_cells).T)
+            np.add.at(agents_state, cells + (4,), 1)
+        transitions = np.stack([b._padded_rail_obs for b in builders])
+        return preprocess_obs((transitions, agents_state, targets))
+
+    def _get_ego(self, handle: int):
+        agent = self.env.agents[handle]
+        position = get_agent_pos(agent)
+        if position is None:
+            position = (-1, -1)
+        return np.array([*agent.target, *position, agent.direction, agent.position is not None], dtype=np.float32)
@@ -1,5 +1,4 @@
 import collections
-from itertools import combinations
 from typing import Optional, List, Dict, Union, Tuple
 
 import gym
@@ -49,9 +48,12 @@ class LocalConflictObsForRailEnvRLLibWrapper(ObservationBuilder):
     def __init__(self, local_conflict_obs_builder: TreeObsForRailEnv):
         super().__init__()
         self._builder = local_conflict_obs_builder
-        # To cache calculated agent states
-        # This is only computed once and reused for all other agents
+        # agent states of all agents, computed once per step and reused for all agents
         self.agent_states: Optional[Dict] = None
+        self._cache_key = None
+        self._episode = 0
+        self.hits = 0
+        self.misses = 0
 
     @property
     def observation_dim(self):
@@ -59,35 +61,58 @@ class LocalConflictObsForRailEnvRLLibWrapper(ObservationBuilder):
 
     def reset(self):
         self._builder.reset()
-
-    def get(self, handle: int = 0):
-        n_agents = self._builder.get_number_of_agents()
-        obs = []
-        for handle in range(n_agents):
-            obs.append(self._builder.get(handle))
-
-        if not self.agent_states:
+        self._episode += 1
+        self.agent_states = None
+        self._cache_key = None
+
+    def _get_agent_states(self) -> Dict:
+        cache_key = (self._episode, self.env._elapsed_steps)
+        if self.agent_states is None or cache_key != self._cache_key:
+            self.misses += 1
+            all_agent_observations = self._builder.get_many(list(range(self._builder.get_number_of_agents())))
             self.agent_states = create_agent_states(
-                obs, self._builder.predictor.max_depth)
+                all_agent_observations, self._builder.predictor.max_depth, self._builder.n_local)
+            self._cache_key = cache_key
+        else:
+            self.hits += 1
+        return self.agent_states
 
-        return self.agent_states[handle] \
-            if obs is not None else obs
+    def get(self, handle: int = 0):
+        return self._get_agent_states().get(handle, None)
+
+    @staticmethod
+    def get_many_batch(builders: List['LocalConflictObsForRailEnvRLLibWrapper'],
+                       handles: List[List[int]]) -> List[Dict]:
+        """
+        Builds the observations of several envs, detecting the conflicts of all envs in one pass.
+        """
+        configs = {(b._builder.predictor.max_depth, b._builder.n_local) for b in builders}
+        if len(configs) > 1:
+            return [b.get_many(h) for b, h in zip(builders, handles)]
+        max_depth, n_local = configs.pop()
+
+        pending = [b for b in builders if b.agent_states is None or b._cache_key != (b._episode, b.env._elapsed_steps)]
+        all_observations = [b._builder.get_many(list(range(b._builder.get_number_of_agents()))) for b in pending]
+        predicted_pos = [next((o.predicted_pos for o in reversed(list(obs.values())) if o is not None), None)
+                         for obs in all_observations]
+        batched = [i for i, pos in enumerate(predicted_pos) if pos is not None]
+        conflict_matrices = dict(zip(batched, get_agent_conflict_prediction_matrices(
+            [len(all_observations[i]) for i in batched], max_depth, [predicted_pos[i] for i in batched]))) \
+            if batched else {}
+        for i, (builder, obs) in enumerate(zip(pending, all_observations)):
+            builder.misses += 1
+            builder.agent_states = create_agent_states(obs, max_depth, n_local, conflict_matrices.get(i, None))
+            builder._cache_key = (builder._episode, builder.env._elapsed_steps)
+        return [b.get_many(h) for b, h in zip(builders, handles)]
 
     def get_many(self, handles: Optional[List[int]] = None):
-
-        all_agent_observations = self._builder.get_many(handles)
-        obs = dict()
         if handles is None:
             handles = []
-        for k in handles:
-            if not self.agent_states:
-                self.agent_states = create_agent_states(
-                    all_agent_observations, self._builder.predictor.max_depth)
-            obs[k] = self.agent_states[k]
-
-        return obs
+        agent_states = self._get_agent_states()
+        return {k: agent_states.get(k, None) for k in handles}
 
     def set_env(self, env):
+        super().set_env(env)
         self._builder.set_env(env)
 
 
@@ -126,6 +151,7 @@ class LocalConflictObsForRailEnv(TreeObsForRailEnv):
     def __init__(self, max_depth: int, predictor: PredictionBuilder = None,
                  n_local: int = 5):
         super().__init__(max_depth, predictor)
+        self.n_local = n_local
         self.observation_dim = 1 + 3 * (n_local - 1) + 22 * n_local
 
     def reset(self):
@@ -207,7 +233,9 @@ class LocalConflictObsForRailEnv(TreeObsForRailEnv):
             observation2[idx[1]] = 1
 
         min_distances = np.sort(min_distances)
-        incremental_distances = np.diff(np.sort(min_distances))
+        # inf - inf of the missing transitions is set to 0 below, also if numpy is set to raise
+        with np.errstate(invalid='ignore'):
+            incremental_distances = np.diff(np.sort(min_distances))
         incremental_distances[incremental_distances == np.inf] = 0
         incremental_distances[np.isnan(incremental_distances)] = 0
 
@@ -250,11 +278,12 @@ class LocalConflictObsForRailEnv(TreeObsForRailEnv):
 
 
 def create_agent_states(obs: Union[Dict, List],
-                        max_depth: int, n_local: int = 5) -> Dict:
+                        max_depth: int, n_local: int = 5, conflict_matrix: Optional[Tuple] = None) -> Dict:
     """
     Identifies local agent conflicts and adds information from
     conflict prediction matrix. For more details refer to the
     observation section in the README.md file.
+    The conflict matrix is computed from the predictions if not given.
     """
     n_agents = len(obs)
     x_dim = 0
@@ -300,10 +329,9 @@ def create_agent_states(obs: Union[Dict, List],
             status[i] = int(custom_observations.status > 0)
             info_action_required[i] = int(custom_observations.action_required)
 
-    predicted_pos = custom_observations.predicted_pos
-    agent_conflicts_count_path, agent_conflicts_step_path, \
-    agent_total_step_conflicts = get_agent_conflict_prediction_matrix(
-        n_agents, max_depth, predicted_pos)
+    if conflict_matrix is None:
+        conflict_matrix = get_agent_conflict_prediction_matrix(n_agents, max_depth, custom_observations.predicted_pos)
+    agent_conflicts_count_path, agent_conflicts_step_path, agent_total_step_conflicts = conflict_matrix
 
     # Normalise based on average grid dimensions
     avg_dim = (x_dim * y_dim) ** 0.5
@@ -311,23 +339,23 @@ def create_agent_states(obs: Union[Dict, List],
 
     agent_conflict_steps = min(max_depth - 1, depth)
 
-    agent_conflicts = agent_conflicts_step_path[agent_conflict_steps]
     agent_conflicts_avg_step_count = np.average(
         agent_total_step_conflicts) / n_agents
 
     for i in range(n_agents):
         if obs[i] is not None:
+            agent_conflicts = agent_conflicts_step_path.row(agent_conflict_steps, i)
             n_upd_local = min(n_local, n_agents - 1)
             if n_upd_local < n_local:
                 n_pad = n_local - n_upd_local
                 ls_other_local_agents = np.argpartition(
-                    agent_conflicts[i, :], n_upd_local)[:n_upd_local - 1]
+                    agent_conflicts, n_upd_local)[:n_upd_local - 1]
                 for j in range(n_pad):
                     ls_other_local_agents = np.hstack(
                         [ls_other_local_agents, i])
             else:
                 ls_other_local_agents = np.argpartition(
-                    agent_conflicts[i, :], n_local)[:n_local - 1]
+                    agent_conflicts, n_local)[:n_local - 1]
             ls_local_agents = np.hstack([i, ls_other_local_agents])
             local_agent_states = np.hstack(
                 [distance_target[ls_local_agents],
@@ -336,12 +364,12 @@ def create_agent_states(obs: Union[Dict, List],
             local_agent_states = np.hstack(
                 [local_agent_states, info_action_required[ls_local_agents]])
             local_agent_states = np.hstack([local_agent_states,
-                                            agent_conflicts_step_path[0]
-                                            [i, ls_other_local_agents],
-                                            agent_conflicts_step_path[1]
-                                            [i, ls_other_local_agents],
-                                            agent_conflicts_step_path[2]
-                                            [i, ls_other_local_agents]])
+                                            agent_conflicts_step_path.row(0, i)
+                                            [ls_other_local_agents],
+                                            agent_conflicts_step_path.row(1, i)
+                                            [ls_other_local_agents],
+                                            agent_conflicts_step_path.row(2, i)
+                                            [ls_other_local_agents]])
             local_agent_states = np.hstack([local_agent_states,
                                             agent_conflicts_count_path[0]
                                             [ls_local_agents],
@@ -378,60 +406,110 @@ def create_agent_states(obs: Union[Dict, List],
     return local_agent_states_all
 
 
+class AgentConflictSteps:
+    """
+    Sparse agent x agent matrix holding the first predicted step (starting at 1) at which two agents are
+    predicted on the same cell. Only pairs of agents with a predicted conflict are stored.
+    """
+
+    def __init__(self, n_agents: int, max_depth: int, agents: np.ndarray, others: np.ndarray,
+                 first_steps: np.ndarray):
+        self.n_agents = n_agents
+        self.max_depth = max_depth
+        self.agents = agents
+        self.others = others
+        self.first_steps = first_steps
+        self.indptr = np.searchsorted(agents, np.arange(n_agents + 1))
+
+    def row(self, t: int, handle: int) -> np.ndarray:
+        """
+        Normalised conflict steps of agent `handle` to all other agents considering the first t + 1 prediction
+        steps, 1 if no conflict is predicted within these steps.
+        """
+        row = np.ones(self.n_agents)
+        start, end = self.indptr[handle], self.indptr[handle + 1]
+        steps = self.first_steps[start:end]
+        within = steps <= t + 1
+        row[self.others[start:end][within]] = steps[within] / self.max_depth
+        return row
+
+    def __getitem__(self, t: int) -> np.ndarray:
+        return np.array([self.row(t, i) for i in range(self.n_agents)])
+
+    def total(self) -> np.ndarray:
+        totals = np.full(self.n_agents, float(self.n_agents))
+        np.add.at(totals, self.agents, self.first_steps / self.max_depth - 1)
+        return totals
+
+
 def get_agent_conflict_prediction_matrix(n_agents, max_depth, predicted_pos
-                                         ) -> Tuple[List, List, List]:
+                                         ) -> Tuple[List, AgentConflictSteps, np.ndarray]:
     '''
     Calculates the agent conflict step path and agent conflict count path
     and the agent total conflict steps
     For more details refer to the observation section in the README.md file.
+
+    Agents are grouped by (step, cell) in one pass, only groups with more
+    than one agent are expanded to agent pairs.
     '''
-    agent_total_step_conflicts = []
-    agent_conflicts_step_path = []
-    agent_conflicts_count_path = []
-    values = []
-    counts = []
-    agent_conflicts_step = max_depth * np.ones((n_agents, n_agents))
-
-    for i in range(max_depth):
-        step = i + 1
-        pos = predicted_pos[i]
-        val, count = np.unique(pos, return_counts=True)
-        if val[0] == -1:
-            val = val[1:]
-            count = count[1:]
-        values.append(val)
-        counts.append(count)
-
-        counter = np.zeros(n_agents)
-        agent_conflicts_count = np.zeros(n_agents)
-
-        for j, curVal in enumerate(val):
-            curCount = count[j]
-            if curCount > 1:
-                idxs = np.argwhere(pos == curVal)
-                lsIdx = [int(x) for x in idxs]
-                combs = list(combinations(lsIdx, 2))
-                for k, comb in enumerate(combs):
-                    counter[comb[0]] += 1
-                    counter[comb[1]] += 1
-                    agent_conflicts_count[comb[0]] = counter[comb[0]]
-                    agent_conflicts_count[comb[1]] = counter[comb[1]]
-                    agent_conflicts_step[comb[0], comb[1]] = min(
-                        step, agent_conflicts_step[comb[0], comb[1]])
-                    agent_conflicts_step[comb[1], comb[0]] = min(
-                        step, agent_conflicts_step[comb[1], comb[0]])
-
-        agent_conflicts_step_current = agent_conflicts_step / max_depth
-        agent_conflicts_step_path.append(agent_conflicts_step_current)
-        agent_conflicts_count = agent_conflicts_count / n_agents
-        agent_conflicts_count_path.append(agent_conflicts_count)
+    return get_agent_conflict_prediction_matrices([n_agents], max_depth, [predicted_pos])[0]
 
-    for i in range(n_agents):
-        agent_total_step_conflicts.append(
-            sum(agent_conflicts_step_current[i, :]))
 
-    return agent_conflicts_count_path, agent_conflicts_step_path, \
-           agent_total_step_conflicts
+def get_agent_conflict_prediction_matrices(n_agents: List[int], max_depth, predicted_pos: List
+                                           ) -> List[Tuple[List, AgentConflictSteps, np.ndarray]]:
+    """
+    Conflict prediction matrices of several envs (see get_agent_conflict_prediction_matrix), computed in one pass
+    over the predictions of all envs. The cells and agents of each env are offset so that the envs don't mix.
+    """
+    agent_offsets = np.concatenate([[0], np.cumsum(n_agents)]).astype(int)
+    positions = []
+    cell_offset = 0
+    for n, pos in zip(n_agents, predicted_pos):
+        env_positions = np.array([pos[t] for t in range(max_depth)], dtype=int)
+        positions.append(np.where(env_positions >= 0, env_positions + cell_offset, -1))
+        cell_offset += np.max(env_positions, initial=0) + 1
+    positions = np.concatenate(positions, axis=1)
+    steps, agents = np.nonzero(positions >= 0)
+    cells = positions[steps, agents]
+    keys = steps * (np.max(cells, initial=0) + 1) + cells
+    _, groups, group_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+    groups = groups.reshape(-1)
+
+    agent_conflicts_count = np.zeros((max_depth, agent_offsets[-1]))
+    agent_conflicts_count[steps, agents] = group_sizes[groups] - 1
+
+    # join every agent in a conflicting group with all members of its group
+    conflicting = group_sizes[groups] > 1
+    order = np.argsort(groups[conflicting], kind='stable')
+    member_groups = groups[conflicting][order]
+    member_agents = agents[conflicting][order]
+    member_steps = steps[conflicting][order] + 1
+    sizes = group_sizes[member_groups]
+    group_starts = np.searchsorted(member_groups, member_groups)
+    member_idx = np.repeat(np.arange(len(member_groups)), sizes)
+    partner_idx = np.repeat(group_starts, sizes) + np.arange(len(member_idx)) \
+        - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    pairs = member_agents[member_idx] != member_agents[partner_idx]
+    pair_agents = member_agents[member_idx][pairs]
+    pair_others = member_agents[partner_idx][pairs]
+    pair_steps = member_steps[member_idx][pairs]
+
+    # keep the first step per agent pair
+    order = np.lexsort((pair_steps, pair_others, pair_agents))
+    pair_keys = pair_agents[order] * agent_offsets[-1] + pair_others[order]
+    _, first = np.unique(pair_keys, return_index=True)
+    first = order[first]
+    pair_agents, pair_others, pair_steps = pair_agents[first], pair_others[first], pair_steps[first]
+
+    matrices = []
+    pair_offsets = np.searchsorted(pair_agents, agent_offsets)
+    for k, n in enumerate(n_agents):
+        offset, pair_slice = agent_offsets[k], slice(pair_offsets[k], pair_offsets[k + 1])
+        agent_conflicts_count_path = list(agent_conflicts_count[:, offset:offset + n] / n)
+        agent_conflicts_step_path = AgentConflictSteps(n, max_depth, pair_agents[pair_slice] - offset,
+                                                       pair_others[pair_slice] - offset, pair_steps[pair_slice])
+        matrices.append((agent_conflicts_count_path, agent_conflicts_step_path, agent_conflicts_step_path.total()))
+    return matrices
 
 
 def action_required(agent):
@@ -50,35 +50,42 @@ class MetaObservationBuilder(ObservationBuilder):
             distance_map = self.env.distance_map.get()
             nan_inf_mask = ((distance_map != np.inf) * (np.abs(np.isnan(distance_map) - 1))).astype(np.bool)
             max_distance = np.max(distance_map[nan_inf_mask])
-            density_maps = dict()
-            for handle in handles:
-                density_maps[handle] = self.get(handle)
+            density_maps = np.array([self.get(handle) for handle in handles])
+            density_sum = np.sum(density_maps, axis=0, dtype=np.float64)
+            nr_others = max(len(handles) - 1, 1)
+            nr_agents_same_start = self._nr_agents_same_start()
             obs = dict()
-            for handle in handles:
+            for i, handle in enumerate(handles):
                 stacked_obs = np.zeros(shape=self.observation_shape, dtype=np.float32)
                 agent = self.env.agents[handle]
                 init_pos = agent.initial_position
                 init_dir = agent.initial_direction
-                nr_agents_same_start = len([a.handle for a in self.env.agents
-                                            if a.initial_position == agent.initial_position])
                 init_pos_map = np.zeros(shape=(self._height, self._width), dtype=np.float32)
                 init_pos_map[init_pos] = 1
-                other_dens_maps = [density_maps[key] for key in density_maps if key != handle]
-                others_density = np.mean(np.array(other_dens_maps), axis=0)
+                others_density = (density_sum - density_maps[i]) / nr_others
                 distance = distance_map[handle][init_pos + (init_dir,)]
                 distance = max_distance if (
                         distance == np.inf or np.isnan(distance)) else distance
 
-                stacked_obs[:, :, 0] = density_maps[handle]
+                stacked_obs[:, :, 0] = density_maps[i]
                 stacked_obs[:, :, 1] = others_density
                 stacked_obs[:, :, 2] = init_pos_map
 
                 obs[handle] = (stacked_obs,
-                               np.array([distance / max_distance, nr_agents_same_start / len(self.env.agents)]))
+                               np.array([distance / max_distance, nr_agents_same_start[handle] / len(self.env.agents)]))
             return obs
         else:
             return {h: np.zeros(1) for h in handles}
 
+    def _nr_agents_same_start(self) -> np.ndarray:
+        """
+        number of agents sharing the initial position of each agent, indexed by handle
+        """
+        init_cells = np.array([a.initial_position[0] * self.env.width + a.initial_position[1]
+                               for a in self.env.agents])
+        _, inverse, counts = np.unique(init_cells, return_inverse=True, return_counts=True)
+        return counts[inverse]
+
     def get(self, handle: int = 0):
         """
         compute density map for agent: a value is asigned to every cell along the shortest path between
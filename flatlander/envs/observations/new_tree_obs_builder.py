@@ -7,10 +7,11 @@ from flatland.core.env import Environment
 from flatland.core.env_observation_builder import ObservationBuilder
 from flatland.core.env_prediction_builder import PredictionBuilder
 from flatland.core.grid.grid4_utils import get_new_position
-from flatland.core.grid.grid_utils import coordinate_to_position
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.utils.ordered_set import OrderedSet
 
+from flatlander.envs.observations.common.prediction_cache import PredictionCache
+
 MyNode = collections.namedtuple('Node', 'dist_own_target_encountered '
                                         'dist_other_target_encountered '
                                         'dist_other_agent_encountered '
@@ -73,22 +74,10 @@ class MyTreeObsForRailEnv(ObservationBuilder):
         if handles is None:
             handles = []
         if self.predictor:
-            self.max_prediction_depth = 0
-            self.predicted_pos = {}
-            self.predicted_dir = {}
-            self.predictions = self.predictor.get()
-            if self.predictions:
-                for t in range(self.predictor.max_depth + 1):
-                    pos_list = []
-                    dir_list = []
-                    for a in handles:
-                        if self.predictions[a] is None:
-                            continue
-                        pos_list.append(self.predictions[a][t][1:3])
-                        dir_list.append(self.predictions[a][t][3])
-                    self.predicted_pos.update({t: coordinate_to_position(self.env.width, pos_list)})
-                    self.predicted_dir.update({t: dir_list})
-                self.max_prediction_depth = len(self.predicted_pos)
+            step_predictions = PredictionCache.for_env(self.env).get(self.predictor)
+            self.predictions = step_predictions.predictions
+            self.predicted_pos, self.predicted_dir = step_predictions.positions(handles)
+            self.max_prediction_depth = len(self.predicted_pos)
         # Update local lookup table for all agents' positions
         # ignore other agents not in the grid (only status open and done)
         # self.location_has_agent = {tuple(agent.position): 1 for agent in self.envs.agents if
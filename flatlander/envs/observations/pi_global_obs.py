@@ -40,7 +40,10 @@ class PaddedGlobalObsForRailEnv(ObservationBuilder):
         self._max_n_agents = max_n_agents
         self._max_width = max_width
         self._max_height = max_height
-        self._builder = PerfectInformationGlobalObs(max_n_agents=self._max_n_agents)
+        # the inner builder writes directly into padded arrays, the static rail channels are padded once per rail
+        self._builder = PerfectInformationGlobalObs(max_n_agents=self._max_n_agents,
+                                                    max_height=self._max_height,
+                                                    max_width=self._max_width)
 
     def set_env(self, env: Environment):
         self._builder.set_env(env)
@@ -49,11 +52,7 @@ class PaddedGlobalObsForRailEnv(ObservationBuilder):
         self._builder.reset()
 
     def get_many(self, handle: int = 0):
-        obs = self._builder.get_many()
-        height, width = obs.shape[:2]
-        pad_height, pad_width = self._max_height - height, self._max_width - width
-        assert pad_height >= 0 and pad_width >= 0
-        return np.pad(obs, ((0, pad_height), (0, pad_height), (0, 0)), constant_values=0)
+        return self._builder.get_many()
 
     def get(self, handle: int = 0):
         return None
@@ -7,7 +7,7 @@ from flatland.core.grid.grid4_utils import get_new_position
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.envs.rail_env import RailEnv
 
-from flatlander.algorithms.graph_coloring import GreedyGraphColoring
+from flatlander.algorithms.graph_coloring import IncrementalGraphColoring
 from flatlander.envs.observations import register_obs, Observation
 
 
@@ -30,6 +30,7 @@ class PriorityPathObservation(Observation):
 class PriorityPathObservationBuilder(ObservationBuilder):
     def reset(self):
         self._conflict_map = {}
+        self._coloring.reset()
 
     def __init__(self, encode_one_hot=True, asserts=False):
         super().__init__()
@@ -38,6 +39,8 @@ class PriorityPathObservationBuilder(ObservationBuilder):
         self._path_size = len(self._directions) + 2
         self._encode_one_hot = encode_one_hot
         self._asserts = asserts
+        # the order of the colors matters
+        self._coloring = IncrementalGraphColoring(colors=[1, 0])
 
     def get_many(self, handles: Optional[List[int]] = None):
         if handles is None:
@@ -46,10 +49,8 @@ class PriorityPathObservationBuilder(ObservationBuilder):
         self._conflict_map = {handle: [] for handle in handles}
         obs_dict = {handle: self.get(handle) for handle in handles}
 
-        # the order of the colors matters
-        priorities = GreedyGraphColoring.color(colors=[1, 0],
-                                               nodes=obs_dict.keys(),
-                                               neighbors=self._conflict_map)
+        priorities = self._coloring.color(nodes=obs_dict.keys(),
+                                          neighbors=self._conflict_map)
         for handle, obs in obs_dict.items():
             obs[-1] = priorities[handle]
 
@@ -1,5 +1,5 @@
 from collections import defaultdict
-from typing import Dict, NamedTuple, Any, Optional
+from typing import Dict, NamedTuple, Any, Optional, List
 
 import gym
 import numpy as np
@@ -8,6 +8,9 @@ from flatland.envs.rail_env import RailEnv, RailEnvActions
 
 from flatlander.envs.observations.common.shortest_path_conflict_detector import ShortestPathConflictDetector
 from flatlander.envs.observations.common.timeless_conflict_detector import TimelessConflictDetector
+from flatlander.envs.utils.gym_env import LazyObservations, select_observations, readable_observations
+from flatlander.envs.utils.priorization.agent_ordering import AgentOrdering, agent_states, agent_events, \
+    repriorize
 from flatlander.envs.utils.priorization.helper import get_virtual_position
 from flatlander.envs.utils.priorization.priorizer import Priorizer, NrAgentsWaitingPriorizer, NrAgentsSameStart
 
@@ -35,9 +38,10 @@ class CprFlatlandGymEnv(gym.Env):
                  regenerate_rail_on_reset: bool = True,
                  regenerate_schedule_on_reset: bool = True,
                  max_nr_active_agents: int = 50,
-                 priorizer: Priorizer = NrAgentsSameStart(),
+                 priorizer: Priorizer = None,
                  conflict_detector=TimelessConflictDetector(),
-                 allow_noop=False, **_) -> None:
+                 allow_noop=False,
+                 dynamic_priorities=False, **_) -> None:
 
         super().__init__()
         self._agents_done = []
@@ -53,8 +57,10 @@ class CprFlatlandGymEnv(gym.Env):
         self.observation_space = observation_space
         self._prev_obs = None
         self.sorted_handles = []
-        self.priorizer = priorizer
+        # the priorizers cache per schedule, so every env gets its own
+        self.priorizer = priorizer if priorizer is not None else NrAgentsSameStart()
         self.allow_noop = allow_noop
+        self.dynamic_priorities = dynamic_priorities
         self.conflict_detector = conflict_detector
         self.conflict_detector.set_env(rail_env=rail_env)
 
@@ -66,6 +72,14 @@ class CprFlatlandGymEnv(gym.Env):
         if render:
             self.rail_env.set_renderer(render)
 
+    @property
+    def sorted_handles(self) -> List[int]:
+        return self.agent_ordering.handles
+
+    @sorted_handles.setter
+    def sorted_handles(self, handles: List[int]):
+        self.agent_ordering = AgentOrdering(handles)
+
     def get_predictions(self, action_dict):
         positions = {}
         directions = {}
@@ -90,6 +104,7 @@ class CprFlatlandGymEnv(gym.Env):
         return {h: a + 1 for h, a in action_dict.items()}
 
     def get_robust_actions(self, action_dict, sorted_handles):
+        ordering = sorted_handles if isinstance(sorted_handles, AgentOrdering) else AgentOrdering(sorted_handles)
         self.conflict_detector.update()
         if not self.allow_noop:
             action_dict = self.get_rail_env_actions(action_dict)
@@ -98,7 +113,7 @@ class CprFlatlandGymEnv(gym.Env):
 
         robust_actions = {}
         relevant_handles = []
-        for h in sorted_handles:
+        for h in ordering:
             if positions.get(h, None) is not None:
                 relevant_handles.append(h)
             if len(relevant_handles) >= self._max_nr_active_agents:
@@ -109,7 +124,7 @@ class CprFlatlandGymEnv(gym.Env):
                                                                  positions=positions,
                                                                  directions=directions)
 
-        for i, h in enumerate(sorted_handles):
+        for i, h in enumerate(ordering):
             if h in action_dict.keys():
                 if h in allowed_handles:
                     robust_actions[h] = action_dict[h]
@@ -120,8 +135,12 @@ class CprFlatlandGymEnv(gym.Env):
         return robust_actions
 
     def step(self, action_dict: Dict[int, RailEnvActions]) -> StepOutput:
-        robust_actions = self.get_robust_actions(action_dict, sorted_handles=self.sorted_handles)
+        robust_actions = self.get_robust_actions(action_dict, sorted_handles=self.agent_ordering)
+        prev_states = agent_states(self.rail_env.agents) if self.dynamic_priorities else None
         obs, rewards, dones, infos = self.rail_env.step(robust_actions)
+        prev_obs = readable_observations(self._prev_obs)
+        if self.dynamic_priorities:
+            repriorize(self.agent_ordering, agent_events(prev_states, self.rail_env.agents))
 
         d, r, o = dict(), dict(), dict()
         for agent, done in dones.items():
@@ -132,15 +151,19 @@ class CprFlatlandGymEnv(gym.Env):
                 if agent != '__all__':
                     if done:
                         self._agents_done.append(agent)
-                    if obs[agent] is not None:
+                    if isinstance(obs, LazyObservations):
+                        o[agent] = None
+                    elif obs[agent] is not None:
                         o[agent] = obs[agent]
                     else:
-                        o[agent] = self._prev_obs[agent]
+                        o[agent] = prev_obs[agent]
                     r[agent] = rewards[agent]
                     self._agent_scores[agent] += rewards[agent]
                     self._agent_steps[agent] += 1
                 d[agent] = dones[agent]
 
+        if isinstance(obs, LazyObservations):
+            o = select_observations(obs, o.keys(), fallback=prev_obs)
         self._prev_obs = o
 
         return StepOutput(obs=o, reward=r, done=d, info={agent: {
@@ -1,5 +1,7 @@
 from collections import defaultdict
-from typing import Dict, NamedTuple, Any, Optional
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Any, Optional, Iterable, Callable
 
 import gym
 
@@ -13,6 +15,158 @@ class StepOutput(NamedTuple):
     info: Any
 
 
+class LazyObservations(Mapping):
+    """
+    Observations of one env step, built for all handles at once by the observation builder when the first value
+    is read. They have to be read before the env steps again. Missing observations are taken from `fallback`, a
+    transform set by a wrapper is applied to every observation read.
+    """
+
+    def __init__(self, rail_env: RailEnv, handles: Optional[Iterable[int]] = None,
+                 fallback: Optional[Mapping] = None):
+        self.fallback = fallback
+        self._rail_env = rail_env
+        self._elapsed_steps = rail_env._elapsed_steps
+        self._handles = list(range(rail_env.get_num_agents())) if handles is None else list(handles)
+        self._handle_set = set(self._handles)
+        self._source = self
+        self._obs = None
+        self._transform = None
+
+    def restrict(self, handles: Iterable[int], fallback: Optional[Mapping] = None) -> 'LazyObservations':
+        """
+        Returns the observations of the handles only, sharing the (not yet) built observations. Without a fallback
+        the one of these observations is kept.
+        """
+        restricted = LazyObservations(self._rail_env, handles, self.fallback if fallback is None else fallback)
+        restricted._elapsed_steps = self._elapsed_steps
+        restricted._source = self._source
+        restricted._transform = self._transform
+        return restricted
+
+    def transformed(self, transform: Callable[[int, Any], Any]) -> 'LazyObservations':
+        """
+        Returns the observations with transform(handle, obs) applied when they are read.
+        """
+        transformed = self.restrict(self._handles)
+        previous = self._transform
+        transformed._transform = transform if previous is None else lambda h, o: transform(h, previous(h, o))
+        return transformed
+
+    def build(self) -> Dict[int, Any]:
+        source = self._source
+        if source._obs is None:
+            source._check_step()
+            source._set_built(self._rail_env.obs_builder.get_many(source._handles))
+        return source._obs
+
+    def _check_step(self):
+        if self._rail_env._elapsed_steps != self._elapsed_steps:
+            raise RuntimeError("observations of step {} read at step {}".format(self._elapsed_steps,
+                                                                               self._rail_env._elapsed_steps))
+
+    def _set_built(self, obs: Dict[int, Any]):
+        self._obs = obs
+        self._rail_env.obs_dict = obs
+
+    @property
+    def built(self) -> bool:
+        return self._source._obs is not None
+
+    def __getitem__(self, handle):
+        if handle not in self._handle_set:
+            raise KeyError(handle)
+        obs = self.build().get(handle, None)
+        if obs is None and self.fallback is not None:
+            obs = self.fallback.get(handle, None)
+        if self._transform is not None:
+            self._check_step()
+            return self._transform(handle, obs)
+        return obs
+
+    def __contains__(self, handle):
+        return handle in self._handle_set
+
+    def __iter__(self):
+        return iter(self._handles)
+
+    def __len__(self):
+        return len(self._handles)
+
+
+def build_observations(observations: Iterable[Mapping]):
+    """
+    Builds the lazy observations of several envs. Observation builders with a get_many_batch(builders, handles)
+    method build the observations of all their envs in one call, the others are built one env after the other.
+    """
+    sources = {}
+    for obs in observations:
+        if isinstance(obs, LazyObservations) and not obs.built:
+            sources[id(obs._source)] = obs._source
+    groups = defaultdict(list)
+    for source in sources.values():
+        source._check_step()
+        groups[type(source._rail_env.obs_builder)].append(source)
+
+    for builder_cls, group in groups.items():
+        if len(group) > 1 and hasattr(builder_cls, 'get_many_batch'):
+            built = builder_cls.get_many_batch([source._rail_env.obs_builder for source in group],
+                                               [source._handles for source in group])
+            for source, obs in zip(group, built):
+                source._set_built(obs)
+        else:
+            for source in group:
+                source.build()
+
+
+@contextmanager
+def suppressed_observations(rail_env: RailEnv, lazy: bool = False):
+    """
+    Steps of the rail env inside the context don't call the observation builder. The observation of every
+    agent is None, or with `lazy` the step returns LazyObservations which are built when a caller reads them.
+    """
+    previous = vars(rail_env).get('_get_observations', None)
+    if lazy:
+        rail_env._get_observations = lambda: LazyObservations(rail_env)
+    else:
+        rail_env._get_observations = lambda: {h: None for h in range(rail_env.get_num_agents())}
+    try:
+        yield
+    finally:
+        if previous is None:
+            del rail_env._get_observations
+        else:
+            rail_env._get_observations = previous
+
+
+def select_observations(obs, handles, fallback: Optional[Mapping] = None) -> Mapping:
+    """
+    Returns the observations of the handles, without building lazy observations.
+    """
+    if isinstance(obs, LazyObservations):
+        return obs.restrict(handles, fallback)
+    return {h: obs[h] for h in handles}
+
+
+def transform_observations(obs, transform: Callable[[int, Any], Any]) -> Mapping:
+    """
+    Applies transform(handle, obs) to the observations, to lazy observations when they are read.
+    """
+    if isinstance(obs, LazyObservations):
+        return obs.transformed(transform)
+    return {h: transform(h, o) for h, o in obs.items()}
+
+
+def readable_observations(prev_obs: Optional[Mapping]) -> Optional[Mapping]:
+    """
+    Returns the previous observations as far as they can still be read. Lazy observations which were never built
+    can't be read after the env stepped, their fallback is used instead.
+    """
+    if isinstance(prev_obs, LazyObservations):
+        return dict(prev_obs.items()) if prev_obs.built else prev_obs.fallback
+    return prev_obs
+
+
 class FlatlandGymEnv(gym.Env):
     action_space = gym.spaces.Discrete(5)
 
@@ -47,6 +201,7 @@ class FlatlandGymEnv(gym.Env):
             # Perform envs steps as long as there is no observation (for all agents) or all agents are done
             # The observation is `None` if an agent is done or malfunctioning.
             obs, rewards, dones, infos = self.rail_env.step(action_dict)
+            prev_obs = readable_observations(self._prev_obs)
 
             d, r, o = dict(), dict(), dict()
             for agent, done in dones.items():
@@ -60,10 +215,12 @@ class FlatlandGymEnv(gym.Env):
                     if agent != '__all__':
                         if done:
                             self._agents_done.append(agent)
-                        if obs[agent] is not None:
+                        if isinstance(obs, LazyObservations):
+                            o[agent] = None
+                        elif obs[agent] is not None:
                             o[agent] = obs[agent]
                         else:
-                            o[agent] = self._prev_obs[agent]
+                            o[agent] = prev_obs.get(agent, None) if prev_obs is not None else None
                         r[agent] = rewards[agent]
                         self._agent_scores[agent] += rewards[agent]
                         self._agent_steps[agent] += 1
@@ -74,6 +231,8 @@ class FlatlandGymEnv(gym.Env):
 
         assert all([x is not None for x in (d, r, o)])
 
+        if isinstance(obs, LazyObservations):
+            o = select_observations(obs, o.keys(), fallback=prev_obs)
         self._prev_obs = o
 
         return StepOutput(obs=o, reward=r, done=d, info={agent: {
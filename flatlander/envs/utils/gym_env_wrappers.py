@@ -10,7 +10,11 @@ from flatland.envs.rail_env import RailEnv, RailEnvActions
 from flatland.envs.rail_env_shortest_paths import get_valid_move_actions_
 
 from flatlander.agents.shortest_path_agent import ShortestPathAgent
-from flatlander.envs.utils.gym_env import StepOutput
+from flatlander.envs.utils.gym_env import StepOutput, suppressed_observations, select_observations, \
+    transform_observations
+from flatlander.envs.utils.priorization.priorizer import priority_order
+from flatlander.utils.deadlock_check import get_next_cell_table
+from flatlander.utils.deadlock_detector import DeadlockDetector
 
 
 def available_actions(env: RailEnv, agent: EnvAgent, allow_noop=True) -> List[int]:
@@ -53,13 +57,10 @@ class AvailableActionsWrapper(gym.Wrapper):
 
     def _transform_obs(self, obs):
         rail_env = self.unwrapped.rail_env
-        return {
-            agent_id: {
-                'obs': agent_obs,
-                'available_actions': np.asarray(
-                    available_actions(rail_env, rail_env.agents[agent_id], self._allow_noop))
-            } for agent_id, agent_obs in obs.items()
-        }
+        return transform_observations(obs, lambda agent_id, agent_obs: {
+            'obs': agent_obs,
+            'available_actions': np.asarray(available_actions(rail_env, rail_env.agents[agent_id], self._allow_noop))
+        })
 
 
 def find_all_cells_where_agent_can_choose(rail_env: RailEnv):
@@ -90,15 +91,47 @@ def find_all_cells_where_agent_can_choose(rail_env: RailEnv):
     return tuple(map(set, (switches, switches_neighbors, decision_cells)))
 
 
+def get_segment_lengths(rail_env: RailEnv, stop_cells) -> np.ndarray:
+    """
+    Returns for every (cell, direction) state, flat index (row * width + col) * 4 + direction, the number of cells
+    an agent has to enter along its track until it is on one of the stop cells, inf if it never gets there.
+    """
+    next_cells = get_next_cell_table(rail_env.rail).reshape(-1, 4)
+    n_states = len(next_cells)
+    single = np.count_nonzero(next_cells >= 0, axis=1) == 1
+    moves = np.argmax(next_cells >= 0, axis=1)
+    next_cell = np.maximum(next_cells[np.arange(n_states), moves], 0)
+    next_state = next_cell * 4 + moves
+
+    stop = np.zeros(rail_env.height * rail_env.width, dtype=bool)
+    stop[[row * rail_env.width + col for row, col in stop_cells]] = True
+    ends = single & stop[next_cell]
+    follow = single & ~ends
+
+    lengths = np.full(n_states, np.inf)
+    lengths[ends] = 1
+    # one more cell of every segment per iteration, states on circles without stop cells stay inf
+    while True:
+        new_lengths = lengths.copy()
+        new_lengths[follow] = lengths[next_state[follow]] + 1
+        if np.array_equal(new_lengths, lengths):
+            return lengths
+        lengths = new_lengths
+
+
 class SkipNoChoiceCellsWrapper(gym.Wrapper):
 
-    def __init__(self, env, accumulate_skipped_rewards: bool, discounting: float = 0.99) -> None:
+    def __init__(self, env, accumulate_skipped_rewards: bool, discounting: float = 0.99,
+                 fast_forward: bool = False) -> None:
         super().__init__(env)
         self._switches = None
         self._switches_neighbors = None
         self._decision_cells = None
+        self._stop_cells = None
+        self._segment_lengths = None
         self._accumulate_skipped_rewards = accumulate_skipped_rewards
         self._discounting = discounting
+        self._fast_forward = fast_forward
         self._skipped_rewards = defaultdict(list)
 
     def _on_decision_cell(self, agent: EnvAgent):
@@ -112,32 +145,94 @@ class SkipNoChoiceCellsWrapper(gym.Wrapper):
     def _next_to_switch(self, agent: EnvAgent):
         return agent.position in self._switches_neighbors
 
+    def _steps_to_decision(self, action_dict: Dict[int, RailEnvActions]) -> int:
+        """
+        Lower bound of the env steps until an agent can be on a decision cell or done. Malfunctions and blocked
+        cells only delay the agents, the bound stays valid with them.
+        """
+        rail_env = self.unwrapped.rail_env
+        steps = np.inf
+        if rail_env._max_episode_steps is not None:
+            steps = rail_env._max_episode_steps - rail_env._elapsed_steps
+        for agent in rail_env.agents:
+            if agent.status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED]:
+                continue
+            if agent.position is None or agent.position in self._stop_cells:
+                return 1
+            if not agent.moving and agent.malfunction_data['malfunction'] == 0 and agent.handle not in action_dict:
+                continue
+            cells = self._segment_lengths[(agent.position[0] * rail_env.width + agent.position[1]) * 4
+                                          + agent.direction]
+            speed = agent.speed_data['speed']
+            first_cell = max(1, int(np.ceil((1. - agent.speed_data['position_fraction']) / speed - 0.5)))
+            steps = min(steps, first_cell + (cells - 1) * max(1, int(np.ceil(1. / speed - 0.5))))
+        return int(steps) if np.isfinite(steps) else 1
+
+    def _collect(self, step_output: StepOutput, r, d, i) -> List[int]:
+        """
+        Collects the agents which have to act of an env step, returns their handles.
+        """
+        obs, reward, done, info = step_output
+        handles = []
+        for agent_id in obs:
+            if done[agent_id] or self._on_decision_cell(self.unwrapped.rail_env.agents[agent_id]):
+                handles.append(agent_id)
+                r[agent_id] = reward[agent_id]
+                d[agent_id] = done[agent_id]
+                i[agent_id] = info[agent_id]
+                if self._accumulate_skipped_rewards:
+                    discounted_skipped_reward = r[agent_id]
+                    for skipped_reward in reversed(self._skipped_rewards[agent_id]):
+                        discounted_skipped_reward = self._discounting * discounted_skipped_reward + skipped_reward
+                    r[agent_id] = discounted_skipped_reward
+                    self._skipped_rewards[agent_id] = []
+            elif self._accumulate_skipped_rewards:
+                self._skipped_rewards[agent_id].append(reward[agent_id])
+        d['__all__'] = done['__all__']
+        return handles
+
+    def _skip(self, action_dict: Dict[int, RailEnvActions], r, d, i):
+        """
+        Advances the env without building observations as long as no agent can reach a decision cell. Returns the
+        actions of the next step, the collected handles and the observations of the current step.
+        """
+        n_steps = self._steps_to_decision(action_dict) - 1
+        if n_steps <= 0:
+            return action_dict, [], None
+        rail_env = self.unwrapped.rail_env
+        handles = []
+        with suppressed_observations(rail_env):
+            for _ in range(n_steps):
+                handles = self._collect(self.env.step(action_dict), r, d, i)
+                action_dict = {}
+                if len(handles) > 0:
+                    break
+        # agents done by a wrapper (e.g. deadlocks), their observations are built for the current step
+        return action_dict, handles, rail_env._get_observations() if len(handles) > 0 else None
+
     def step(self, action_dict: Dict[int, RailEnvActions]) -> StepOutput:
-        o, r, d, i = {}, {}, {}, {}
-        while len(o) == 0:
-            obs, reward, done, info = self.env.step(action_dict)
-            for agent_id, agent_obs in obs.items():
-                if done[agent_id] or self._on_decision_cell(self.unwrapped.rail_env.agents[agent_id]):
-                    o[agent_id] = agent_obs
-                    r[agent_id] = reward[agent_id]
-                    d[agent_id] = done[agent_id]
-                    i[agent_id] = info[agent_id]
-                    if self._accumulate_skipped_rewards:
-                        discounted_skipped_reward = r[agent_id]
-                        for skipped_reward in reversed(self._skipped_rewards[agent_id]):
-                            discounted_skipped_reward = self._discounting * discounted_skipped_reward + skipped_reward
-                        r[agent_id] = discounted_skipped_reward
-                        self._skipped_rewards[agent_id] = []
-                elif self._accumulate_skipped_rewards:
-                    self._skipped_rewards[agent_id].append(reward[agent_id])
-            d['__all__'] = done['__all__']
+        r, d, i = {}, {}, {}
+        handles = []
+        while len(handles) == 0:
+            if self._fast_forward:
+                action_dict, handles, obs = self._skip(action_dict, r, d, i)
+                if len(handles) > 0:
+                    break
+            step_output = self.env.step(action_dict)
+            obs = step_output[0]
+            handles = self._collect(step_output, r, d, i)
             action_dict = {}
-        return StepOutput(o, r, d, i)
+        return StepOutput(select_observations(obs, handles), r, d, i)
 
     def reset(self, random_seed: Optional[int] = None) -> Dict[int, Any]:
         obs = self.env.reset(random_seed)
+        rail_env = self.unwrapped.rail_env
         self._switches, self._switches_neighbors, self._decision_cells = \
-            find_all_cells_where_agent_can_choose(self.unwrapped.rail_env)
+            find_all_cells_where_agent_can_choose(rail_env)
+        if self._fast_forward:
+            self._stop_cells = self._decision_cells | {a.initial_position for a in rail_env.agents} \
+                               | {a.target for a in rail_env.agents}
+            self._segment_lengths = get_segment_lengths(rail_env, self._stop_cells)
         return obs
 
 
@@ -165,14 +260,15 @@ class PriorizationWrapper(gym.Wrapper):
         print("Apply PriorizationWrapper")
         self.action_space = gym.spaces.Box(low=0, high=1, shape=(1,))  # shortest path, other direction
         self.sp_agent = ShortestPathAgent()
-        self.norm_factor = self.unwrapped.rail_env._max_episode_steps * self.unwrapped.rail_env.get_num_agents()
+
+    @property
+    def norm_factor(self):
+        # the scaling envs add agents on reset
+        return self.unwrapped.rail_env._max_episode_steps * self.unwrapped.rail_env.get_num_agents()
 
     def step(self, action_dict: Dict[int, float]) -> StepOutput:
         rail_env: RailEnv = self.unwrapped.rail_env
-        sorted_actions = {k: v for k, v in sorted(action_dict.items(),
-                                                  key=lambda item: item[1],
-                                                  reverse=True)}
-        self.env.sorted_handles = list(sorted_actions.keys())
+        self.env.sorted_handles = priority_order(action_dict)
 
         rail_actions = self.sp_agent.compute_actions({h: None for h in action_dict.keys()}, env=rail_env)
         o, r, d, i = self.env.step(rail_actions)
@@ -190,38 +286,45 @@ class SparsePriorizationWrapper(gym.Wrapper):
         print("Apply SparsePriorizationWrapper")
         self.action_space = gym.spaces.Box(low=0, high=1, shape=(1,))  # shortest path, other direction
         self.sp_agent = ShortestPathAgent()
-        self.norm_factor = self.unwrapped.rail_env._max_episode_steps * self.unwrapped.rail_env.get_num_agents()
+
+    @property
+    def norm_factor(self):
+        # the scaling envs add agents on reset
+        return self.unwrapped.rail_env._max_episode_steps * self.unwrapped.rail_env.get_num_agents()
 
     def step(self, action_dict: Dict[int, float]) -> StepOutput:
         rail_env: RailEnv = self.unwrapped.rail_env
 
-        sorted_actions = {k: v for k, v in sorted(action_dict.items(),
-                                                  key=lambda item: item[1],
-                                                  reverse=True)}
-        self.env.sorted_handles = list(sorted_actions.keys())
+        self.env.sorted_handles = priority_order(action_dict)
 
         cum_done = defaultdict(lambda: False)
         cum_rew = defaultdict(lambda: 0)
-        rail_actions = self.sp_agent.compute_actions({h: None for h in action_dict.keys()}, env=rail_env)
-        o, r, done, i = self.env.step(rail_actions)
-        r = {h: rew / self.norm_factor for h, rew in r.items()}
-        for h, rew in r.items():
-            cum_rew[h] += rew
-
-        for h, curr_d in done.items():
-            cum_done[h] = curr_d or cum_done[h]
-        while not rail_env._elapsed_steps % 10 == 0 and not cum_done.get('__all__', False):
-
+        # a caller which steps lazily itself (the vector env) builds the observations
+        caller_lazy = '_get_observations' in vars(rail_env)
+        # only the observations of the last step are read
+        with suppressed_observations(rail_env, lazy=True):
             rail_actions = self.sp_agent.compute_actions({h: None for h in action_dict.keys()}, env=rail_env)
             o, r, done, i = self.env.step(rail_actions)
             r = {h: rew / self.norm_factor for h, rew in r.items()}
+            for h, rew in r.items():
+                cum_rew[h] += rew
 
             for h, curr_d in done.items():
                 cum_done[h] = curr_d or cum_done[h]
+            while not rail_env._elapsed_steps % 10 == 0 and not cum_done.get('__all__', False):
 
-            for h, rew in r.items():
-                cum_rew[h] += rew
+                rail_actions = self.sp_agent.compute_actions({h: None for h in action_dict.keys()}, env=rail_env)
+                o, r, done, i = self.env.step(rail_actions)
+                r = {h: rew / self.norm_factor for h, rew in r.items()}
+
+                for h, curr_d in done.items():
+                    cum_done[h] = curr_d or cum_done[h]
+
+                for h, rew in r.items():
+                    cum_rew[h] += rew
 
+        if not caller_lazy:
+            o = dict(o.items())
         return StepOutput(o, cum_rew, cum_done, i)
 
     def reset(self, random_seed: Optional[int] = None) -> Dict[int, Any]:
@@ -240,9 +343,8 @@ class SparseRewardWrapper(gym.Wrapper):
 
         obs, reward, done, info = self.env.step(action_dict)
 
-        o, r, d, i = {}, {}, {}, {}
-        for agent_id, agent_obs in obs.items():
-            o[agent_id] = obs[agent_id]
+        r, d, i = {}, {}, {}
+        for agent_id in obs:
             d[agent_id] = done[agent_id]
             i[agent_id] = info[agent_id]
             if done[agent_id]:
@@ -256,7 +358,7 @@ class SparseRewardWrapper(gym.Wrapper):
                 r[agent_id] = 0
         d['__all__'] = done['__all__'] or all(d.values())
 
-        return StepOutput(o, r, d, i)
+        return StepOutput(select_observations(obs, list(r.keys())), r, d, i)
 
     def reset(self, random_seed: Optional[int] = None) -> Dict[int, Any]:
         return self.env.reset(random_seed)
@@ -270,15 +372,14 @@ class GlobalRewardWrapper(gym.Wrapper):
     def step(self, action_dict: Dict[int, RailEnvActions]) -> StepOutput:
         obs, reward, done, info = self.env.step(action_dict)
 
-        o, r, d, i = {}, {}, {}, {}
-        for agent_id, agent_obs in obs.items():
-            o[agent_id] = obs[agent_id]
+        r, d, i = {}, {}, {}
+        for agent_id in obs:
             d[agent_id] = done[agent_id]
             i[agent_id] = info[agent_id]
             r[agent_id] = np.mean(list(reward.values()))
 
         d['__all__'] = done['__all__'] or all(d.values())
-        return StepOutput(o, r, d, i)
+        return StepOutput(select_observations(obs, list(r.keys())), r, d, i)
 
     def reset(self, random_seed: Optional[int] = None) -> Dict[int, Any]:
         return self.env.reset(random_seed)
@@ -289,42 +390,21 @@ class DeadlockWrapper(gym.Wrapper):
     def __init__(self, env, deadlock_reward=-1) -> None:
         super().__init__(env)
         self._deadlock_reward = deadlock_reward
-        self._deadlocked_agents = []
+        self._deadlocked_agents = set()
+        self._detector = DeadlockDetector()
 
     def check_deadlock(self):  # -> Set[int]:
         rail_env: RailEnv = self.unwrapped.rail_env
+        if self._detector.rail_env is not rail_env:
+            self._detector.reset(rail_env)
+        else:
+            self._detector.update()
         new_deadlocked_agents = []
         for agent in rail_env.agents:
             if agent.status == RailAgentStatus.ACTIVE and agent.handle not in self._deadlocked_agents:
-                position = agent.position
-                direction = agent.direction
-                while position is not None:
-                    possible_transitions = rail_env.rail.get_transitions(*position, direction)
-                    num_transitions = np.count_nonzero(possible_transitions)
-                    if num_transitions == 1:
-                        new_direction_me = np.argmax(possible_transitions)
-                        new_cell_me = get_new_position(position, new_direction_me)
-                        opp_agent = rail_env.agent_positions[new_cell_me]
-                        if opp_agent != -1:
-                            opp_position = rail_env.agents[opp_agent].position
-                            opp_direction = rail_env.agents[opp_agent].direction
-                            opp_possible_transitions = rail_env.rail.get_transitions(*opp_position, opp_direction)
-                            opp_num_transitions = np.count_nonzero(opp_possible_transitions)
-                            if opp_num_transitions == 1:
-                                if opp_direction != direction:
-                                    self._deadlocked_agents.append(agent.handle)
-                                    new_deadlocked_agents.append(agent.handle)
-                                    position = None
-                                else:
-                                    position = new_cell_me
-                                    direction = new_direction_me
-                            else:
-                                position = new_cell_me
-                                direction = new_direction_me
-                        else:
-                            position = None
-                    else:
-                        position = None
+                if self._detector.blocked_train(agent.handle):
+                    self._deadlocked_agents.add(agent.handle)
+                    new_deadlocked_agents.append(agent.handle)
         return new_deadlocked_agents
 
     def step(self, action_dict: Dict[int, RailEnvActions]) -> StepOutput:
@@ -335,10 +415,9 @@ class DeadlockWrapper(gym.Wrapper):
         else:
             new_deadlocked_agents = []
 
-        o, r, d, i = {}, {}, {}, {}
-        for agent_id, agent_obs in obs.items():
+        r, d, i = {}, {}, {}
+        for agent_id in obs:
             if agent_id not in self._deadlocked_agents or agent_id in new_deadlocked_agents:
-                o[agent_id] = obs[agent_id]
                 d[agent_id] = done[agent_id]
                 i[agent_id] = info[agent_id]
                 r[agent_id] = reward[agent_id]
@@ -348,11 +427,13 @@ class DeadlockWrapper(gym.Wrapper):
                     d[agent_id] = True
         d['__all__'] = done['__all__'] or all(d.values())
 
-        return StepOutput(o, r, d, i)
+        return StepOutput(select_observations(obs, list(r.keys())), r, d, i)
 
     def reset(self, random_seed: Optional[int] = None) -> Dict[int, Any]:
-        self._deadlocked_agents = []
-        return self.env.reset(random_seed)
+        self._deadlocked_agents = set()
+        obs = self.env.reset(random_seed)
+        self._detector.reset(self.unwrapped.rail_env)
+        return obs
 
 
 class NoStopShortestPathActionWrapper(gym.Wrapper):
@@ -416,61 +497,29 @@ class DeadlockResolutionWrapper(gym.Wrapper):
         super().__init__(env)
         self._deadlock_reward = deadlock_reward
         self._num_swaps = defaultdict(int)
+        self._detector = DeadlockDetector()
 
-    def get_deadlocks(self, agent: EnvAgent, seen: List[int]) -> EnvAgent:
-        # abort if agent already checked
-        if agent.handle in seen:
-            # handle circular deadlock
-            seen.append(agent.handle)
-            # return
-            return []
-        # add agent to seen agents
-        seen.append(agent.handle)
-
-        # get rail environment
+    def get_deadlocks(self, agent: EnvAgent) -> List[Optional[EnvAgent]]:
+        """
+        Agents per direction that block the agent in a cycle of the wait-for graph, empty if the agent is not
+        deadlocked.
+        """
         rail_env: RailEnv = self.unwrapped.rail_env
-        # get transitions for agent's position and direction
-        transitions = rail_env.rail.get_transitions(*agent.position, agent.direction)
-        num_possible_transitions = np.count_nonzero(transitions)
-        # initialize list to assign deadlocked agents to directions
-        deadlocked_agents = [None] * len(transitions)
-        # check if all possible transitions are blocked
-        for direction, transition in enumerate(transitions):
-            # only check transitions > 0 but iterate through all to get direction
-            if transition > 0:
-                # get opposite agent in direction of travel if cell is occuppied
-                new_position = get_new_position(agent.position, direction)
-                i_opp_agent = rail_env.agent_positions[new_position]
-                if i_opp_agent != -1:
-                    opp_agent = rail_env.agents[i_opp_agent]
-                    # get blocking agents of opposite agent
-                    blocking_agents = self.get_deadlocks(opp_agent, seen)
-                    # add opposite agent to deadlocked agents if blocked by
-                    # checking agent. also add opposite agent if it is part
-                    # of a circular blocking structure.
-                    if agent in blocking_agents or seen[0] == seen[-1]:
-                        deadlocked_agents[direction] = opp_agent
-
-        # return deadlocked agents if applicable
-        num_deadlocked_agents = np.count_nonzero(deadlocked_agents)
-        if num_deadlocked_agents > 0:
-            # deadlock has to be resolved only if no transition is possible
-            if num_deadlocked_agents == num_possible_transitions:
-                return deadlocked_agents
-            # workaround for already commited agent inside cell that is blocked by at least one agent
-            if agent.speed_data['position_fraction'] > 1:
-                return deadlocked_agents
-
-        return []
+        deadlocked = self._detector.deadlocked_agents(agent.handle)
+        return [rail_env.agents[h] if h is not None else None for h in deadlocked]
 
     def step(self, action_dict: Dict[int, RailEnvActions]) -> StepOutput:
         obs, reward, done, info = self.env.step(action_dict)
         # get rail environment
         rail_env: RailEnv = self.unwrapped.rail_env
+        if self._detector.rail_env is not rail_env:
+            self._detector.reset(rail_env)
+        else:
+            self._detector.update()
         # check agents that have status ACTIVE for deadlocks, envs.active_agents contains also other agents
         active_agents = [agent for agent in rail_env.agents if agent.status == RailAgentStatus.ACTIVE]
         for agent in active_agents:
-            deadlocked_agents = self.get_deadlocks(agent, [])
+            deadlocked_agents = self.get_deadlocks(agent)
             if len(deadlocked_agents) > 0:
                 # favor transition in front as most natural
                 d_agent = deadlocked_agents[agent.direction]
@@ -497,6 +546,7 @@ class DeadlockResolutionWrapper(gym.Wrapper):
                 # increase swap counter in info dict
                 self._num_swaps[agent.handle] += 1
                 self._num_swaps[d_agent.handle] += 1
+                self._detector.update([agent.handle, d_agent.handle])
 
         for i_agent in info:
             info[i_agent]['num_swaps'] = self._num_swaps[i_agent]
@@ -505,7 +555,9 @@ class DeadlockResolutionWrapper(gym.Wrapper):
 
     def reset(self, random_seed: Optional[int] = None) -> Dict[int, Any]:
         self._num_swaps = defaultdict(int)
-        return self.env.reset(random_seed)
+        obs = self.env.reset(random_seed)
+        self._detector.reset(self.unwrapped.rail_env)
+        return obs
 
 
 class FlatlandRenderWrapper(RailEnv, gym.Env):
@@ -0,0 +1,86 @@
+from typing import List, Iterable, Dict
+
+import numpy as np
+from flatland.envs.agent_utils import RailAgentStatus, EnvAgent
+
+
+class AgentOrdering:
+    """
+    Ordering of the agent handles, highest priority first, with O(1) rank lookup through a handle -> rank array.
+
+    Agents can be re-prioritized during the episode, moving a handle only updates the ranks between its old and
+    its new position.
+    """
+
+    def __init__(self, handles: Iterable[int] = ()):
+        self._order = [int(h) for h in handles]
+        self.ranks = np.full(max(self._order, default=-1) + 1, -1, dtype=int)
+        self.ranks[self._order] = np.arange(len(self._order))
+
+    @property
+    def handles(self) -> List[int]:
+        return list(self._order)
+
+    def rank(self, handle: int) -> int:
+        return int(self.ranks[handle]) if 0 <= handle < len(self.ranks) else -1
+
+    def move(self, handle: int, rank: int):
+        old_rank = self.rank(handle)
+        assert old_rank >= 0, "handle {} is not ordered".format(handle)
+        rank = int(np.clip(rank, 0, len(self._order) - 1))
+        if rank == old_rank:
+            return
+        del self._order[old_rank]
+        self._order.insert(rank, handle)
+        lo, hi = min(old_rank, rank), max(old_rank, rank) + 1
+        self.ranks[self._order[lo:hi]] = np.arange(lo, hi)
+
+    def move_to_front(self, handle: int):
+        self.move(handle, 0)
+
+    def move_to_back(self, handle: int):
+        self.move(handle, len(self._order) - 1)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __getitem__(self, item):
+        return self._order[item]
+
+
+def agent_events(prev_states: Dict[int, tuple], agents: List[EnvAgent]) -> Dict[str, List[int]]:
+    """
+    Compares the (status, malfunction) states of the agents before a step with the current ones and returns the
+    handles which became active, started to malfunction or reached their target.
+    """
+    events = {'active': [], 'malfunction': [], 'done': []}
+    for agent in agents:
+        prev_status, prev_malfunction = prev_states[agent.handle]
+        if agent.status == RailAgentStatus.ACTIVE and prev_status == RailAgentStatus.READY_TO_DEPART:
+            events['active'].append(agent.handle)
+        if agent.malfunction_data['malfunction'] > 0 and prev_malfunction == 0:
+            events['malfunction'].append(agent.handle)
+        if agent.status in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED] \
+                and prev_status not in [RailAgentStatus.DONE, RailAgentStatus.DONE_REMOVED]:
+            events['done'].append(agent.handle)
+    return events
+
+
+def agent_states(agents: List[EnvAgent]) -> Dict[int, tuple]:
+    return {agent.handle: (agent.status, agent.malfunction_data['malfunction']) for agent in agents}
+
+
+def repriorize(ordering: AgentOrdering, events: Dict[str, List[int]]):
+    """
+    Agents leaving their start get precedence over everybody else, malfunctioning and arrived agents are moved to
+    the back so that nobody waits for them.
+    """
+    for handle in events['active']:
+        if ordering.rank(handle) >= 0:
+            ordering.move_to_front(handle)
+    for handle in events['malfunction'] + events['done']:
+        if ordering.rank(handle) >= 0:
+            ordering.move_to_back(handle)
@@ -1,11 +1,21 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Dict, Any
+
 import numpy as np
 from flatland.envs.rail_env import RailEnv
 
 from flatlander.envs.utils.priorization.helper import get_virtual_position
 
 
+def priority_order(priorities: Dict[int, Any]) -> List[int]:
+    """
+    Returns the handles sorted by descending priority, handles with equal priority keep their order.
+    """
+    handles = list(priorities.keys())
+    values = np.asarray(list(priorities.values()), dtype=float).reshape(len(handles), -1)[:, 0]
+    return [handles[i] for i in np.argsort(-values, kind='stable')]
+
+
 class Priorizer(ABC):
 
     @abstractmethod
@@ -13,49 +23,93 @@ class Priorizer(ABC):
         raise NotImplementedError()
 
 
-class DistToTargetPriorizer(Priorizer):
-    def priorize(self, handles: List[int], rail_env: RailEnv):
-        agent_distances = {}
-        distance_map = rail_env.distance_map.get()
-        nan_inf_mask = ((distance_map != np.inf) * (np.abs(np.isnan(distance_map) - 1))).astype(np.bool)
-        max_distance = np.max(distance_map[nan_inf_mask])
-
-        for h in handles:
-            agent_virtual_position = get_virtual_position(rail_env.agents[h])
-            if agent_virtual_position is not None:
-                distance = distance_map[h][agent_virtual_position + (rail_env.agents[h].direction,)]
-                distance = max_distance if (distance == np.inf or np.isnan(distance)) else distance
-                agent_distances[h] = distance
-
-        sorted_dists = {k: v for k, v in sorted(agent_distances.items(), key=lambda item: item[1])}
-        return list(sorted_dists.keys())
+class KeyPriorizer(Priorizer):
+    """
+    Priorizes the handles by a numeric key per agent, lowest key first. Handles with a nan key are dropped,
+    handles with equal keys keep their order.
+    """
 
+    @abstractmethod
+    def keys(self, handles: np.ndarray, rail_env: RailEnv) -> np.ndarray:
+        raise NotImplementedError()
 
-class NrAgentsWaitingPriorizer(Priorizer):
     def priorize(self, handles: List[int], rail_env: RailEnv):
-        agents_waiting = {}
-        for h in handles:
-            agent = rail_env.agents[h]
-
-            agents_same_start = [a for a in rail_env.agents
-                                 if a.initial_position == agent.initial_position]
-            nr_agents_same_start = len(agents_same_start)
-            agents_waiting[h] = nr_agents_same_start
+        keys = self.keys(np.asarray(handles, dtype=int), rail_env)
+        order = np.argsort(keys, kind='stable')
+        return [handles[i] for i in order if not np.isnan(keys[i])]
+
+
+class CompositePriorizer(KeyPriorizer):
+    """
+    Priorizes by the keys of the first priorizer, ties are broken by the keys of the following ones.
+    """
+
+    def __init__(self, priorizers: List[KeyPriorizer]):
+        self.priorizers = priorizers
+
+    def keys(self, handles: np.ndarray, rail_env: RailEnv) -> np.ndarray:
+        keys = [p.keys(handles, rail_env) for p in self.priorizers]
+        ranks = np.empty(len(handles))
+        ranks[np.lexsort(keys[::-1])] = np.arange(len(handles))
+        ranks[np.any(np.isnan(keys), axis=0)] = np.nan
+        return ranks
+
+
+class StartGroupPriorizer(KeyPriorizer):
+    """
+    Agents starting in larger groups first. The group sizes are computed in one pass per schedule and
+    cached until the env creates new agents.
+    """
+
+    def __init__(self, same_direction: bool = False):
+        self.same_direction = same_direction
+        self._agents = None
+        self._group_sizes = None
+
+    def keys(self, handles: np.ndarray, rail_env: RailEnv) -> np.ndarray:
+        if self._agents is not rail_env.agents or len(self._group_sizes) != len(rail_env.agents):
+            self._agents = rail_env.agents
+            self._group_sizes = self._start_group_sizes(rail_env)
+        return -self._group_sizes[handles].astype(float)
+
+    def _start_group_sizes(self, rail_env: RailEnv) -> np.ndarray:
+        if len(rail_env.agents) == 0:
+            return np.zeros(0, dtype=int)
+        starts = np.array([a.initial_position for a in rail_env.agents])
+        starts = starts[:, 0] * rail_env.width + starts[:, 1]
+        if self.same_direction:
+            starts = starts * 4 + np.array([a.initial_direction for a in rail_env.agents])
+        _, groups, sizes = np.unique(starts, return_inverse=True, return_counts=True)
+        return sizes[groups.reshape(-1)]
+
+
+class DistToTargetPriorizer(KeyPriorizer):
+    def __init__(self):
+        self._distance_map = None
+        self._max_distance = None
+
+    def keys(self, handles: np.ndarray, rail_env: RailEnv) -> np.ndarray:
+        distance_map = rail_env.distance_map.get()
+        if distance_map is not self._distance_map:
+            self._distance_map = distance_map
+            self._max_distance = np.max(distance_map[np.isfinite(distance_map)])
 
-        sorted_dists = {k: v for k, v in sorted(agents_waiting.items(), key=lambda item: item[1], reverse=True)}
-        return list(sorted_dists.keys())
+        keys = np.full(len(handles), np.nan)
+        positions = [get_virtual_position(rail_env.agents[h]) for h in handles]
+        on_grid = np.array([p is not None for p in positions], dtype=bool)
+        if np.any(on_grid):
+            cells = np.array([p for p in positions if p is not None])
+            directions = np.array([rail_env.agents[h].direction for h in handles[on_grid]])
+            distances = distance_map[handles[on_grid], cells[:, 0], cells[:, 1], directions]
+            keys[on_grid] = np.where(np.isfinite(distances), distances, self._max_distance)
+        return keys
 
 
-class NrAgentsSameStart(Priorizer):
-    def priorize(self, handles: List[int], rail_env: RailEnv):
-        agents_waiting = {}
-        for h in handles:
-            agent = rail_env.agents[h]
+class NrAgentsWaitingPriorizer(StartGroupPriorizer):
+    def __init__(self):
+        super().__init__(same_direction=False)
 
-            nr_agents_same_start_and_dir = len([a.handle for a in rail_env.agents
-                                                if a.initial_direction == agent.initial_direction
-                                                and a.initial_position == agent.initial_position])
-            agents_waiting[h] = nr_agents_same_start_and_dir
 
-        sorted_dists = {k: v for k, v in sorted(agents_waiting.items(), key=lambda item: item[1], reverse=True)}
-        return list(sorted_dists.keys())
+class NrAgentsSameStart(StartGroupPriorizer):
+    def __init__(self):
+        super().__init__(same_direction=True)
@@ -0,0 +1,245 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool
+from typing import Optional, Dict, Tuple, Iterable
+
+import numpy as np
+from flatland.core.grid.rail_env_grid import RailEnvTransitions
+from flatland.core.transition_map import GridTransitionMap
+from flatland.envs.distance_map import DistanceMap
+from flatland.envs.malfunction_generators import NoMalfunctionGen
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+from flatland.envs.schedule_utils import Schedule
+
+# columns of the agent table: initial row, initial col, direction, target row, target col, speed
+_AGENT_FIELDS = 6
+
+_BANK_FILES = ['seeds', 'grids', 'agents', 'max_episode_steps', 'distance_maps']
+
+
+class LoadedDistanceMap(DistanceMap):
+    """
+    Distance map which is not recomputed after a precomputed map was set, also if it was computed before.
+    """
+
+    def set(self, distance_map: np.ndarray):
+        super().set(distance_map)
+        self.agents_previous_computation = None
+
+
+def generate_episode(config: Dict, seed: int) -> Optional[Tuple[np.ndarray, np.ndarray, int, np.ndarray]]:
+    """
+    Generates the rail and schedule of a sparse generator config like FlatlandSparse with the given reset seed.
+    Returns the grid, the agent table, the max episode steps and the distance map, None if generation failed.
+    """
+    speed_ratio_map = None
+    if 'speed_ratio_map' in config:
+        speed_ratio_map = {float(k): float(v) for k, v in config['speed_ratio_map'].items()}
+    env = RailEnv(width=config['width'],
+                  height=config['height'],
+                  rail_generator=sparse_rail_generator(seed=config['seed'],
+                                                       max_num_cities=config['max_num_cities'],
+                                                       grid_mode=config['grid_mode'],
+                                                       max_rails_between_cities=config['max_rails_between_cities'],
+                                                       max_rails_in_city=config['max_rails_in_city']),
+                  schedule_generator=sparse_schedule_generator(speed_ratio_map),
+                  number_of_agents=config['number_of_agents'],
+                  malfunction_generator=NoMalfunctionGen(),
+                  obs_builder_object=GlobalObsForRailEnv(),
+                  remove_agents_at_target=True)
+    try:
+        env.reset(random_seed=seed)
+    except ValueError:
+        return None
+    agents = np.array([[*a.initial_position, a.initial_direction, *a.target, a.speed_data['speed']]
+                       for a in env.agents], dtype=float)
+    return env.rail.grid.copy(), agents, env._max_episode_steps, env.distance_map.get().astype(np.float32)
+
+
+def _generate_episode(args):
+    return args[1], generate_episode(*args)
+
+
+def generate_rail_bank(config: Dict, path: str, seeds: Iterable[int], n_workers: int = 1) -> 'RailBank':
+    """
+    Pregenerates the episodes of a generator config for the given reset seeds in parallel and stores them as
+    .npy files under `path`, which can be memory mapped. Seeds for which the generator fails are left out.
+    """
+    seeds = [int(s) for s in seeds]
+    assert all(s > 0 for s in seeds), "flatland ignores the reset seed 0"
+    os.makedirs(path, exist_ok=True)
+    height, width, n_agents = config['height'], config['width'], config['number_of_agents']
+
+    arrays = {
+        'seeds': np.lib.format.open_memmap(os.path.join(path, 'seeds.npy'), mode='w+', dtype=np.int64,
+                                           shape=(len(seeds),)),
+        'grids': np.lib.format.open_memmap(os.path.join(path, 'grids.npy'), mode='w+', dtype=np.uint16,
+                                           shape=(len(seeds), height, width)),
+        'agents': np.lib.format.open_memmap(os.path.join(path, 'agents.npy'), mode='w+', dtype=float,
+                                            shape=(len(seeds), n_agents, _AGENT_FIELDS)),
+        'max_episode_steps': np.lib.format.open_memmap(os.path.join(path, 'max_episode_steps.npy'), mode='w+',
+                                                       dtype=np.int64, shape=(len(seeds),)),
+        'distance_maps': np.lib.format.open_memmap(os.path.join(path, 'distance_maps.npy'), mode='w+',
+                                                   dtype=np.float32, shape=(len(seeds), n_agents, height, width, 4))
+    }
+    arrays['seeds'][:] = -1
+
+    jobs = [(config, seed) for seed in seeds]
+    with Pool(n_workers) as pool:
+        for i, (seed, episode) in enumerate(pool.imap(_generate_episode, jobs)):
+            if episode is None:
+                continue
+            grid, agents, max_episode_steps, distance_map = episode
+            arrays['seeds'][i] = seed
+            arrays['grids'][i] = grid
+            arrays['agents'][i] = agents
+            arrays['max_episode_steps'][i] = max_episode_steps
+            arrays['distance_maps'][i] = distance_map
+
+    for array in arrays.values():
+        array.flush()
+    return RailBank(path)
+
+
+class EpisodeSource:
+    """
+    Rail and schedule generator for a RailEnv which hand out precomputed episodes (grid, agent table, max episode
+    steps and distance map). The episode of the next reset is chosen with select(seed).
+    """
+
+    def __init__(self):
+        self._episode = None
+
+    def select(self, seed: Optional[int] = None):
+        raise NotImplementedError()
+
+    def _next_episode(self) -> Tuple[np.ndarray, np.ndarray, int, np.ndarray]:
+        raise NotImplementedError()
+
+    def rail_generator(self):
+        def generator(width, height, num_agents, num_resets=0, np_random=None):
+            self._episode = self._next_episode()
+            grid, _, _, distance_map = self._episode
+            rail = GridTransitionMap(width=grid.shape[1], height=grid.shape[0], transitions=RailEnvTransitions())
+            rail.grid = np.array(grid)
+            return rail, {'distance_map': np.array(distance_map, dtype=float)}
+
+        return generator
+
+    def schedule_generator(self):
+        def generator(rail, num_agents, hints=None, num_resets=0, np_random=None):
+            _, agents, max_episode_steps, _ = self._episode
+            agents = np.array(agents)
+            positions = [(int(a[0]), int(a[1])) for a in agents]
+            targets = [(int(a[3]), int(a[4])) for a in agents]
+            directions = [int(a[2]) for a in agents]
+            return Schedule(agent_positions=positions, agent_directions=directions, agent_targets=targets,
+                            agent_speeds=[float(s) for s in agents[:, 5]], agent_malfunction_rates=None,
+                            max_episode_steps=int(max_episode_steps))
+
+        return generator
+
+    def attach(self, rail_env: RailEnv):
+        """
+        Makes the rail env use the precomputed distance maps.
+        """
+        rail_env.distance_map = LoadedDistanceMap(rail_env.agents, rail_env.height, rail_env.width)
+
+
+class RailBank(EpisodeSource):
+    """
+    Pregenerated episodes of one generator config, memory mapped from disk and selected by their reset seed.
+    Without a selection the episodes are used in order.
+    """
+
+    def __init__(self, path: str, offset: int = 0):
+        super().__init__()
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in _BANK_FILES}
+        valid = np.flatnonzero(arrays['seeds'] >= 0)
+        assert len(valid) > 0, "rail bank {} is empty".format(path)
+        self._arrays = arrays
+        self._rows = {int(arrays['seeds'][i]): int(i) for i in valid}
+        self._order = valid
+        self._cursor = offset % len(valid)
+        self._selected = None
+
+    @property
+    def seeds(self):
+        return list(self._rows.keys())
+
+    @property
+    def number_of_agents(self) -> int:
+        return self._arrays['agents'].shape[1]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, seed):
+        return seed in self._rows
+
+    def select(self, seed: Optional[int] = None):
+        """
+        Selects the episode of the next reset, the next one in order if the seed is None or not in the bank.
+        """
+        if seed is not None and seed in self._rows:
+            self._selected = self._rows[seed]
+        else:
+            self._selected = int(self._order[self._cursor])
+            self._cursor = (self._cursor + 1) % len(self._order)
+
+    def _next_episode(self):
+        if self._selected is None:
+            self.select()
+        row, self._selected = self._selected, None
+        return tuple(self._arrays[name][row] for name in ['grids', 'agents', 'max_episode_steps', 'distance_maps'])
+
+
+class EpisodePrefetcher(EpisodeSource):
+    """
+    Generates the episode of the next reset in a background process while the current episode runs. The reset
+    seed of the k-th episode is derived from the seed and k, an explicitly selected seed restarts the sequence
+    from there. Episodes for which the generator fails are skipped, up to max_failures in a row.
+    """
+
+    def __init__(self, config: Dict, seed: int = 1, max_failures: int = 10):
+        super().__init__()
+        assert seed > 0, "flatland ignores the reset seed 0"
+        self._config = config
+        self._seed = seed
+        self._max_failures = max_failures
+        self._episode_count = 0
+        self._executor = ProcessPoolExecutor(max_workers=1)
+        self._pending = None
+        self._prefetch()
+
+    def episode_seed(self, episode: int) -> int:
+        if episode == 0:
+            return self._seed
+        return hash((self._seed, episode)) % (2 ** 31 - 1) + 1
+
+    def _prefetch(self):
+        seed = self.episode_seed(self._episode_count)
+        self._pending = (seed, self._executor.submit(generate_episode, self._config, seed))
+
+    def select(self, seed: Optional[int] = None):
+        if not seed or seed == self._pending[0]:
+            return
+        self._pending[1].cancel()
+        self._seed, self._episode_count = seed, 0
+        self._prefetch()
+
+    def _next_episode(self):
+        for _ in range(self._max_failures + 1):
+            episode = self._pending[1].result()
+            self._episode_count += 1
+            self._prefetch()
+            if episode is not None:
+                return episode
+        raise RuntimeError("The generator failed for {} episodes in a row".format(self._max_failures + 1))
+
+    def close(self):
+        self._pending[1].cancel()
+        self._executor.shutdown(wait=False)
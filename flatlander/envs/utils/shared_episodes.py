@@ -0,0 +1,89 @@
+import hashlib
+import weakref
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from flatland.core.transition_map import GridTransitionMap
+from flatland.envs.agent_utils import EnvAgent
+from flatland.envs.distance_map import DistanceMap
+from flatland.envs.rail_env import RailEnv
+
+
+def _generator_key(np_random: np.random.RandomState, *args) -> tuple:
+    name, keys, pos, has_gauss, cached_gaussian = np_random.get_state()
+    return args + (hashlib.sha1(keys.tobytes()).hexdigest(), pos, has_gauss, cached_gaussian)
+
+
+class SharedDistanceMap(DistanceMap):
+    """
+    Distance map shared by the envs on the same rail object with the same agent targets. The shared map must not
+    be modified.
+    """
+
+    _maps = weakref.WeakKeyDictionary()
+
+    def _compute(self, agents: List[EnvAgent], rail: GridTransitionMap):
+        maps = SharedDistanceMap._maps.setdefault(rail, {})
+        targets = tuple(agent.target for agent in agents)
+        if targets in maps:
+            self.agents_previous_computation = self.agents
+            self.distance_map = maps[targets]
+        else:
+            super()._compute(agents, rail)
+            self.distance_map.flags.writeable = False
+            maps[targets] = self.distance_map
+
+
+class SharedEpisodeCache:
+    """
+    Shares the generated rails and schedules between envs with the same generator configs (e.g. the sub envs of a
+    worker). Generators which are called with the same arguments and random state as before return the rail or
+    schedule of that call and leave the random state as that call did, instead of generating it again. Envs sharing
+    a rail object also share the rail caches (transitions, next cells) and through SharedDistanceMap the distance
+    maps.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _generate(self, key, np_random: np.random.RandomState, generate):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            result, state = self._entries[key]
+            np_random.set_state(state)
+            return result
+        self.misses += 1
+        result = generate()
+        self._entries[key] = result, np_random.get_state()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+    def rail_generator(self, rail_generator):
+        def generator(width, height, num_agents, num_resets=0, np_random=None):
+            key = _generator_key(np_random, 'rail', width, height, num_agents, num_resets)
+            return self._generate(key, np_random,
+                                  lambda: rail_generator(width, height, num_agents, num_resets, np_random))
+
+        return generator
+
+    def schedule_generator(self, schedule_generator):
+        def generator(rail, num_agents, hints=None, num_resets=0, np_random=None):
+            key = _generator_key(np_random, 'schedule', rail, num_agents, num_resets)
+            return self._generate(key, np_random,
+                                  lambda: schedule_generator(rail, num_agents, hints, num_resets, np_random))
+
+        return generator
+
+    def attach(self, rail_env: RailEnv):
+        """
+        Lets the rail env generate its next episodes through the cache and share the distance maps.
+        """
+        rail_env.rail_generator = self.rail_generator(rail_env.rail_generator)
+        rail_env.schedule_generator = self.schedule_generator(rail_env.schedule_generator)
+        rail_env.distance_map = SharedDistanceMap(rail_env.agents, rail_env.height, rail_env.width)
@@ -0,0 +1,44 @@
+import fcntl
+import os
+from collections import defaultdict
+from typing import Optional, Hashable
+
+_local_counts = defaultdict(int)
+
+
+class SharedStepCounter:
+    """
+    Env step counter which can be shared by the sub envs of a training run. With a key the count is shared by the
+    counters with the same key in the process (the vector envs of a worker), with a path it is kept in that file and
+    shared by all workers. Without either the counter only counts its own steps.
+
+    Steps are added locally and only written to the shared count on sync(), which returns the total.
+    """
+
+    def __init__(self, path: Optional[str] = None, key: Optional[Hashable] = None):
+        self._path = path
+        self._key = key
+        self._count = 0
+        self._pending = 0
+
+    def add(self, steps: int = 1):
+        self._pending += steps
+
+    def sync(self) -> int:
+        if self._path is None and self._key is None:
+            self._count += self._pending
+            total = self._count
+        elif self._path is None:
+            _local_counts[self._key] += self._pending
+            total = _local_counts[self._key]
+        else:
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.pread(fd, 8, 0)
+                total = (int.from_bytes(data, 'little') if len(data) == 8 else 0) + self._pending
+                os.pwrite(fd, total.to_bytes(8, 'little'), 0)
+            finally:
+                os.close(fd)
+        self._pending = 0
+        return total
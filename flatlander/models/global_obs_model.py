@@ -7,6 +7,32 @@ from flatlander.models.common.models import NatureCNN, ImpalaCNN
 import numpy as np
 
 
+def expand_ego_channels(inputs):
+    """
+    tensorflow version of flatlander.envs.observations.global_obs.expand_ego_channels: rebuilds the agent's own
+    target/direction channels from the ego vector and removes the agent from the other agents channels
+    """
+    shared_obs, ego = inputs
+    height, width = shared_obs.shape[1], shared_obs.shape[2]
+    depth = len(grid4.Grid4TransitionsEnum) + 1
+    ego = tf.cast(ego, tf.int32)
+
+    def cell_map(row, col):
+        # negative indices (agent not on the map) result in an empty map
+        index = tf.where(row >= 0, row * width + col, -1)
+        return tf.reshape(tf.one_hot(index, height * width), (-1, height, width, 1))
+
+    own_target = cell_map(ego[:, 0], ego[:, 1])
+    own_position = cell_map(ego[:, 2], ego[:, 3])
+    no_agent = tf.one_hot(0, depth)
+    own_direction = own_position * tf.reshape(tf.one_hot(ego[:, 4] + 1, depth), (-1, 1, 1, depth)) \
+        + (1 - own_position) * no_agent
+    on_grid = own_position * tf.reshape(tf.cast(ego[:, 5], tf.float32), (-1, 1, 1, 1))
+    others_direction = (1 - on_grid) * shared_obs[..., 23:28] + on_grid * no_agent
+    return tf.concat([shared_obs[..., :16], own_target, shared_obs[..., 17:18], own_direction,
+                      others_direction, shared_obs[..., 28:]], axis=-1)
+
+
 class GlobalObsModel(TFModelV2):
     def import_from_h5(self, h5_file):
         pass
@@ -20,12 +46,23 @@ class GlobalObsModel(TFModelV2):
         self.baseline = None
         self._mask_unavailable_actions = self._options.get("mask_unavailable_actions", False)
 
-        if self._mask_unavailable_actions:
-            obs_space = obs_space['obs']
+        original_space = getattr(obs_space, 'original_space', None)
+        if self._mask_unavailable_actions and original_space is not None:
+            original_space = original_space['obs']
+        # shared global observation + ego vector, see flatlander.envs.observations.global_obs
+        self._shared_obs = isinstance(original_space, gym.spaces.Tuple)
+
+        if self._shared_obs:
+            inputs = [tf.keras.layers.Input(shape=o.shape) for o in original_space]
+            observations = tf.keras.layers.Lambda(expand_ego_channels)(inputs)
         else:
-            obs_space = self.obs_space
+            if self._mask_unavailable_actions:
+                obs_space = obs_space['obs']
+            else:
+                obs_space = self.obs_space
 
-        observations = tf.keras.layers.Input(shape=obs_space.shape)
+            observations = tf.keras.layers.Input(shape=obs_space.shape)
+            inputs = observations
 
         if self._options['architecture'] == 'nature':
             conv_out = NatureCNN(activation_out=True, **self._options.get('architecture_options', {}))(observations)
@@ -40,7 +77,7 @@ class GlobalObsModel(TFModelV2):
             z = tf.keras.layers.Dense(units=np.sum(action_space.nvec))(conv_out)
         baseline = tf.keras.layers.Dense(units=1)(conv_out)
 
-        self._model = tf.keras.Model(inputs=observations, outputs=[z, baseline])
+        self._model = tf.keras.Model(inputs=inputs, outputs=[z, baseline])
         self.register_variables(self._model.variables)
         # self._model.summary()
 
@@ -50,7 +87,10 @@ class GlobalObsModel(TFModelV2):
             obs = input_dict['obs']['obs']
         else:
             obs = input_dict['obs']
-        obs = tf.cast(obs, dtype=tf.float32)
+        if self._shared_obs:
+            obs = [tf.cast(o, dtype=tf.float32) for o in obs]
+        else:
+            obs = tf.cast(obs, dtype=tf.float32)
         logits, baseline = self._model(obs)
         #if isinstance(self._action_space, gym.spaces.MultiDiscrete):
         #    logits = tf.reshape(logits, (self._action_space.nvec.shape[0], self._action_space.nvec[0]))
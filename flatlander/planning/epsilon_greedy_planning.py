@@ -6,6 +6,7 @@ from flatland.envs.agent_utils import RailAgentStatus
 from flatland.envs.rail_env import RailEnv, RailEnvActions
 import numpy as np
 from flatlander.agents.heuristic_agent import HeuristicPriorityAgent
+from flatlander.envs.utils.gym_env import suppressed_observations
 from flatlander.submission.helper import get_agent_pos, is_done
 
 
@@ -31,26 +32,28 @@ def epsilon_greedy_plan(env: RailEnv, obs_dict, budget_seconds=60, epsilon=0.1,
         dones = defaultdict(lambda: False)
         print(f'\nPlanning step {plan_step + 1}')
 
-        while not dones['__all__'] and not budget_used:
-            actions = defaultdict(lambda: None, policy_agent.compute_actions(obs_dict,
-                                                                             env=local_env))
-            for agent in env.agents:
-                pos = get_agent_pos(agent)
-                next_possible_moves = local_env.rail.get_transitions(*pos, agent.direction)
-                departed = agent.status.value != RailAgentStatus.READY_TO_DEPART.value
+        # the observations are only built if the agent reads them
+        with suppressed_observations(local_env, lazy=True):
+            while not dones['__all__'] and not budget_used:
+                actions = defaultdict(lambda: None, policy_agent.compute_actions(obs_dict,
+                                                                                 env=local_env))
+                for agent in env.agents:
+                    pos = get_agent_pos(agent)
+                    next_possible_moves = local_env.rail.get_transitions(*pos, agent.direction)
+                    departed = agent.status.value != RailAgentStatus.READY_TO_DEPART.value
 
-                if np.random.random() < epsilon and promising(next_possible_moves, departed):
-                    possible_actions = set(np.flatnonzero(next_possible_moves))
-                    possible_actions = possible_actions.union({RailEnvActions.STOP_MOVING.value,
-                                                               RailEnvActions.MOVE_FORWARD.value})
-                    non_default_actions = possible_actions.difference({actions[agent.handle]})
-                    actions[agent.handle] = np.random.choice(list(non_default_actions))
+                    if np.random.random() < epsilon and promising(next_possible_moves, departed):
+                        possible_actions = set(np.flatnonzero(next_possible_moves))
+                        possible_actions = possible_actions.union({RailEnvActions.STOP_MOVING.value,
+                                                                   RailEnvActions.MOVE_FORWARD.value})
+                        non_default_actions = possible_actions.difference({actions[agent.handle]})
+                        actions[agent.handle] = np.random.choice(list(non_default_actions))
 
-            action_memory.append(actions)
-            obs_dict, all_rewards, dones, info = local_env.step(actions)
-            episode_return += np.sum(list(all_rewards))
+                action_memory.append(actions)
+                obs_dict, all_rewards, dones, info = local_env.step(actions)
+                episode_return += np.sum(list(all_rewards))
 
-            budget_used = (time() - start_t) > budget_seconds
+                budget_used = (time() - start_t) > budget_seconds
 
         if not budget_used:
             all_returns.append(episode_return)
@@ -7,6 +7,7 @@ from flatland.envs.agent_utils import RailAgentStatus
 from flatlander.agents.agent import Agent
 import numpy as np
 
+from flatlander.envs.utils.gym_env import suppressed_observations
 from flatlander.submission.helper import get_agent_pos, is_done
 
 
@@ -98,44 +99,46 @@ class Phenotype:
         local_env = deepcopy(self.env)
         obs_dict = self.initial_obs
 
-        for actions in self.genotype:
-            if not self.budget_function():
-                obs_dict, all_rewards, dones, info = local_env.step(actions)
-                episode_return += np.sum(list(all_rewards))
-
-        while not dones['__all__'] and not self.budget_function():
-            actions: defaultdict[int, Optional[int]] = defaultdict(lambda: None,
-                                                                   self.default_behaviour.compute_actions(
-                                                                       obs_dict,
-                                                                       env=local_env))
-            transitions = defaultdict(lambda: None)
-            agents_departed = defaultdict(lambda: True)
+        # the observations are only built if the default behaviour reads them
+        with suppressed_observations(local_env, lazy=True):
+            for actions in self.genotype:
+                if not self.budget_function():
+                    obs_dict, all_rewards, dones, info = local_env.step(actions)
+                    episode_return += np.sum(list(all_rewards))
+
+            while not dones['__all__'] and not self.budget_function():
+                actions: defaultdict[int, Optional[int]] = defaultdict(lambda: None,
+                                                                       self.default_behaviour.compute_actions(
+                                                                           obs_dict,
+                                                                           env=local_env))
+                transitions = defaultdict(lambda: None)
+                agents_departed = defaultdict(lambda: True)
 
-            for agent in local_env.agents:
-                pos = get_agent_pos(agent)
-                next_possible_moves = local_env.rail.get_transitions(*pos, agent.direction)
-
-                actions = defaultdict(lambda: None, self.default_behaviour.compute_actions(obs_dict,
-                                                                                           env=local_env))
                 for agent in local_env.agents:
                     pos = get_agent_pos(agent)
                     next_possible_moves = local_env.rail.get_transitions(*pos, agent.direction)
 
-                    if np.random.random() < self.epsilon:
-                        possible_actions = set(np.flatnonzero(next_possible_moves))
-                        possible_actions = possible_actions.union({RailEnvActions.STOP_MOVING.value,
-                                                                   RailEnvActions.MOVE_FORWARD.value})
-                        non_default_actions = possible_actions.difference({actions[agent.handle]})
-                        actions[agent.handle] = np.random.choice(list(non_default_actions))
-
-                transitions[agent.handle] = next_possible_moves
-                agents_departed[agent.handle] = agent.status.value != RailAgentStatus.READY_TO_DEPART.value
-
-            self.genotype.append(actions)
-            self.possible_mutations.append(transitions)
-            self.departed.append(agents_departed)
-            obs_dict, all_rewards, dones, info = local_env.step(actions)
-            episode_return += np.sum(list(all_rewards))
+                    actions = defaultdict(lambda: None, self.default_behaviour.compute_actions(obs_dict,
+                                                                                               env=local_env))
+                    for agent in local_env.agents:
+                        pos = get_agent_pos(agent)
+                        next_possible_moves = local_env.rail.get_transitions(*pos, agent.direction)
+
+                        if np.random.random() < self.epsilon:
+                            possible_actions = set(np.flatnonzero(next_possible_moves))
+                            possible_actions = possible_actions.union({RailEnvActions.STOP_MOVING.value,
+                                                                       RailEnvActions.MOVE_FORWARD.value})
+                            non_default_actions = possible_actions.difference({actions[agent.handle]})
+                            actions[agent.handle] = np.random.choice(list(non_default_actions))
+
+                    transitions[agent.handle] = next_possible_moves
+                    agents_departed[agent.handle] = agent.status.value != RailAgentStatus.READY_TO_DEPART.value
+
+                self.genotype.append(actions)
+                self.possible_mutations.append(transitions)
+                self.departed.append(agents_departed)
+                obs_dict, all_rewards, dones, info = local_env.step(actions)
+                episode_return += np.sum(list(all_rewards))
 
         if not self.budget_function():
             percentage_complete = np.sum(
@@ -1,5 +1,7 @@
 import os
+import uuid
 from argparse import ArgumentParser
+from functools import partial
 from pathlib import Path
 
 import gym
@@ -9,7 +11,7 @@ import yaml
 from gym.spaces import Tuple
 from ray.cluster_utils import Cluster
 from ray.rllib.utils import try_import_tf, try_import_torch
-from ray.tune import run_experiments, register_env
+from ray.tune import run_experiments, register_env, sample_from
 from ray.tune.logger import TBXLogger
 from ray.tune.resources import resources_to_json
 from ray.tune.tune import _make_scheduler
@@ -22,7 +24,9 @@ from flatlander.envs.utils.global_gym_env import GlobalFlatlandGymEnv
 from flatlander.envs.utils.gym_env_fill_missing import FillingFlatlandGymEnv
 from flatlander.logging.custom_metrics import on_episode_end
 from flatlander.logging.wandb_logger import WandbLogger
-from flatlander.utils.loader import load_envs, load_models
+from flatlander.utils.demonstration_reader import DemonstrationInputReader
+from flatlander.utils.demonstrations import is_demonstration_dataset
+from flatlander.utils.loader import load_envs, load_models, custom_model_names
 
 ray_results.DEFAULT_RESULTS_DIR = os.path.join(os.getcwd(), "..", "..", "..", "flatland-challenge-data/results")
 
@@ -34,7 +38,6 @@ class ExperimentRunner:
         self.tf = try_import_tf()
         self.torch, _ = try_import_torch()
         load_envs(os.path.dirname(__file__))
-        load_models(os.path.dirname(__file__))
 
     @staticmethod
     def get_experiments(run_args, arg_parser: ArgumentParser = None):
@@ -164,6 +167,14 @@ class ExperimentRunner:
                         rllib_dir = Path(__file__).parent
                         input_file = rllib_dir.absolute().joinpath(exp["config"]["input"])
                         exp["config"]["input"] = str(input_file)
+                    if is_demonstration_dataset(exp["config"]["input"]):
+                        exp["config"]["input"] = partial(DemonstrationInputReader, exp["config"]["input"])
+
+            env_config = exp.get("config", {}).get("env_config", {})
+            if isinstance(env_config.get("step_counter"), str):
+                # every trial counts its steps in a new file, a restored trial keeps its file
+                env_config["step_counter"] = sample_from(
+                    lambda _, path=env_config["step_counter"]: "{}.{}".format(path, uuid.uuid4().hex))
 
             if exp["run"] in self.group_algorithms:
                 self.setup_grouping(exp.get("config"))
@@ -216,6 +227,7 @@ class ExperimentRunner:
                 num_cpus=args.ray_num_cpus if args.ray_num_cpus is not None else n_cpu,
                 num_gpus=args.ray_num_gpus if args.ray_num_gpus is not None else n_gpu)
 
+        load_models(os.path.dirname(__file__), names=custom_model_names(experiments))
         run_experiments(
             experiments,
             scheduler=_make_scheduler(args),
@@ -2,19 +2,15 @@ import multiprocessing
 import os
 
 import numpy as np
-import ray
 import yaml
 from flatland.envs.agent_utils import RailAgentStatus
 from flatland.envs.persistence import RailEnvPersister
 from flatland.envs.rail_env import RailEnv
-from ray.rllib.agents import Trainer
-from ray.tune import register_env
-from ray.tune.trial import Trial
 
-from flatlander.envs.flatland_sparse import FlatlandSparse
-from flatlander.utils.helper import is_done
-from flatlander.utils.loader import load_models, load_envs
-from flatlander.submission.submissions import RUN, CURRENT_ENV_PATH, get_tune_time, AGENT_MAP
+from flatlander.utils.helper import is_done, get_agent_pos
+
+# ray, rllib (and with it tensorflow) are only imported by the functions running a trained agent, the heuristic
+# submissions and the planners only use the episode helpers
 
 n_cpu = multiprocessing.cpu_count()
 print("***** NUM CPUS AVAILABLE:", n_cpu, "*****")
@@ -22,6 +18,7 @@ print("***** NUM CPUS AVAILABLE:", n_cpu, "*****")
 RAY_INITIALIZED = False
 
 def get_parameters(run=None):
+    from flatlander.submission.submissions import RUN
     if run is None:
         run = RUN
         print("RUNNING", RUN)
@@ -35,6 +32,7 @@ def get_parameters(run=None):
 
 
 def init_ray():
+    import ray
     global RAY_INITIALIZED
     if not RAY_INITIALIZED:
         ray.init(local_mode=True, num_cpus=n_cpu)
@@ -42,18 +40,20 @@ def init_ray():
 
 
 def init_run(run=None):
+    from flatlander.utils.loader import load_models, load_envs, custom_model_names
     init_ray()
     run, config = get_parameters(run)
 
     load_envs(os.path.abspath(
         os.path.join(os.path.dirname(__file__), "../runner")))
     load_models(os.path.abspath(
-        os.path.join(os.path.dirname(__file__), "../runner")))
+        os.path.join(os.path.dirname(__file__), "../runner")), names=custom_model_names(config))
 
     return config, run
 
 
-def get_agent(config, run) -> Trainer:
+def get_agent(config, run) -> 'Trainer':
+    from flatlander.submission.submissions import AGENT_MAP
     agent = AGENT_MAP[run["agent"]](config=config)
     agent.restore(run["checkpoint_paths"])
     return agent
@@ -93,6 +93,12 @@ def fine_tune(config, run, env: RailEnv):
     """
     Fine-tune the agent on a static env at evaluation time
     """
+    import ray
+    from ray.tune import register_env
+    from ray.tune.trial import Trial
+    from flatlander.envs.flatland_sparse import FlatlandSparse
+    from flatlander.submission.submissions import CURRENT_ENV_PATH, get_tune_time
+
     RailEnvPersister.save(env, CURRENT_ENV_PATH)
     num_agents = env.get_num_agents()
     tune_time = get_tune_time(num_agents)
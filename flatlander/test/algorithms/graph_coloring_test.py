@@ -0,0 +1,33 @@
+import random
+import unittest
+
+from flatlander.algorithms.graph_coloring import GreedyGraphColoring, IncrementalGraphColoring
+
+
+class IncrementalGraphColoringTest(unittest.TestCase):
+
+    def test_same_as_greedy(self):
+        rnd = random.Random(0)
+        n_nodes = 20
+        coloring = IncrementalGraphColoring(colors=[1, 0])
+        edges = set()
+        for _ in range(30):
+            for _ in range(3):
+                edges ^= {(rnd.randrange(n_nodes), rnd.randrange(n_nodes))}
+            neighbors = {h: [b for a, b in edges if a == h] for h in range(n_nodes)}
+            assert coloring.color(nodes=range(n_nodes), neighbors=neighbors) == \
+                   GreedyGraphColoring.color(nodes=range(n_nodes), neighbors=neighbors, colors=[1, 0])
+
+    def test_only_changed_components_recolored(self):
+        coloring = IncrementalGraphColoring(colors=[1, 0])
+        neighbors = {0: [1], 1: [0], 2: [3], 3: [2]}
+        coloring.color(nodes=range(4), neighbors=neighbors)
+        assert coloring.recolored == 4
+        neighbors[2] = []
+        neighbors[3] = []
+        coloring.color(nodes=range(4), neighbors=neighbors)
+        assert coloring.recolored == 6
+
+
+if __name__ == '__main__':
+    unittest.main()
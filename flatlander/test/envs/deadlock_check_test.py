@@ -0,0 +1,66 @@
+import random
+import unittest
+
+import numpy as np
+from flatland.core.grid.grid4_utils import get_new_position
+from flatland.envs.agent_utils import RailAgentStatus
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.utils.deadlock_check import get_movable_agents, check_if_all_blocked
+
+
+def movable_agents_loop(env):
+    """the movable agents as found by the original loop of check_if_all_blocked"""
+    location_has_agent = {}
+    for agent in env.agents:
+        if agent.status in [RailAgentStatus.ACTIVE, RailAgentStatus.DONE] and agent.position:
+            location_has_agent[tuple(agent.position)] = 1
+
+    movable = []
+    for handle in env.get_agent_handles():
+        agent = env.agents[handle]
+        if agent.status == RailAgentStatus.READY_TO_DEPART:
+            agent_virtual_position = agent.initial_position
+        elif agent.status == RailAgentStatus.ACTIVE:
+            agent_virtual_position = agent.position
+        elif agent.status == RailAgentStatus.DONE:
+            agent_virtual_position = agent.target
+        else:
+            continue
+
+        possible_transitions = env.rail.get_transitions(*agent_virtual_position, agent.direction)
+        orientation = agent.direction
+        for branch_direction in [(orientation + i) % 4 for i in range(-1, 3)]:
+            if possible_transitions[branch_direction]:
+                new_position = get_new_position(agent_virtual_position, branch_direction)
+                if new_position not in location_has_agent:
+                    movable.append(handle)
+                    break
+    return movable
+
+
+class DeadlockCheckTest(unittest.TestCase):
+
+    def test_matches_loop(self):
+        for seed in range(5):
+            env = RailEnv(width=25, height=25,
+                          rail_generator=sparse_rail_generator(max_num_cities=2, seed=seed, grid_mode=False,
+                                                               max_rails_between_cities=1, max_rails_in_city=2),
+                          schedule_generator=sparse_schedule_generator(),
+                          number_of_agents=15,
+                          obs_builder_object=GlobalObsForRailEnv(),
+                          remove_agents_at_target=seed % 2 == 0)
+            env.reset(random_seed=seed)
+            rnd = random.Random(seed)
+            for _ in range(80):
+                env.step({h: rnd.choice([0, 1, 2, 2, 2, 3, 4]) for h in env.get_agent_handles()})
+                expected = movable_agents_loop(env)
+                np.testing.assert_array_equal(get_movable_agents(env), expected)
+                assert check_if_all_blocked(env) == (len(expected) == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
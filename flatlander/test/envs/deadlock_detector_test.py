@@ -0,0 +1,36 @@
+import random
+import unittest
+
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.utils.deadlock_detector import DeadlockDetector
+
+
+class DeadlockDetectorTest(unittest.TestCase):
+
+    def test_incremental_update(self):
+        env = RailEnv(width=30, height=30,
+                      rail_generator=sparse_rail_generator(max_num_cities=3, seed=1, grid_mode=False,
+                                                           max_rails_between_cities=1, max_rails_in_city=2),
+                      schedule_generator=sparse_schedule_generator(),
+                      number_of_agents=20,
+                      obs_builder_object=GlobalObsForRailEnv())
+        env.reset(random_seed=1)
+        rnd = random.Random(1)
+        detector = DeadlockDetector(env)
+        for _ in range(100):
+            env.step({h: rnd.choice([1, 2, 2, 3, 4]) for h in range(env.get_num_agents())})
+            detector.update()
+            rebuilt = DeadlockDetector(env)
+            handles = range(env.get_num_agents())
+            assert detector.movable_agents() == rebuilt.movable_agents()
+            assert [detector.deadlocked_agents(h) for h in handles] == [rebuilt.deadlocked_agents(h) for h in handles]
+            assert [detector.blocked_train(h) for h in handles if env.agents[h].position is not None] == \
+                   [rebuilt.blocked_train(h) for h in handles if env.agents[h].position is not None]
+
+
+if __name__ == '__main__':
+    unittest.main()
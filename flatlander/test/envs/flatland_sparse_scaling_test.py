@@ -0,0 +1,60 @@
+import os
+import unittest
+
+import numpy as np
+import yaml
+
+try:
+    from flatlander.envs.flatland_sparse_scaling import FlatlandSparseScaling
+except ImportError:  # the envs need ray
+    FlatlandSparseScaling = None
+
+
+def load_config():
+    with open(os.path.join(os.path.dirname(__file__), 'test_config.yaml')) as f:
+        return yaml.safe_load(f)
+
+
+@unittest.skipIf(FlatlandSparseScaling is None, "ray is not installed")
+class FlatlandSparseScalingTests(unittest.TestCase):
+
+    def test_num_agents(self):
+        env = FlatlandSparseScaling(load_config())
+        assert env.get_num_agents(1000) == 1
+        assert env.get_num_agents(100001) == 2
+        assert env.get_num_agents(474000) == 3
+        assert env.get_num_agents(475001) == 4
+
+    def test_max_agents(self):
+        env = FlatlandSparseScaling(load_config())
+        assert env.get_num_agents(100000000000) == 10
+
+    def test_reset_adds_agents_on_kept_rail(self):
+        env = FlatlandSparseScaling(dict(load_config(), add_agent_interval=10, interval_growth_rate=1.0))
+        env._env._regenerate_rail_on_reset = False
+        env.reset()
+        rail_env = env._env.rail_env
+        grid = np.copy(rail_env.rail.grid)
+        assert rail_env.get_num_agents() == 1
+
+        for _ in range(25):
+            env.step({0: 2})
+        obs = env.reset()
+        assert env._env.rail_env is rail_env
+        assert rail_env.get_num_agents() == 3
+        assert set(obs.keys()) == {0, 1, 2}
+        assert np.array_equal(rail_env.rail.grid, grid)
+
+    def test_step_counter_key(self):
+        config = dict(load_config(), add_agent_interval=10, interval_growth_rate=1.0,
+                      step_counter_key='scaling_test')
+        envs = [FlatlandSparseScaling(config) for _ in range(2)]
+        for env in envs:
+            env.reset()
+            for _ in range(6):
+                env.step({0: 2})
+        # the steps of an env are added to the shared count when it resets
+        envs[0].reset()
+        assert envs[0]._env.rail_env.get_num_agents() == 1
+        envs[1].reset()
+        assert envs[1]._env.rail_env.get_num_agents() == 2
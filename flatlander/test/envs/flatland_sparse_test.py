@@ -0,0 +1,72 @@
+import os
+import unittest
+
+import numpy as np
+import yaml
+
+from flatlander.envs.utils.gym_env import suppressed_observations, build_observations
+
+try:
+    from flatlander.envs.flatland_sparse import FlatlandSparse
+except ImportError:  # the envs need ray
+    FlatlandSparse = None
+
+
+def load_config(**overrides):
+    with open(os.path.join(os.path.dirname(__file__), 'test_config.yaml')) as f:
+        return dict(yaml.safe_load(f), **overrides)
+
+
+@unittest.skipIf(FlatlandSparse is None, "ray is not installed")
+class FlatlandSparseTest(unittest.TestCase):
+
+    def test_close_prefetcher(self):
+        env = FlatlandSparse(load_config(prefetch_episodes=True, number_of_agents=2))
+        prefetcher = env._episode_source
+        env.reset()
+        done = {'__all__': False}
+        while not done['__all__']:
+            _, _, done, _ = env.step({h: 2 for h in range(2)})
+        # the end of an episode keeps the prefetcher running
+        assert not prefetcher._executor._shutdown_thread
+        env.reset()
+        env.close()
+        assert prefetcher._executor._shutdown_thread
+
+    def test_sparse_priorization_dict_observations(self):
+        env = FlatlandSparse(load_config(sparse_priorization=True, number_of_agents=2))
+        obs = env.reset()
+        obs, _, _, _ = env.step({h: 0.5 for h in obs})
+        # rllib asserts a dict
+        assert isinstance(obs, dict)
+
+    def test_wrapped_batch_build(self):
+        config = load_config(observation='localConflict', number_of_agents=3,
+                             observation_config={'max_depth': 2, 'shortest_path_max_depth': 20, 'n_local': 3},
+                             sparse_reward=True, deadlock_reward=-1, skip_no_choice_cells=True,
+                             accumulate_skipped_rewards=True, available_actions_obs=True)
+        envs = [FlatlandSparse(dict(config, seed=seed)) for seed in [1, 2]]
+        references = [FlatlandSparse(dict(config, seed=seed)) for seed in [1, 2]]
+        for env in envs + references:
+            env.reset()
+        for _ in range(10):
+            steps = []
+            for env in envs:
+                with suppressed_observations(env._env.rail_env, lazy=True):
+                    steps.append(env.step({h: 2 for h in range(3)}))
+            hits = [env._env.rail_env.obs_builder.hits for env in envs]
+            build_observations([obs for obs, _, _, _ in steps])
+            # the builders got the agent states from get_many_batch
+            assert [env._env.rail_env.obs_builder.hits for env in envs] == [h + 1 for h in hits]
+
+            for (obs, reward, done, _), reference in zip(steps, references):
+                expected, expected_reward, expected_done, _ = reference.step({h: 2 for h in range(3)})
+                assert reward == expected_reward and done == expected_done
+                assert list(obs.keys()) == list(expected.keys())
+                for h in obs:
+                    assert np.allclose(obs[h]['obs'], expected[h]['obs'])
+                    assert np.array_equal(obs[h]['available_actions'], expected[h]['available_actions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
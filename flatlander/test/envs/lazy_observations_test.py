@@ -0,0 +1,118 @@
+import unittest
+
+import gym
+import numpy as np
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.local_conflict_obs import LocalConflictObservation
+from flatlander.envs.utils.gym_env import LazyObservations, suppressed_observations, FlatlandGymEnv, \
+    build_observations
+from flatlander.envs.utils.gym_env_wrappers import SparseRewardWrapper, DeadlockWrapper, SkipNoChoiceCellsWrapper, \
+    AvailableActionsWrapper
+
+
+class CountingGlobalObs(GlobalObsForRailEnv):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def get_many(self, handles=None):
+        self.calls += 1
+        return super().get_many(handles)
+
+
+class LazyObservationsTest(unittest.TestCase):
+
+    def prep_env(self):
+        self.obs_builder = CountingGlobalObs()
+        self.env = RailEnv(width=30, height=30,
+                           rail_generator=sparse_rail_generator(max_num_cities=3, seed=1, grid_mode=False,
+                                                                max_rails_between_cities=2, max_rails_in_city=3),
+                           schedule_generator=sparse_schedule_generator(),
+                           number_of_agents=3,
+                           obs_builder_object=self.obs_builder)
+        self.env.reset(random_seed=1)
+        self.obs_builder.calls = 0
+
+    def test_built_on_read(self):
+        self.prep_env()
+        with suppressed_observations(self.env, lazy=True):
+            for _ in range(5):
+                obs, _, _, _ = self.env.step({h: 2 for h in range(3)})
+        assert isinstance(obs, LazyObservations)
+        assert self.obs_builder.calls == 0
+        assert sorted(obs.keys()) == [0, 1, 2] and 1 in obs
+
+        expected = self.obs_builder.get_many([0, 1, 2])
+        restricted = obs.restrict([1])
+        assert (restricted[1][0] == expected[1][0]).all()
+        assert len(restricted) == 1 and obs.built
+        assert self.obs_builder.calls == 2
+
+    def test_stale_read(self):
+        self.prep_env()
+        with suppressed_observations(self.env, lazy=True):
+            obs, _, _, _ = self.env.step({})
+            self.env.step({})
+        with self.assertRaises(RuntimeError):
+            obs[0]
+
+    def test_restored(self):
+        self.prep_env()
+        with suppressed_observations(self.env):
+            obs, _, _, _ = self.env.step({})
+        assert all(o is None for o in obs.values())
+        obs, _, _, _ = self.env.step({})
+        assert self.obs_builder.calls == 1 and obs[0] is not None
+
+    @staticmethod
+    def make_wrapped_env(seed: int):
+        rail_env = RailEnv(width=30, height=30,
+                           rail_generator=sparse_rail_generator(max_num_cities=3, seed=seed, grid_mode=False,
+                                                                max_rails_between_cities=2, max_rails_in_city=3),
+                           schedule_generator=sparse_schedule_generator(),
+                           number_of_agents=4,
+                           obs_builder_object=LocalConflictObservation(
+                               {'max_depth': 2, 'shortest_path_max_depth': 20, 'n_local': 3}).builder())
+        env = FlatlandGymEnv(rail_env, gym.spaces.Box(0, 1, (1,)))
+        env = SparseRewardWrapper(env)
+        env = DeadlockWrapper(env, deadlock_reward=-1)
+        env = SkipNoChoiceCellsWrapper(env, accumulate_skipped_rewards=True)
+        env = AvailableActionsWrapper(env)
+        env.reset(random_seed=seed)
+        return rail_env, env
+
+    def test_wrappers_keep_lazy(self):
+        envs = [self.make_wrapped_env(seed) for seed in [1, 2]]
+        references = [self.make_wrapped_env(seed) for seed in [1, 2]]
+        builds = [rail_env.obs_builder.misses for rail_env, _ in envs]
+        for _ in range(20):
+            observations = []
+            for rail_env, env in envs:
+                with suppressed_observations(rail_env, lazy=True):
+                    observations.append(env.step({h: 2 for h in range(4)}))
+            assert all(isinstance(obs, LazyObservations) for obs, _, _, _ in observations)
+            # only the observations of the returned steps are built, all envs in one batch
+            build_observations([obs for obs, _, _, _ in observations])
+            builds = [b + 1 for b in builds]
+            assert [rail_env.obs_builder.misses for rail_env, _ in envs] == builds
+            assert [rail_env.obs_builder.hits for rail_env, _ in envs] == [b - 1 for b in builds]
+
+            for (obs, reward, done, _), (_, reference) in zip(observations, references):
+                expected, expected_reward, expected_done, _ = reference.step({h: 2 for h in range(4)})
+                assert reward == expected_reward and done == expected_done
+                assert list(obs.keys()) == list(expected.keys())
+                for h in obs:
+                    if expected[h]['obs'] is None:
+                        assert obs[h]['obs'] is None
+                    else:
+                        assert np.allclose(obs[h]['obs'], expected[h]['obs'])
+                    assert np.array_equal(obs[h]['available_actions'], expected[h]['available_actions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import gym
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.utils.gym_env import FlatlandGymEnv, LazyObservations, suppressed_observations
+from flatlander.envs.utils.gym_env_wrappers import SparsePriorizationWrapper
+
+
+class SparsePriorizationWrapperTest(unittest.TestCase):
+
+    def prep_env(self):
+        self.rail_env = RailEnv(width=30, height=30,
+                                rail_generator=sparse_rail_generator(max_num_cities=3, seed=1, grid_mode=False,
+                                                                     max_rails_between_cities=2,
+                                                                     max_rails_in_city=3),
+                                schedule_generator=sparse_schedule_generator(),
+                                number_of_agents=3,
+                                obs_builder_object=GlobalObsForRailEnv())
+        self.env = SparsePriorizationWrapper(FlatlandGymEnv(self.rail_env, gym.spaces.Box(0, 1, (1,))))
+        return self.env.reset(random_seed=1)
+
+    def test_dict_observations(self):
+        obs = self.prep_env()
+        done = {'__all__': False}
+        while not done['__all__']:
+            obs, reward, done, _ = self.env.step({h: 0.5 for h in obs})
+            assert type(obs) == dict
+            assert set(obs.keys()) <= set(reward.keys())
+            assert all(o is not None for o in obs.values())
+
+    def test_lazy_caller(self):
+        obs = self.prep_env()
+        with suppressed_observations(self.rail_env, lazy=True):
+            obs, _, _, _ = self.env.step({h: 0.5 for h in obs})
+        assert isinstance(obs, LazyObservations) and not obs.built
+
+
+if __name__ == '__main__':
+    unittest.main()
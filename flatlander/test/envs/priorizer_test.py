@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.utils.priorization.agent_ordering import AgentOrdering
+from flatlander.envs.utils.priorization.priorizer import NrAgentsSameStart, DistToTargetPriorizer, \
+    CompositePriorizer, priority_order
+
+
+class PriorizerTest(unittest.TestCase):
+
+    def prep_env(self):
+        self.env = RailEnv(width=30, height=30,
+                           rail_generator=sparse_rail_generator(max_num_cities=3, seed=1, grid_mode=False,
+                                                                max_rails_between_cities=2, max_rails_in_city=3),
+                           schedule_generator=sparse_schedule_generator(),
+                           number_of_agents=10,
+                           obs_builder_object=GlobalObsForRailEnv())
+        self.env.reset(random_seed=1)
+
+    def test_same_start(self):
+        self.prep_env()
+        handles = list(range(self.env.get_num_agents()))
+        same_start = [len([a for a in self.env.agents if a.initial_position == agent.initial_position
+                           and a.initial_direction == agent.initial_direction]) for agent in self.env.agents]
+        expected = sorted(handles, key=lambda h: same_start[h], reverse=True)
+        assert NrAgentsSameStart().priorize(handles, self.env) == expected
+
+    def test_composite(self):
+        self.prep_env()
+        handles = list(range(self.env.get_num_agents()))
+        same_start = NrAgentsSameStart().keys(np.array(handles), self.env)
+        dists = DistToTargetPriorizer().keys(np.array(handles), self.env)
+        expected = sorted(handles, key=lambda h: (same_start[h], dists[h]))
+        priorizer = CompositePriorizer([NrAgentsSameStart(), DistToTargetPriorizer()])
+        assert priorizer.priorize(handles, self.env) == expected
+
+    def test_priority_order(self):
+        assert priority_order({0: 0.1, 1: 0.5, 2: 0.1, 3: 0.9}) == [3, 1, 0, 2]
+
+    def test_agent_ordering(self):
+        ordering = AgentOrdering([3, 0, 2, 1])
+        ordering.move_to_back(0)
+        ordering.move_to_front(1)
+        assert ordering.handles == [1, 3, 2, 0]
+        assert [ordering.rank(h) for h in range(4)] == [3, 0, 2, 1]
+        ordering.handles.reverse()
+        assert ordering.handles == [1, 3, 2, 0]
+
+
+if __name__ == '__main__':
+    unittest.main()
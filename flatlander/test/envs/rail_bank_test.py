@@ -0,0 +1,84 @@
+import tempfile
+import unittest
+
+import numpy as np
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+
+from flatlander.envs.utils.rail_bank import generate_rail_bank, generate_episode, EpisodePrefetcher
+
+
+class RailBankTest(unittest.TestCase):
+    config = {'width': 25, 'height': 25, 'number_of_agents': 3, 'max_num_cities': 2, 'grid_mode': False,
+              'max_rails_between_cities': 2, 'max_rails_in_city': 3, 'seed': 0,
+              'speed_ratio_map': {1.: 0.5, 0.5: 0.5}}
+
+    def test_bank_episodes(self):
+        with tempfile.TemporaryDirectory() as path:
+            bank = generate_rail_bank(self.config, path, seeds=[3, 1, 2], n_workers=2)
+            assert sorted(bank.seeds) == [1, 2, 3]
+
+            env = RailEnv(width=25, height=25, rail_generator=bank.rail_generator(),
+                          schedule_generator=bank.schedule_generator(), number_of_agents=3,
+                          obs_builder_object=GlobalObsForRailEnv(), remove_agents_at_target=True)
+            bank.attach(env)
+            for seed in [2, 1, 2]:
+                bank.select(seed)
+                env.reset(random_seed=seed)
+                grid, agents, max_episode_steps, distance_map = generate_episode(self.config, seed)
+                assert np.array_equal(env.rail.grid, grid)
+                assert [a.initial_position for a in env.agents] == [(int(a[0]), int(a[1])) for a in agents]
+                assert [a.target for a in env.agents] == [(int(a[3]), int(a[4])) for a in agents]
+                assert [a.speed_data['speed'] for a in env.agents] == list(agents[:, 5])
+                assert env._max_episode_steps == max_episode_steps
+                assert np.array_equal(env.distance_map.get(), distance_map)
+                assert env.distance_map.get().dtype == float
+
+    def test_order_without_seed(self):
+        with tempfile.TemporaryDirectory() as path:
+            bank = generate_rail_bank(self.config, path, seeds=[1, 2], n_workers=1)
+            env = RailEnv(width=25, height=25, rail_generator=bank.rail_generator(),
+                          schedule_generator=bank.schedule_generator(), number_of_agents=3,
+                          obs_builder_object=GlobalObsForRailEnv())
+            bank.attach(env)
+            grids = []
+            for _ in range(3):
+                env.reset()
+                grids.append(env.rail.grid.copy())
+            assert np.array_equal(grids[0], grids[2]) and not np.array_equal(grids[0], grids[1])
+
+    def test_prefetched_episodes(self):
+        grids = []
+        for _ in range(2):
+            prefetcher = EpisodePrefetcher(self.config, seed=5)
+            env = RailEnv(width=25, height=25, rail_generator=prefetcher.rail_generator(),
+                          schedule_generator=prefetcher.schedule_generator(), number_of_agents=3,
+                          obs_builder_object=GlobalObsForRailEnv())
+            prefetcher.attach(env)
+            env.reset()
+            assert np.array_equal(env.rail.grid, generate_episode(self.config, 5)[0])
+            env.reset()
+            grids.append(env.rail.grid.copy())
+
+            prefetcher.select(7)
+            env.reset()
+            grid, agents, _, distance_map = generate_episode(self.config, 7)
+            assert np.array_equal(env.rail.grid, grid)
+            assert np.array_equal(env.distance_map.get(), distance_map)
+            prefetcher.close()
+        # the seeds of the following episodes only depend on the episode count
+        assert np.array_equal(grids[0], grids[1])
+
+    def test_prefetcher_failing_generator(self):
+        # no cities fit on the grid
+        prefetcher = EpisodePrefetcher(dict(self.config, width=6, height=6), seed=5, max_failures=2)
+        try:
+            with self.assertRaises(RuntimeError):
+                prefetcher.select(3)
+                prefetcher.rail_generator()(6, 6, 3)
+        finally:
+            prefetcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.global_obs import PaddedGlobalObsForRailEnv
+from flatlander.envs.utils.gym_env import suppressed_observations, build_observations
+from flatlander.envs.utils.shared_episodes import SharedEpisodeCache
+
+
+class SharedEpisodesTest(unittest.TestCase):
+
+    @staticmethod
+    def make_env(seed=1):
+        return RailEnv(width=30, height=30,
+                       rail_generator=sparse_rail_generator(max_num_cities=3, seed=0, grid_mode=False,
+                                                            max_rails_between_cities=2, max_rails_in_city=3),
+                       schedule_generator=sparse_schedule_generator({1.: 0.5, 0.5: 0.5}),
+                       number_of_agents=4,
+                       obs_builder_object=PaddedGlobalObsForRailEnv(max_width=32, max_height=32, shared=True),
+                       random_seed=seed)
+
+    def test_shared_episodes(self):
+        cache = SharedEpisodeCache()
+        envs = [self.make_env() for _ in range(2)]
+        for env in envs:
+            cache.attach(env)
+        reference = self.make_env()
+        for _ in range(2):
+            reference.reset()
+            for env in envs:
+                env.reset()
+            assert envs[0].rail is envs[1].rail
+            assert envs[0].distance_map.get() is envs[1].distance_map.get()
+            assert np.array_equal(envs[1].rail.grid, reference.rail.grid)
+            assert [a.target for a in envs[1].agents] == [a.target for a in reference.agents]
+            assert np.array_equal(envs[1].distance_map.get(), reference.distance_map.get())
+            assert np.array_equal(envs[1].np_random.get_state()[1], reference.np_random.get_state()[1])
+        assert cache.hits == 4 and cache.misses == 4
+
+        other = self.make_env(seed=2)
+        cache.attach(other)
+        other.reset()
+        assert other.rail is not envs[0].rail
+
+    def test_batch_build(self):
+        envs = [self.make_env(seed) for seed in [1, 2]]
+        references = [self.make_env(seed) for seed in [1, 2]]
+        for env in envs + references:
+            env.reset()
+        observations = []
+        for env in envs:
+            with suppressed_observations(env, lazy=True):
+                observations.append(env.step({h: 2 for h in range(4)})[0])
+        build_observations(observations)
+        for obs, reference in zip(observations, references):
+            expected = reference.step({h: 2 for h in range(4)})[0]
+            for h in range(4):
+                assert np.array_equal(obs[h][0], expected[h][0]) and np.array_equal(obs[h][1], expected[h][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
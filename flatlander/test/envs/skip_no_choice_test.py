@@ -0,0 +1,57 @@
+import unittest
+
+import gym
+import numpy as np
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.utils.gym_env import FlatlandGymEnv
+from flatlander.envs.utils.gym_env_wrappers import SkipNoChoiceCellsWrapper
+
+
+class CountingGlobalObs(GlobalObsForRailEnv):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def get_many(self, handles=None):
+        self.calls += 1
+        return super().get_many(handles)
+
+
+class SkipNoChoiceCellsTest(unittest.TestCase):
+
+    def run_episode(self, fast_forward: bool):
+        obs_builder = CountingGlobalObs()
+        rail_env = RailEnv(width=30, height=30,
+                           rail_generator=sparse_rail_generator(max_num_cities=3, seed=1, grid_mode=False,
+                                                                max_rails_between_cities=2, max_rails_in_city=3),
+                           schedule_generator=sparse_schedule_generator({1.: 0.5, 0.5: 0.5}),
+                           number_of_agents=2,
+                           obs_builder_object=obs_builder)
+        env = SkipNoChoiceCellsWrapper(FlatlandGymEnv(rail_env, gym.spaces.Box(0, 1, (1,))),
+                                       accumulate_skipped_rewards=True, fast_forward=fast_forward)
+        obs = env.reset(random_seed=1)
+        trace = []
+        done = {'__all__': False}
+        while not done['__all__']:
+            obs, reward, done, _ = env.step({h: 2 for h in obs})
+            trace.append((rail_env._elapsed_steps, {h: o[0].sum() for h, o in obs.items()}, reward, done))
+        return trace, obs_builder.calls
+
+    def test_fast_forward_same_episode(self):
+        trace, calls = self.run_episode(fast_forward=False)
+        ff_trace, ff_calls = self.run_episode(fast_forward=True)
+        assert len(trace) == len(ff_trace)
+        for step, ff_step in zip(trace, ff_trace):
+            assert step[0] == ff_step[0] and step[3] == ff_step[3]
+            assert step[1] == ff_step[1]
+            assert np.allclose(list(step[2].values()), list(ff_step[2].values()))
+        assert ff_calls < calls
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from flatlander.envs.utils.step_counter import SharedStepCounter
+
+
+class SharedStepCounterTest(unittest.TestCase):
+
+    def test_shared_file(self):
+        with tempfile.TemporaryDirectory() as path:
+            counters = [SharedStepCounter(os.path.join(path, 'steps')) for _ in range(3)]
+            for i, counter in enumerate(counters):
+                counter.add(i + 1)
+            assert counters[0].sync() == 1
+            assert counters[2].sync() == 4
+            assert counters[1].sync() == 6
+            assert counters[0].sync() == 6
+
+    def test_shared_key(self):
+        counters = [SharedStepCounter(key='step_counter_test') for _ in range(2)]
+        counters[0].add(2)
+        counters[1].add(3)
+        assert counters[0].sync() == 2
+        assert counters[1].sync() == 5
+        assert SharedStepCounter(key='other_step_counter_test').sync() == 0
+
+    def test_own_count(self):
+        counters = [SharedStepCounter() for _ in range(2)]
+        counters[0].add(2)
+        counters[1].add(3)
+        assert counters[0].sync() == 2
+        assert counters[1].sync() == 3
@@ -0,0 +1,113 @@
+import unittest
+
+import numpy as np
+from flatland.core.grid.grid4_utils import get_new_position
+from flatland.core.grid.grid_utils import coordinate_to_position
+from flatland.envs.agent_utils import RailAgentStatus
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.conflict_piority_shortest_path_obs import ConflictPriorityShortestPathObservation
+
+
+def reference_shortest_path_position(builder, position, direction, handle):
+    distance_map = builder.env.distance_map.get()
+    max_dist = np.max(distance_map[np.isfinite(distance_map)])
+    possible_transitions = builder.env.rail.get_transitions(*position, direction)
+    min_dist = np.inf
+    sp_move = None
+    sp_pos = None
+    for movement in builder._directions:
+        if possible_transitions[movement]:
+            pos = get_new_position(position, movement)
+            distance = distance_map[handle][pos + (movement,)]
+            distance = max_dist if (distance == np.inf or np.isnan(distance)) else distance
+            if distance <= min_dist:
+                min_dist = distance
+                sp_move = movement
+                sp_pos = pos
+    return sp_pos, sp_move
+
+
+def reference_detect_conflicts(builder, tot_dist, time_per_cell, position, cell_transitions, handle, direction):
+    """
+    The original per cell walk of the conflict priority observation.
+    """
+    potential_conflict = np.inf
+    conflict_handle = None
+    predicted_time = int(tot_dist * time_per_cell)
+    while predicted_time < builder.max_prediction_depth:
+        predicted_time = int(tot_dist * time_per_cell)
+        int_position = coordinate_to_position(builder.env.width, [position])
+        if tot_dist < builder.max_prediction_depth:
+            pre_step = max(0, predicted_time - 1)
+            post_step = min(builder.max_prediction_depth - 1, predicted_time + 1)
+            # the predicted time first, one step before/after only if there is no other agent at that time
+            for t in [predicted_time, pre_step, post_step]:
+                if int_position in np.delete(builder.predicted_pos[t], handle, 0):
+                    for ca in np.where(builder.predicted_pos[t] == int_position)[0]:
+                        if direction != builder.predicted_dir[t][ca] \
+                                and cell_transitions[int((builder.predicted_dir[t][ca] + 2) % 4)] == 1 \
+                                and tot_dist < potential_conflict:
+                            potential_conflict = tot_dist
+                            conflict_handle = ca
+                        if builder.env.agents[ca].status == RailAgentStatus.DONE and tot_dist < potential_conflict:
+                            potential_conflict = tot_dist
+                            conflict_handle = ca
+                    break
+        tot_dist += 1
+        position, direction = reference_shortest_path_position(builder, position, direction, handle)
+    return potential_conflict, conflict_handle
+
+
+def reference_path_conflicts(builder, handles):
+    path_conflicts = {}
+    for handle in handles:
+        agent = builder.env.agents[handle]
+        position = builder._virtual_position(agent)
+        path_conflicts[handle] = []
+        if position is None:
+            continue
+        possible_transitions = builder.env.rail.get_transitions(*position, agent.direction)
+        for movement in builder._directions:
+            if possible_transitions[movement]:
+                pos = get_new_position(position, movement)
+                cell_transitions = builder.env.rail.get_transitions(*pos, movement)
+                _, ch = reference_detect_conflicts(builder, 1, np.reciprocal(agent.speed_data["speed"]), pos,
+                                                   cell_transitions, handle, movement)
+                path_conflicts[handle].append(ch)
+    return path_conflicts
+
+
+class ConflictPriorityObsTest(unittest.TestCase):
+
+    def make_env(self, seed: int) -> RailEnv:
+        builder = ConflictPriorityShortestPathObservation({'shortest_path_max_depth': 10}).builder()
+        env = RailEnv(width=25, height=25,
+                      rail_generator=sparse_rail_generator(max_num_cities=3, seed=seed, grid_mode=False,
+                                                           max_rails_between_cities=2, max_rails_in_city=3),
+                      schedule_generator=sparse_schedule_generator(),
+                      number_of_agents=8,
+                      obs_builder_object=builder)
+        env.reset(random_seed=seed)
+        return env
+
+    def test_detect_path_conflicts(self):
+        n_conflicts = 0
+        for seed in [1, 2, 3]:
+            env = self.make_env(seed)
+            handles = list(range(env.get_num_agents()))
+            np_random = np.random.RandomState(seed)
+            for _ in range(40):
+                env.step({h: np_random.randint(5) for h in handles})
+                builder = env.obs_builder
+                expected = reference_path_conflicts(builder, handles)
+                assert builder._path_conflicts == expected
+                n_conflicts += sum(ch is not None for conflicts in expected.values() for ch in conflicts)
+        # the comparison is only meaningful with conflicts
+        assert n_conflicts > 0
+
+
+if __name__ == '__main__':
+    unittest.main()
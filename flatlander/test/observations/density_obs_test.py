@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.global_density_obs import ProjectedDensityForRailEnv
+
+
+class ProjectedDensityObsTest(unittest.TestCase):
+    size = 25
+    max_t = 8
+
+    def make_env(self, seed: int, builder: ProjectedDensityForRailEnv) -> RailEnv:
+        env = RailEnv(width=self.size, height=self.size,
+                      rail_generator=sparse_rail_generator(max_num_cities=3, seed=seed, grid_mode=False,
+                                                           max_rails_between_cities=2, max_rails_in_city=3),
+                      schedule_generator=sparse_schedule_generator({1.: 0.5, 0.5: 0.5}),
+                      number_of_agents=6,
+                      obs_builder_object=builder)
+        env.reset(random_seed=seed)
+        return env
+
+    def test_sparse_matches_dense(self):
+        n_compared = 0
+        for encoding in ['exp_decay', 'lin_decay', 'series']:
+            dense = ProjectedDensityForRailEnv(self.size, self.size, encoding, self.max_t, sparse=False)
+            sparse = ProjectedDensityForRailEnv(self.size, self.size, encoding, self.max_t, sparse=True)
+            env = self.make_env(1, dense)
+            sparse.set_env(env)
+            sparse.reset()
+            handles = list(range(env.get_num_agents()))
+            np_random = np.random.RandomState(0)
+            for _ in range(30):
+                env.step({h: np_random.randint(5) for h in handles})
+                predictions = dense._predictor.get()
+                # the dense maps can't place the predictions of agents which left the grid
+                if any(p is not None and np.isnan(p[:, 1:3]).any() for p in predictions.values()):
+                    continue
+                expected = dense.get_many(handles)
+                obs = sparse.get_many(handles)
+                for h in handles:
+                    assert np.allclose(obs[h][0], expected[h][0])
+                    assert np.allclose(obs[h][1], expected[h][1])
+                n_compared += 1
+        assert n_compared > 0
+
+
+if __name__ == '__main__':
+    unittest.main()
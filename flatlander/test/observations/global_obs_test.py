@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.global_obs import PaddedGlobalObsForRailEnv, expand_ego_channels
+
+try:
+    import tensorflow as tf
+    from flatlander.models.global_obs_model import expand_ego_channels as tf_expand_ego_channels
+except ImportError:  # the model needs tensorflow and ray
+    tf_expand_ego_channels = None
+
+
+class GlobalObsTest(unittest.TestCase):
+    max_size = 32
+
+    def make_env(self, seed: int) -> RailEnv:
+        env = RailEnv(width=30, height=28,
+                      rail_generator=sparse_rail_generator(max_num_cities=3, seed=seed, grid_mode=False,
+                                                           max_rails_between_cities=2, max_rails_in_city=3),
+                      schedule_generator=sparse_schedule_generator({1.: 0.5, 0.5: 0.5}),
+                      number_of_agents=4,
+                      obs_builder_object=PaddedGlobalObsForRailEnv(self.max_size, self.max_size, shared=False))
+        env.reset(random_seed=seed)
+        return env
+
+    def shared_builder(self, env: RailEnv) -> PaddedGlobalObsForRailEnv:
+        builder = PaddedGlobalObsForRailEnv(self.max_size, self.max_size, shared=True)
+        builder.set_env(env)
+        builder.reset()
+        return builder
+
+    def rollout(self, seed: int, steps: int = 30):
+        """
+        Yields the per agent observations and the shared observations of the same env states.
+        """
+        env = self.make_env(seed)
+        shared_builder = self.shared_builder(env)
+        handles = list(range(env.get_num_agents()))
+        np_random = np.random.RandomState(seed)
+        for _ in range(steps):
+            yield env.obs_builder.get_many(handles), shared_builder.get_many(handles)
+            env.step({h: np_random.randint(5) for h in handles})
+
+    def test_expand_ego_channels(self):
+        for seed in [1, 2]:
+            for obs, shared in self.rollout(seed):
+                for h, (shared_obs, ego) in shared.items():
+                    assert np.allclose(expand_ego_channels(shared_obs, ego), obs[h])
+
+    @unittest.skipIf(tf_expand_ego_channels is None, "tensorflow or ray is not installed")
+    def test_tf_expand_ego_channels(self):
+        for obs, shared in self.rollout(1):
+            handles = sorted(shared.keys())
+            shared_obs = np.stack([shared[h][0] for h in handles]).astype(np.float32)
+            ego = np.stack([shared[h][1] for h in handles])
+            expanded = tf_expand_ego_channels([tf.constant(shared_obs), tf.constant(ego)]).numpy()
+            for i, h in enumerate(handles):
+                assert np.allclose(expanded[i], obs[h])
+
+
+if __name__ == '__main__':
+    unittest.main()
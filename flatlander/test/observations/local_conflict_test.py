@@ -0,0 +1,118 @@
+import unittest
+from itertools import combinations
+
+import numpy as np
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.local_conflict_obs import LocalConflictObservation, \
+    LocalConflictObsForRailEnvRLLibWrapper, get_agent_conflict_prediction_matrix
+from flatlander.envs.utils.gym_env import suppressed_observations
+
+
+def reference_conflict_prediction_matrix(n_agents, max_depth, predicted_pos):
+    """
+    The original loop version of get_agent_conflict_prediction_matrix.
+    """
+    agent_total_step_conflicts = []
+    agent_conflicts_step_path = []
+    agent_conflicts_count_path = []
+    agent_conflicts_step = max_depth * np.ones((n_agents, n_agents))
+
+    for i in range(max_depth):
+        step = i + 1
+        pos = predicted_pos[i]
+        val, count = np.unique(pos, return_counts=True)
+        if val[0] == -1:
+            val = val[1:]
+            count = count[1:]
+
+        counter = np.zeros(n_agents)
+        agent_conflicts_count = np.zeros(n_agents)
+
+        for j, curVal in enumerate(val):
+            curCount = count[j]
+            if curCount > 1:
+                idxs = np.argwhere(pos == curVal)
+                lsIdx = [int(x) for x in idxs]
+                combs = list(combinations(lsIdx, 2))
+                for k, comb in enumerate(combs):
+                    counter[comb[0]] += 1
+                    counter[comb[1]] += 1
+                    agent_conflicts_count[comb[0]] = counter[comb[0]]
+                    agent_conflicts_count[comb[1]] = counter[comb[1]]
+                    agent_conflicts_step[comb[0], comb[1]] = min(
+                        step, agent_conflicts_step[comb[0], comb[1]])
+                    agent_conflicts_step[comb[1], comb[0]] = min(
+                        step, agent_conflicts_step[comb[1], comb[0]])
+
+        agent_conflicts_step_current = agent_conflicts_step / max_depth
+        agent_conflicts_step_path.append(agent_conflicts_step_current)
+        agent_conflicts_count = agent_conflicts_count / n_agents
+        agent_conflicts_count_path.append(agent_conflicts_count)
+
+    for i in range(n_agents):
+        agent_total_step_conflicts.append(
+            sum(agent_conflicts_step_current[i, :]))
+
+    return agent_conflicts_count_path, agent_conflicts_step_path, agent_total_step_conflicts
+
+
+class LocalConflictObsTest(unittest.TestCase):
+    config = {'max_depth': 2, 'shortest_path_max_depth': 20, 'n_local': 3}
+
+    def make_env(self, seed: int) -> RailEnv:
+        env = RailEnv(width=30, height=30,
+                      rail_generator=sparse_rail_generator(max_num_cities=3, seed=seed, grid_mode=False,
+                                                           max_rails_between_cities=2, max_rails_in_city=3),
+                      schedule_generator=sparse_schedule_generator({1.: 0.5, 0.5: 0.5}),
+                      number_of_agents=2 + seed,
+                      obs_builder_object=LocalConflictObservation(self.config).builder())
+        env.reset(random_seed=seed)
+        return env
+
+    def test_get_many_batch(self):
+        seeds = [1, 2, 3]
+        envs = [self.make_env(seed) for seed in seeds]
+        references = [self.make_env(seed) for seed in seeds]
+        np_random = np.random.RandomState(0)
+        for _ in range(15):
+            for env, reference in zip(envs, references):
+                actions = {h: np_random.randint(5) for h in range(env.get_num_agents())}
+                with suppressed_observations(env):
+                    env.step(actions)
+                reference.step(actions)
+            handles = [list(range(env.get_num_agents())) for env in envs]
+            built = LocalConflictObsForRailEnvRLLibWrapper.get_many_batch([env.obs_builder for env in envs],
+                                                                          handles)
+            for obs, reference, env_handles in zip(built, references, handles):
+                expected = reference.obs_builder.get_many(env_handles)
+                assert obs.keys() == expected.keys()
+                for h in env_handles:
+                    if expected[h] is None:
+                        assert obs[h] is None
+                    else:
+                        assert np.allclose(obs[h], expected[h])
+        # the agent states of the step are already built
+        misses = [env.obs_builder.misses for env in envs]
+        LocalConflictObsForRailEnvRLLibWrapper.get_many_batch([env.obs_builder for env in envs], handles)
+        assert [env.obs_builder.misses for env in envs] == misses
+
+    def test_conflict_prediction_matrix(self):
+        np_random = np.random.RandomState(0)
+        for _ in range(50):
+            n_agents, max_depth = np_random.randint(1, 12), np_random.randint(1, 8)
+            # few cells to get many conflicts, -1 is off grid
+            predicted_pos = {t: np_random.randint(-1, 6, size=n_agents) for t in range(max_depth)}
+            count_path, step_path, total = get_agent_conflict_prediction_matrix(n_agents, max_depth, predicted_pos)
+            expected_count_path, expected_step_path, expected_total = \
+                reference_conflict_prediction_matrix(n_agents, max_depth, predicted_pos)
+            assert np.allclose(count_path, expected_count_path)
+            for t in range(max_depth):
+                assert np.allclose(step_path[t], expected_step_path[t])
+            assert np.allclose(total, expected_total)
+
+
+if __name__ == '__main__':
+    unittest.main()
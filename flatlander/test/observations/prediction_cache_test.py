@@ -0,0 +1,106 @@
+import unittest
+
+import numpy as np
+from flatland.envs.observations import GlobalObsForRailEnv
+from flatland.envs.rail_env import RailEnv
+from flatland.envs.rail_generators import sparse_rail_generator
+from flatland.envs.schedule_generators import sparse_schedule_generator
+
+from flatlander.envs.observations.common.malf_shortest_path_predictor import MalfShortestPathPredictorForRailEnv
+from flatlander.envs.observations.common.prediction_cache import PredictionCache, StepPredictions
+from flatlander.envs.observations.common.shortest_path_conflict_detector import ShortestPathConflictDetector
+from flatlander.envs.observations.new_tree_obs_builder import MyTreeObsForRailEnv
+
+
+class PredictionCacheTest(unittest.TestCase):
+
+    def prep_env(self, obs_builder=None):
+        self.env = RailEnv(width=30, height=30,
+                           rail_generator=sparse_rail_generator(max_num_cities=3, seed=1, grid_mode=False,
+                                                                max_rails_between_cities=2, max_rails_in_city=3),
+                           schedule_generator=sparse_schedule_generator(),
+                           number_of_agents=5,
+                           obs_builder_object=obs_builder or GlobalObsForRailEnv())
+        self.env.reset(random_seed=1)
+        self.predictor = MalfShortestPathPredictorForRailEnv(max_depth=10)
+        self.predictor.set_env(self.env)
+
+    def test_same_step_hits(self):
+        self.prep_env()
+        cache = PredictionCache.for_env(self.env)
+        first = cache.get(self.predictor)
+        second = cache.get(MalfShortestPathPredictorForRailEnv(max_depth=10))
+        assert first is second
+        assert cache.hits == 1 and cache.misses == 1
+
+    def test_invalidated_after_step(self):
+        self.prep_env()
+        cache = PredictionCache.for_env(self.env)
+        first = cache.get(self.predictor)
+        self.env.step({h: 2 for h in range(self.env.get_num_agents())})
+        assert cache.get(self.predictor) is not first
+        assert cache.misses == 2
+
+    def test_cell_handles(self):
+        self.prep_env()
+        handles = list(range(self.env.get_num_agents()))
+        step_predictions = PredictionCache.for_env(self.env).get(self.predictor)
+        predicted_pos, _ = step_predictions.positions(handles)
+        for (t, cell), cell_handles in step_predictions.cell_handles(handles).items():
+            assert np.all(predicted_pos[t][cell_handles] == cell)
+
+    def test_shallower_lookup(self):
+        self.prep_env()
+        cache = PredictionCache.for_env(self.env)
+        deep_predictor = MalfShortestPathPredictorForRailEnv(max_depth=30)
+        deep_predictor.set_env(self.env)
+        deep = cache.get(deep_predictor)
+        shallow = cache.get(self.predictor)
+        assert cache.hits == 1 and cache.misses == 1
+        assert shallow.max_depth == 10
+        expected = self.predictor.get()
+        for h, prediction in expected.items():
+            assert np.array_equal(shallow.predictions[h], prediction, equal_nan=True)
+            assert np.array_equal(deep.predictions[h][:11], prediction, equal_nan=True)
+
+    def test_builder_and_detector_share(self):
+        builder = MyTreeObsForRailEnv(max_depth=2, predictor=MalfShortestPathPredictorForRailEnv(max_depth=10))
+        self.prep_env(builder)
+        detector = ShortestPathConflictDetector()
+        detector.set_env(self.env)
+        detector.map_predictions()
+
+        cache = PredictionCache.for_env(self.env)
+        cache.hits, cache.misses = 0, 0
+        self.env.step({h: 2 for h in range(self.env.get_num_agents())})
+        self.env.dev_pred_dict = {}
+        detector.update()
+        detector.map_predictions()
+        # the builder predicted at the depth of the detector
+        assert cache.misses == 1 and cache.hits == 1
+        assert len(self.env.dev_pred_dict) == self.env.get_num_agents()
+
+    def test_positions_without_directions(self):
+        self.prep_env()
+        cache = PredictionCache.for_env(self.env)
+        agent = self.env.agents[0]
+        positions = {0: agent.initial_position}
+        without_directions = cache.get(self.predictor, positions=positions)
+        with_directions = cache.get(self.predictor, positions=positions, directions={0: agent.direction})
+        assert without_directions is with_directions
+        assert cache.hits == 1 and cache.misses == 1
+        assert cache.get(self.predictor, positions=positions, directions={0: None}) is without_directions
+        expected = self.predictor.get(positions=positions, directions={0: agent.direction})
+        for h, prediction in expected.items():
+            assert np.array_equal(without_directions.predictions[h], prediction, equal_nan=True)
+
+    def test_positions_without_prediction(self):
+        prediction = np.array([[t, 1, t, 0, 0] for t in range(3)], dtype=float)
+        step_predictions = StepPredictions(10, 2, {0: None, 1: prediction})
+        predicted_pos, predicted_dir = step_predictions.positions([0, 1])
+        assert list(predicted_pos[2]) == [-1, 21] and np.isnan(predicted_dir[2][0])
+        assert step_predictions.cell_handles([0, 1])[(2, 21)] == [1]
+
+
+if __name__ == '__main__':
+    unittest.main()
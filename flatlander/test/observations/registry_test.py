@@ -0,0 +1,20 @@
+import sys
+import unittest
+
+from flatlander.envs import GENERATOR_CONFIG_REGISTRY, get_generator_config
+from flatlander.envs.observations import OBS_REGISTRY, get_obs_cls, _obs_module_index
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_obs_imported_on_lookup(self):
+        index = _obs_module_index()
+        assert index['tree'] == 'tree_obs'
+        cls = get_obs_cls('tree')
+        assert OBS_REGISTRY['tree'] is cls
+        assert sys.modules['flatlander.envs.observations.tree_obs'].__dict__[cls.__name__] is cls
+
+    def test_generator_configs(self):
+        assert 'small_v0' in GENERATOR_CONFIG_REGISTRY
+        assert get_generator_config('small_v0') is get_generator_config('small_v0')
+        assert get_generator_config('small_v0')['number_of_agents'] > 0
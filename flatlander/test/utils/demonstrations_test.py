@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from flatlander.utils.demonstrations import DemonstrationWriter, DemonstrationDataset, build_index, \
+    is_demonstration_dataset
+
+
+def write_shard(path, shard, eps_id, n_rows):
+    with DemonstrationWriter(path, shard, obs_shape=(3,), buffer_size=4) as writer:
+        for i in range(n_rows):
+            writer.add(obs=np.full(3, eps_id * 100 + i), new_obs=np.full(3, eps_id * 100 + i + 1), actions=i % 5,
+                       rewards=-1., dones=i == n_rows - 1, agent_index=i % 2, eps_id=eps_id, t=i // 2,
+                       action_prob=1.)
+
+
+class DemonstrationDatasetTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_shard(path, 'Level_1', 1, 10)
+            write_shard(path, 'Level_2', 2, 7)
+            build_index(path)
+            assert is_demonstration_dataset(path)
+
+            dataset = DemonstrationDataset(path)
+            assert len(dataset) == 17
+            batch = dataset.get([12, 0, 9, 10])
+            np.testing.assert_array_equal(batch['obs'][:, 0], [202, 100, 109, 200])
+            np.testing.assert_array_equal(batch['eps_id'], [2, 1, 1, 2])
+            np.testing.assert_array_equal(batch['dones'], [False, False, True, False])
+            assert batch['obs'].dtype == np.float32 and batch['actions'].dtype == np.int64
+
+            np.testing.assert_array_equal(dataset.episode_rows(2), np.arange(10, 17))
+            sample = dataset.sample(32, np.random.RandomState(0))
+            assert sample['obs'].shape == (32, 3)
+            np.testing.assert_array_equal(sample['new_obs'] - sample['obs'], np.ones((32, 3)))
+
+    def test_failed_shard_is_discarded(self):
+        with tempfile.TemporaryDirectory() as path:
+            write_shard(path, 'Level_1', 1, 5)
+            with self.assertRaises(KeyError):
+                with DemonstrationWriter(path, 'Level_2', obs_shape=(3,)) as writer:
+                    writer.add(obs=np.zeros(3))
+            assert sorted(os.listdir(path)) == ['Level_1']
+            assert len(DemonstrationDataset(path)) == 5
@@ -0,0 +1,28 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from flatlander.utils.rollout_stream import RolloutStreamWriter, iter_rollout_stream
+
+
+class RolloutStreamTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as path:
+            writer = RolloutStreamWriter(path, chunk_size=3, max_queue_size=1, save_info=True, segment_size=200)
+            for episode, n_steps in enumerate([7, 2]):
+                writer.begin_episode(episode)
+                for step in range(n_steps):
+                    writer.append({0: np.full(4, step)}, {0: step % 5}, {0: np.full(4, step + 1)}, {0: -1.},
+                                  {0: False, '__all__': step == n_steps - 1}, {0: {'step': step}})
+                writer.end_episode()
+            writer.close()
+            assert len(os.listdir(path)) > 1
+
+            steps = list(iter_rollout_stream(path))
+            assert [episode for episode, _ in steps] == [0] * 7 + [1] * 2
+            episode, (obs, action, next_obs, reward, done, info) = steps[6]
+            np.testing.assert_array_equal(obs[0], np.full(4, 6))
+            assert action == {0: 1} and done['__all__'] and info == {0: {'step': 6}}
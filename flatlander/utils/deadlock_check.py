@@ -1,6 +1,59 @@
-from flatland.core.grid.grid4_utils import get_new_position
+import weakref
+
+import numpy as np
+from flatland.core.transition_map import GridTransitionMap
 from flatland.envs.agent_utils import RailAgentStatus
 
+from flatlander.envs.observations.common.transition_cache import get_transition_tensor
+from flatlander.utils.deadlock_detector import DeadlockDetector
+
+# row/column offsets of the movements N, E, S, W
+_MOVEMENT_OFFSETS = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]])
+
+_next_cell_cache = weakref.WeakKeyDictionary()
+
+
+def get_next_cell_table(rail: GridTransitionMap) -> np.ndarray:
+    """
+    Returns the (height, width, 4, 4) table of the next cell (as flat index row * width + col) per cell,
+    agent direction and movement, -1 where the transition is not possible. Computed once per rail.
+    """
+    grid, table = _next_cell_cache.get(rail, (None, None))
+    if grid is not rail.grid:
+        transitions = get_transition_tensor(rail).reshape(rail.height, rail.width, 4, 4) > 0
+        next_rows = np.arange(rail.height)[:, np.newaxis, np.newaxis, np.newaxis] + _MOVEMENT_OFFSETS[:, 0]
+        next_cols = np.arange(rail.width)[np.newaxis, :, np.newaxis, np.newaxis] + _MOVEMENT_OFFSETS[:, 1]
+        table = np.where(transitions, next_rows * rail.width + next_cols, -1)
+        table.flags.writeable = False
+        _next_cell_cache[rail] = (rail.grid, table)
+    return table
+
+
+def get_movable_agents(env) -> np.ndarray:
+    """
+    Returns the handles of the agents which have at least one transition into a cell that is not occupied by an
+    active or done agent.
+    """
+    if len(env.agents) == 0:
+        return np.zeros(0, dtype=int)
+    agent_states = [(agent.status, agent.position, agent.initial_position, agent.target, agent.direction)
+                    for agent in env.agents]
+    # virtual positions, (-1, -1) for removed agents
+    virtual_positions = np.array([s[2] if s[0] == RailAgentStatus.READY_TO_DEPART
+                                  else s[1] if s[0] == RailAgentStatus.ACTIVE
+                                  else s[3] if s[0] == RailAgentStatus.DONE
+                                  else (-1, -1) for s in agent_states])
+    directions = np.array([s[4] for s in agent_states])
+    has_position = virtual_positions[:, 0] >= 0
+
+    occupied = np.zeros(env.height * env.width, dtype=bool)
+    occupied[[s[1][0] * env.width + s[1][1] for s in agent_states
+              if s[1] is not None and s[0] in [RailAgentStatus.ACTIVE, RailAgentStatus.DONE]]] = True
+
+    next_cells = get_next_cell_table(env.rail)[virtual_positions[:, 0], virtual_positions[:, 1], directions]
+    free = (next_cells >= 0) & ~occupied[np.maximum(next_cells, 0)]
+    return np.flatnonzero(has_position & np.any(free, axis=1))
+
 
 def check_if_all_blocked(env):
     """
@@ -10,33 +63,21 @@ def check_if_all_blocked(env):
     :return:
     """
 
-    # First build a map of agents in each position
-    location_has_agent = {}
-    for agent in env.agents:
-        if agent.status in [RailAgentStatus.ACTIVE, RailAgentStatus.DONE] and agent.position:
-            location_has_agent[tuple(agent.position)] = 1
-
-    # Looks for any agent that can still move
-    for handle in env.get_agent_handles():
-        agent = env.agents[handle]
-        if agent.status == RailAgentStatus.READY_TO_DEPART:
-            agent_virtual_position = agent.initial_position
-        elif agent.status == RailAgentStatus.ACTIVE:
-            agent_virtual_position = agent.position
-        elif agent.status == RailAgentStatus.DONE:
-            agent_virtual_position = agent.target
-        else:
-            continue
-
-        possible_transitions = env.rail.get_transitions(*agent_virtual_position, agent.direction)
-        orientation = agent.direction
-
-        for branch_direction in [(orientation + i) % 4 for i in range(-1, 3)]:
-            if possible_transitions[branch_direction]:
-                new_position = get_new_position(agent_virtual_position, branch_direction)
+    # No agent can move at all: full deadlock!
+    return len(get_movable_agents(env)) == 0
 
-                if new_position not in location_has_agent:
-                    return False
 
-    # No agent can move at all: full deadlock!
-    return True
+def check_if_all_active_blocked(env, detector: DeadlockDetector):
+    """
+    Checks with a deadlock detector kept up to date for the env whether all agents that still have to move are
+    blocked, only the agents that moved are checked again. Unlike check_if_all_blocked, only active agents block
+    and done agents are never movable.
+    :param env: current environment
+    :param detector: deadlock detector of the env
+    :return:
+    """
+    if detector.rail_env is not env:
+        detector.reset(env)
+    else:
+        detector.update()
+    return detector.all_blocked()
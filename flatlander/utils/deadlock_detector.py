@@ -0,0 +1,254 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from flatland.core.grid.grid4_utils import get_new_position
+from flatland.envs.agent_utils import RailAgentStatus, EnvAgent
+from flatland.envs.rail_env import RailEnv
+
+State = Tuple[Tuple[int, int], int]
+
+
+class DeadlockDetector:
+    """
+    Keeps the wait-for graph (which agent blocks which) of a rail env up to date.
+
+    update() only looks at the agents whose status, position or direction changed since the last update and at
+    the agents waiting on the cells they left or entered. Cells are occupied by active agents, like the rail env's
+    agent_positions.
+    """
+
+    def __init__(self, rail_env: Optional[RailEnv] = None):
+        self.rail_env = None
+        if rail_env is not None:
+            self.reset(rail_env)
+
+    def reset(self, rail_env: RailEnv):
+        self.rail_env = rail_env
+        self._agents = None
+        self._states: Dict[int, tuple] = {}
+        self._occupied: Dict[Tuple[int, int], int] = {}
+        # handle -> [(direction, cell)] of its possible moves, cell -> handles with a move onto the cell
+        self._moves: Dict[int, List[Tuple[int, Tuple[int, int]]]] = {}
+        self._watchers: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+        # handle -> agents on all of its next cells, None if the agent can move
+        self._blockers: Dict[int, Optional[List[int]]] = {}
+        self._movable: Set[int] = set()
+        # active agents with all next cells occupied
+        self._waiting: Set[int] = set()
+        # memo of the blocked train walks, invalidated through the cells they looked at
+        self._chain_memo: Dict[State, bool] = {}
+        self._chain_deps: Dict[Tuple[int, int], Set[State]] = defaultdict(set)
+        self._chain_prev: Dict[State, Set[State]] = defaultdict(set)
+        self._components = None
+        self.update()
+
+    def update(self, handles: Optional[List[int]] = None):
+        """
+        Refreshes the graph around the agents that changed, only `handles` are checked if given.
+        """
+        agents = self.rail_env.agents
+        if self._agents is not agents or len(self._states) != len(agents):
+            self._agents = agents
+            self._states, self._occupied, self._moves, self._blockers = {}, {}, {}, {}
+            self._watchers.clear()
+            self._movable.clear()
+            self._waiting.clear()
+            self._clear_chains()
+            handles = None
+
+        changed = []
+        for agent in (agents if handles is None else [agents[h] for h in handles]):
+            state = (agent.status, agent.position, agent.direction, self._virtual_position(agent))
+            if self._states.get(agent.handle, None) != state:
+                changed.append((agent.handle, state))
+        if len(changed) == 0:
+            return
+
+        changed_cells = set()
+        for handle, _ in changed:
+            old_state = self._states.get(handle, None)
+            if old_state is not None and old_state[1] is not None:
+                if self._occupied.get(old_state[1], None) == handle:
+                    del self._occupied[old_state[1]]
+                changed_cells.add(old_state[1])
+        for handle, state in changed:
+            self._states[handle] = state
+            if state[0] == RailAgentStatus.ACTIVE and state[1] is not None:
+                self._occupied[state[1]] = handle
+                changed_cells.add(state[1])
+
+        affected = {handle for handle, _ in changed}
+        for cell in changed_cells:
+            affected |= self._watchers.get(cell, set())
+            self._invalidate_chains(cell)
+        for handle in affected:
+            self._refresh_agent(handle)
+        self._components = None
+
+    def movable_agents(self) -> Set[int]:
+        """
+        Handles of the agents that are ready to depart or active and have at least one free next cell.
+        """
+        return self._movable
+
+    def all_blocked(self) -> bool:
+        return len(self._movable) == 0
+
+    def blocked_train(self, handle: int) -> bool:
+        """
+        Follows the agent's track (only cells with a single transition) through the agents in front of it and checks
+        whether it ends at an agent heading the other way, or runs in a circle of agents.
+        """
+        agent = self.rail_env.agents[handle]
+        return self._chain_blocked((agent.position, agent.direction))
+
+    def deadlocked_agents(self, handle: int) -> List[Optional[int]]:
+        """
+        Returns the agents per direction blocking the agent in a cycle of the wait-for graph (a head-on pair or a
+        circle of agents). Empty if the agent has a free move or is blocked by an agent outside its cycle.
+        """
+        blockers = self._blockers.get(handle, None)
+        if self._states[handle][0] != RailAgentStatus.ACTIVE or not blockers:
+            return []
+        components = self._strongly_connected_components()
+        component = components.get(handle, None)
+        if component is None or any(components.get(b, None) != component for b in blockers):
+            return []
+        deadlocked = [None] * 4
+        for (direction, _), blocker in zip(self._moves[handle], blockers):
+            deadlocked[direction] = blocker
+        return deadlocked
+
+    @staticmethod
+    def _virtual_position(agent: EnvAgent):
+        if agent.status == RailAgentStatus.READY_TO_DEPART:
+            return agent.initial_position
+        elif agent.status == RailAgentStatus.ACTIVE:
+            return agent.position
+        return None
+
+    def _refresh_agent(self, handle: int):
+        for _, cell in self._moves.get(handle, []):
+            self._watchers[cell].discard(handle)
+        status, _, direction, position = self._states[handle]
+        moves = []
+        if position is not None:
+            transitions = self.rail_env.rail.get_transitions(*position, direction)
+            moves = [(d, get_new_position(position, d)) for d in range(4) if transitions[d]]
+        self._moves[handle] = moves
+        for _, cell in moves:
+            self._watchers[cell].add(handle)
+
+        blockers = [self._occupied.get(cell, None) for _, cell in moves]
+        if position is not None and any(b is None for b in blockers):
+            self._blockers[handle] = None
+            self._movable.add(handle)
+        else:
+            self._blockers[handle] = blockers if position is not None else None
+            self._movable.discard(handle)
+        if self._blockers[handle] and status == RailAgentStatus.ACTIVE:
+            self._waiting.add(handle)
+        else:
+            self._waiting.discard(handle)
+
+    def _strongly_connected_components(self) -> Dict[int, int]:
+        """
+        Tarjan's algorithm on the blocked active agents, returns handle -> component for components of size > 1.
+        """
+        if self._components is not None:
+            return self._components
+        graph = {h: [b for b in self._blockers[h] if b in self._waiting] for h in self._waiting}
+        index, low, on_stack, stack = {}, {}, set(), []
+        components = {}
+        for root in graph:
+            if root in index:
+                continue
+            work = [(root, iter(graph[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, neighbors = work[-1]
+                pushed = False
+                for neighbor in neighbors:
+                    if neighbor not in graph:
+                        continue
+                    if neighbor not in index:
+                        index[neighbor] = low[neighbor] = len(index)
+                        stack.append(neighbor)
+                        on_stack.add(neighbor)
+                        work.append((neighbor, iter(graph[neighbor])))
+                        pushed = True
+                        break
+                    elif neighbor in on_stack:
+                        low[node] = min(low[node], index[neighbor])
+                if pushed:
+                    continue
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member == node:
+                            break
+                    if len(members) > 1:
+                        for member in members:
+                            components[member] = node
+        self._components = components
+        return components
+
+    def _chain_blocked(self, state: State) -> bool:
+        rail = self.rail_env.rail
+        agents = self.rail_env.agents
+        path = []
+        on_path = set()
+        blocked = False
+        while True:
+            if state in self._chain_memo:
+                blocked = self._chain_memo[state]
+                break
+            if state in on_path:
+                # circle of agents following each other
+                blocked = True
+                break
+            path.append(state)
+            on_path.add(state)
+            position, direction = state
+            transitions = rail.get_transitions(*position, direction)
+            if np.count_nonzero(transitions) != 1:
+                break
+            new_direction = int(np.argmax(transitions))
+            new_cell = get_new_position(position, new_direction)
+            self._chain_deps[new_cell].add(state)
+            opp_handle = self._occupied.get(new_cell, None)
+            if opp_handle is None:
+                break
+            opp = agents[opp_handle]
+            opp_transitions = rail.get_transitions(*opp.position, opp.direction)
+            if np.count_nonzero(opp_transitions) == 1 and opp.direction != direction:
+                blocked = True
+                break
+            next_state = (new_cell, new_direction)
+            self._chain_prev[next_state].add(state)
+            state = next_state
+
+        for state in path:
+            self._chain_memo[state] = blocked
+        return blocked
+
+    def _invalidate_chains(self, cell):
+        pending = list(self._chain_deps.pop(cell, ()))
+        while pending:
+            state = pending.pop()
+            if self._chain_memo.pop(state, None) is not None:
+                pending.extend(self._chain_prev.pop(state, ()))
+
+    def _clear_chains(self):
+        self._chain_memo.clear()
+        self._chain_deps.clear()
+        self._chain_prev.clear()
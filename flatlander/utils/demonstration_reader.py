@@ -0,0 +1,34 @@
+import numpy as np
+from ray.rllib.offline import InputReader, IOContext
+from ray.rllib.policy.sample_batch import SampleBatch
+
+from flatlander.utils.demonstrations import DemonstrationDataset
+
+
+class DemonstrationInputReader(InputReader):
+    """
+    RLlib input reader of a columnar demonstration dataset (use a dataset folder as "input" of an experiment).
+
+    Returns random minibatches of rollout_fragment_length transitions. With postprocess_inputs the transitions of
+    a random episode are returned instead, postprocessed by the default policy per agent.
+    """
+
+    def __init__(self, path: str, ioctx: IOContext = None, batch_size: int = None):
+        self.ioctx = ioctx or IOContext()
+        self.dataset = DemonstrationDataset(path)
+        self.batch_size = batch_size or self.ioctx.config.get('rollout_fragment_length', 200)
+        self._np_random = np.random.RandomState(self.ioctx.worker_index)
+
+    def next(self) -> SampleBatch:
+        if self.ioctx.config.get('postprocess_inputs'):
+            return self._next_episode()
+        return SampleBatch(self.dataset.sample(self.batch_size, self._np_random))
+
+    def _next_episode(self) -> SampleBatch:
+        eps_ids = self.dataset.eps_ids()
+        batch = self.dataset.get(self.dataset.episode_rows(eps_ids[self._np_random.randint(len(eps_ids))]))
+        policy = self.ioctx.worker.policy_map['default_policy']
+        return SampleBatch.concat_samples(
+            [policy.postprocess_trajectory(SampleBatch({name: values[batch['agent_index'] == agent]
+                                                        for name, values in batch.items()}))
+             for agent in np.unique(batch['agent_index'])])
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+SHARD_META_FILE = 'meta.json'
+MANIFEST_FILE = 'manifest.json'
+
+
+def demonstration_fields(obs_shape: Tuple[int, ...], obs_dtype=np.float32) -> Dict[str, Tuple[np.dtype, tuple]]:
+    """
+    Columns of a demonstration dataset: name -> (dtype, shape of one row).
+    """
+    obs_shape = tuple(int(s) for s in obs_shape)
+    return {
+        'obs': (np.dtype(obs_dtype), obs_shape),
+        'new_obs': (np.dtype(obs_dtype), obs_shape),
+        'actions': (np.dtype(np.int64), ()),
+        'rewards': (np.dtype(np.float32), ()),
+        'dones': (np.dtype(np.bool_), ()),
+        'agent_index': (np.dtype(np.int32), ()),
+        'eps_id': (np.dtype(np.int64), ()),
+        't': (np.dtype(np.int32), ()),
+        'action_prob': (np.dtype(np.float32), ()),
+    }
+
+
+def _fields_to_json(fields):
+    return {name: {'dtype': dtype.str, 'shape': list(shape)} for name, (dtype, shape) in fields.items()}
+
+
+def _fields_from_json(fields):
+    return {name: (np.dtype(f['dtype']), tuple(f['shape'])) for name, f in fields.items()}
+
+
+def _write_json(path: str, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class DemonstrationWriter:
+    """
+    Writes one shard of a columnar demonstration dataset, every field is appended to its own raw binary file. The
+    shard is written to a temporary directory and only shows up in the dataset once it is closed.
+    """
+
+    def __init__(self, path: str, shard: str, obs_shape: Tuple[int, ...], obs_dtype=np.float32,
+                 buffer_size: int = 1024):
+        self.path = path
+        self.shard = shard
+        self.fields = demonstration_fields(obs_shape, obs_dtype)
+        self.rows = 0
+        self._buffer_size = buffer_size
+        self._buffer = {name: [] for name in self.fields}
+        self._tmp_dir = os.path.join(path, '.tmp-' + shard)
+        if os.path.isdir(self._tmp_dir):
+            shutil.rmtree(self._tmp_dir)
+        os.makedirs(self._tmp_dir)
+        self._files = {name: open(os.path.join(self._tmp_dir, name + '.bin'), 'wb') for name in self.fields}
+
+    def add(self, **values):
+        """
+        Adds one transition, a value is required for every field.
+        """
+        for name in self.fields:
+            self._buffer[name].append(values[name])
+        if len(self._buffer['obs']) >= self._buffer_size:
+            self._flush()
+
+    def _flush(self):
+        self.rows += len(self._buffer['obs'])
+        for name, (dtype, shape) in self.fields.items():
+            values = np.asarray(self._buffer[name], dtype=dtype).reshape((-1,) + shape)
+            values.tofile(self._files[name])
+            self._buffer[name] = []
+
+    def close(self):
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        _write_json(os.path.join(self._tmp_dir, SHARD_META_FILE),
+                    {'rows': self.rows, 'fields': _fields_to_json(self.fields)})
+        shard_dir = os.path.join(self.path, self.shard)
+        if os.path.isdir(shard_dir):
+            shutil.rmtree(shard_dir)
+        os.rename(self._tmp_dir, shard_dir)
+
+    def discard(self):
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def build_index(path: str) -> dict:
+    """
+    Writes the index of the closed shards of a dataset and returns it.
+    """
+    fields, shards = None, []
+    for shard in sorted(os.listdir(path)):
+        meta_file = os.path.join(path, shard, SHARD_META_FILE)
+        if shard.startswith('.') or not os.path.isfile(meta_file):
+            continue
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if fields is None:
+            fields = meta['fields']
+        elif meta['fields'] != fields:
+            raise ValueError("Shard {} has different fields than the other shards of {}".format(shard, path))
+        shards.append({'name': shard, 'rows': meta['rows']})
+    index = {'fields': fields or {}, 'shards': shards, 'rows': sum(s['rows'] for s in shards)}
+    _write_json(os.path.join(path, INDEX_FILE), index)
+    return index
+
+
+def load_manifest(path: str) -> dict:
+    """
+    Completed shards of a dataset which is being converted: shard -> stats recorded when it was completed.
+    """
+    manifest_file = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: dict):
+    _write_json(os.path.join(path, MANIFEST_FILE), manifest)
+
+
+def is_shard_complete(path: str, shard: str, manifest: dict) -> bool:
+    return shard in manifest and os.path.isfile(os.path.join(path, shard, SHARD_META_FILE))
+
+
+def is_demonstration_dataset(path) -> bool:
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+class DemonstrationDataset:
+    """
+    Read only, memory mapped view of a demonstration dataset. Rows are indexed over all shards in index order.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        index_file = os.path.join(path, INDEX_FILE)
+        if os.path.isfile(index_file):
+            with open(index_file) as f:
+                index = json.load(f)
+        else:
+            index = build_index(path)
+        self.fields = _fields_from_json(index['fields'])
+        self._shards = []
+        offsets = [0]
+        for shard in index['shards']:
+            if shard['rows'] == 0:
+                continue
+            self._shards.append({name: np.memmap(os.path.join(path, shard['name'], name + '.bin'), dtype=dtype,
+                                                 mode='r', shape=(shard['rows'],) + shape)
+                                 for name, (dtype, shape) in self.fields.items()})
+            offsets.append(offsets[-1] + shard['rows'])
+        self._offsets = np.array(offsets, dtype=np.int64)
+        self._eps_ids = None
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def get(self, rows: Iterable[int], fields: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Gathers the given rows into arrays, reading every shard once.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        fields = self.fields.keys() if fields is None else fields
+        shard_indices = np.searchsorted(self._offsets, rows, side='right') - 1
+        batch = {name: np.empty((len(rows),) + self.fields[name][1], dtype=self.fields[name][0])
+                 for name in fields}
+        for shard_index in np.unique(shard_indices):
+            mask = shard_indices == shard_index
+            local_rows = rows[mask] - self._offsets[shard_index]
+            for name in batch:
+                batch[name][mask] = self._shards[shard_index][name][local_rows]
+        return batch
+
+    def sample(self, batch_size: int, np_random=np.random) -> Dict[str, np.ndarray]:
+        """
+        Random minibatch of rows, in dataset order to read the memory maps front to back.
+        """
+        return self.get(np.sort(np_random.randint(0, len(self), size=batch_size)))
+
+    def eps_ids(self) -> np.ndarray:
+        if self._eps_ids is None:
+            self._eps_ids = np.concatenate([shard['eps_id'] for shard in self._shards]) \
+                if self._shards else np.zeros(0, dtype=np.int64)
+        return self._eps_ids
+
+    def episode_rows(self, eps_id: int) -> np.ndarray:
+        return np.flatnonzero(self.eps_ids() == eps_id)
@@ -6,11 +6,7 @@ import types
 
 import gym
 import humps
-from ray.rllib import MultiAgentEnv
-from ray.rllib.models import ModelCatalog
-from ray.rllib.models.modelv2 import ModelV2
-from ray.rllib.models.tf.tf_modelv2 import TFModelV2
-from ray.tune import registry, register_env
+from ray.tune import registry
 
 """
 Helper functions
@@ -56,11 +52,51 @@ def load_class_from_file(_file_path):
     return filename, class_name, _class
 
 
+def _make_env_creator(_file_path):
+    """
+    Env creator which loads the env class from the file on its first call, so that registering the
+    envs imports none of them.
+    """
+    env_cls = []
+
+    def env_creator(config):
+        from ray.rllib import MultiAgentEnv, BaseEnv
+        if len(env_cls) == 0:
+            _, class_name, _class = load_class_from_file(_file_path)
+            if not issubclass(_class, (gym.Env, MultiAgentEnv, BaseEnv)):
+                raise Exception("We expected the class named {} to be "
+                                "a subclass of either gym.Env, ray.rllib.MultiAgentEnv or ray.rllib.BaseEnv. "
+                                "Please read more here : https://ray.readthedocs.io/en/latest/rllib-env.html"
+                                .format(class_name))
+            env_cls.append(_class)
+        return env_cls[0](config)
+
+    return env_creator
+
+
+def custom_model_names(config) -> set:
+    """
+    Returns the names of the custom models used anywhere in the (experiment) config.
+    """
+    names = set()
+    if isinstance(config, dict):
+        for key, value in config.items():
+            if key == "custom_model" and isinstance(value, str):
+                names.add(value)
+            else:
+                names |= custom_model_names(value)
+    elif isinstance(config, (list, tuple)):
+        for value in config:
+            names |= custom_model_names(value)
+    return names
+
+
 def load_envs(local_dir="."):
     """
     This function takes a path to a local directory
-    and looks for an `envs` folder, and imports
-    all the available files in there.
+    and looks for an `envs` folder, and registers
+    all the available files in there. The files
+    are only imported when the env is created.
 
     Determine the filename, env_name and class_name
 
@@ -76,26 +112,19 @@ def load_envs(local_dir="."):
             local_dir, "..", "envs", "*.py")):
         if "__init__" in _file_path:
             continue
-        env_name, class_name, _class = load_class_from_file(_file_path)
-        env = _class
-
-        if not issubclass(env, gym.Env) and not issubclass(env, MultiAgentEnv):
-            raise Exception("We expected the class named {} to be "
-                            "a subclass of either gym.Env or ray.rllib.MultiAgentEnv. "
-                            "Please read more here : https://ray.readthedocs.io/en/latest/rllib-env.html"
-                            .format(class_name))
-
-        registry.register_env(env_name, lambda config: env(config))
+        env_name = os.path.basename(_file_path).replace(".py", "")
+        registry.register_env(env_name, _make_env_creator(_file_path))
         load_count += 1
 
-    print("- Successfully loaded", load_count, "environment classes")
+    print("- Successfully registered", load_count, "environment classes")
 
 
-def load_models(local_dir="."):
+def load_models(local_dir=".", names=None):
     """
     This function takes a path to a local directory
     and looks for a `models` folder, and imports
-    all the available files in there.
+    all the available files in there, only the
+    models in `names` if given.
 
     Determine the filename, env_name and class_name
 
@@ -107,11 +136,17 @@ def load_models(local_dir="."):
         of TFModelV2 (ModelV2 : Added PyTorch Model support too,
                       Model: Added Custom loss Model support)
     """
+    from ray.rllib.models import ModelCatalog
+    from ray.rllib.models.modelv2 import ModelV2
+    from ray.rllib.models.tf.tf_modelv2 import TFModelV2
+
     load_count = 0
     for _file_path in glob.glob(os.path.join(
             local_dir, "..", "models", "*.py")):
         if "__init__" in _file_path:
             continue
+        if names is not None and os.path.basename(_file_path).replace(".py", "") not in names:
+            continue
         model_name, class_name, _class = load_class_from_file(_file_path)
         custom_model = _class
 
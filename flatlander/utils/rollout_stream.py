@@ -0,0 +1,116 @@
+import glob
+import os
+import pickle
+import queue
+import struct
+import threading
+import zlib
+
+# episode, chunk index, last chunk of the episode, compressed size
+_CHUNK_HEADER = struct.Struct('<qi?q')
+
+
+def _empty_chunk(save_info: bool):
+    columns = ['obs', 'actions', 'next_obs', 'rewards', 'dones'] + (['infos'] if save_info else [])
+    return {column: [] for column in columns}
+
+
+class RolloutStreamWriter:
+    """
+    Streams rollouts to a folder of compressed segment files. The steps of an episode are collected in chunks of
+    chunk_size steps, a full chunk is handed to a background thread through a bounded queue, which pickles,
+    compresses and appends it to the current segment. Segments of an earlier stream in the folder are removed.
+    Read the stream with iter_rollout_stream.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 256, max_queue_size: int = 4, save_info: bool = False,
+                 segment_size: int = 256 * 1024 * 1024, compress_level: int = 1):
+        os.makedirs(path, exist_ok=True)
+        for segment in glob.glob(os.path.join(path, 'segment-*.bin')):
+            os.remove(segment)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.save_info = save_info
+        self.segment_size = segment_size
+        self.compress_level = compress_level
+        self._episode = 0
+        self._chunk_index = 0
+        self._chunk = _empty_chunk(save_info)
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self._thread.start()
+
+    def begin_episode(self, episode: int):
+        self._episode = episode
+        self._chunk_index = 0
+        self._chunk = _empty_chunk(self.save_info)
+
+    def append(self, obs, action, next_obs, reward, done, info=None):
+        values = [obs, action, next_obs, reward, done] + ([info] if self.save_info else [])
+        for column, value in zip(self._chunk.values(), values):
+            column.append(value)
+        if len(self._chunk['obs']) >= self.chunk_size:
+            self._put(last=False)
+
+    def end_episode(self):
+        self._put(last=True)
+
+    def _put(self, last: bool):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((self._episode, self._chunk_index, last, self._chunk))
+        self._chunk_index += 1
+        self._chunk = _empty_chunk(self.save_info)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _write_chunks(self):
+        segment = 0
+        f = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                episode, chunk_index, last, chunk = item
+                data = zlib.compress(pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL), self.compress_level)
+                if f is None or f.tell() >= self.segment_size:
+                    if f is not None:
+                        f.close()
+                    f = open(os.path.join(self.path, 'segment-{:05d}.bin'.format(segment)), 'wb')
+                    segment += 1
+                f.write(_CHUNK_HEADER.pack(episode, chunk_index, last, len(data)))
+                f.write(data)
+        except Exception as e:
+            self._error = e
+            # keep draining, the producer must not block on a full queue
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if f is not None:
+                f.close()
+
+
+def iter_rollout_stream(path: str):
+    """
+    Lazily yields the (episode, step) of a rollout stream, only one chunk is decompressed at a time. Steps are
+    [obs, action, next_obs, reward, done] (and info if it was saved), a truncated last chunk is skipped.
+    """
+    for segment in sorted(glob.glob(os.path.join(path, 'segment-*.bin'))):
+        with open(segment, 'rb') as f:
+            while True:
+                header = f.read(_CHUNK_HEADER.size)
+                if len(header) < _CHUNK_HEADER.size:
+                    break
+                episode, _, _, size = _CHUNK_HEADER.unpack(header)
+                data = f.read(size)
+                if len(data) < size:
+                    break
+                chunk = pickle.loads(zlib.decompress(data))
+                for step in zip(*chunk.values()):
+                    yield episode, list(step)
@@ -1,17 +1,9 @@
-import os
-
 from flatlander.agents.heuristic_agent import HeuristicPriorityAgent
 from flatlander.envs.observations.conflict_piority_shortest_path_obs import ConflictPriorityShortestPathObservation
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-# os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
-
-import tensorflow as tf
-
 from flatland.evaluators.client import FlatlandRemoteClient
 from flatlander.submission.helper import episode_start_info, episode_end_info
 
-tf.compat.v1.disable_eager_execution()
 remote_client = FlatlandRemoteClient()
 
 TUNE = False